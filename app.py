@@ -1,10 +1,41 @@
 import streamlit as st
-import requests
-import json
 import time
 import os
+import re
+import math
+import threading
+from concurrent.futures import Future, wait
 from dotenv import load_dotenv
 
+from spo_plus import (
+    AsyncLLMService,
+    Cassette,
+    EventBus,
+    EventQueue,
+    LLMService,
+    OptimizationEngine,
+    OptimizationState,
+    RenderCoalescer,
+    ResilientCaller,
+    RetryPolicy,
+    StreamBuffer,
+    get_background_loop,
+    get_judgment_cache,
+    get_response_cache,
+    get_run_store,
+    get_worker,
+    start_worker,
+)
+from spo_plus.prompts import verdict_label
+from spo_plus.parallel import DEFAULT_MAX_CONCURRENCY
+from spo_plus.context import CONTEXT_TOKEN_BUDGET
+from spo_plus.render import RENDER_INTERVAL
+from spo_plus.runlog import export_lines
+from spo_plus.sequential import ADAPTIVE_MODES
+from spo_plus.tracing import Tracer, waterfall_rows
+from spo_plus.usage import Budget, UsageMeter, add_usage, format_usage, total_tokens
+from spo_plus.worker import ACTIVE_STATUSES, active_workers
+
 # 加载环境变量
 load_dotenv()
 
@@ -22,179 +53,18 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# 自定义CSS
-st.markdown("""
-<style>
-    /* 现代化设计 */
-    .main-header {
-        font-size: 2.5rem;
-        margin-bottom: 1rem;
-        font-weight: 600;
-        color: #1E3A8A;
-    }
-    .sub-header {
-        font-size: 1.5rem;
-        margin-bottom: 1rem;
-        font-weight: 500;
-        color: #2563EB;
-    }
-    
-    /* 卡片式设计 */
-    .card {
-        background-color: #FFFFFF;
-        border-radius: 0.75rem;
-        padding: 1.5rem;
-        margin-bottom: 1.5rem;
-        box-shadow: 0 4px 6px -1px rgba(0, 0, 0, 0.1), 0 2px 4px -1px rgba(0, 0, 0, 0.06);
-        transition: all 0.3s ease;
-    }
-    .card:hover {
-        box-shadow: 0 10px 15px -3px rgba(0, 0, 0, 0.1), 0 4px 6px -2px rgba(0, 0, 0, 0.05);
-    }
-    
-    /* 更好的输出容器 */
-    .output-container {
-        background-color: #F9FAFB;
-        border-radius: 0.75rem;
-        padding: 1.2rem;
-        margin-bottom: 1rem;
-        border-left: 4px solid #E5E7EB;
-        font-family: 'Roboto Mono', monospace;
-    }
-    
-    /* 评估结果颜色 */
-    .better {
-        border-left: 4px solid #10B981;
-        background-color: #ECFDF5;
-    }
-    .worse {
-        border-left: 4px solid #EF4444;
-        background-color: #FEF2F2;
-    }
-    .similar {
-        border-left: 4px solid #F59E0B;
-        background-color: #FFFBEB;
-    }
-    
-    /* 历史记录项 */
-    .history-item {
-        padding: 0.75rem;
-        margin-bottom: 0.75rem;
-        border-radius: 0.5rem;
-        background-color: #F9FAFB;
-        transition: all 0.2s ease;
-    }
-    .history-item:hover {
-        background-color: #F3F4F6;
-    }
-    .history-item.better {
-        border-left: 4px solid #10B981;
-    }
-    .history-item.not-better {
-        border-left: 4px solid #EF4444;
-    }
-    
-    /* 提示和引导 */
-    .guide-box {
-        background-color: #EFF6FF;
-        border: 1px solid #DBEAFE;
-        border-radius: 0.5rem;
-        padding: 1rem;
-        margin-bottom: 1.2rem;
-        color: #1E40AF;
-    }
-    .tip-box {
-        background-color: #ECFDF5;
-        border: 1px solid #D1FAE5;
-        border-radius: 0.5rem;
-        padding: 1rem;
-        margin-bottom: 1.2rem;
-        color: #065F46;
-    }
-    
-    /* 更好的按钮 */
-    .stButton>button {
-        border-radius: 0.5rem !important;
-        font-weight: 500 !important;
-        transition: all 0.2s !important;
-    }
-    
-    /* 流式输出区域 */
-    .stream-output {
-        background-color: #F8FAFC;
-        border-radius: 0.5rem;
-        padding: 1rem;
-        margin-top: 0.5rem;
-        border-left: 3px solid #3B82F6;
-        min-height: 100px;
-        font-family: 'Roboto Mono', monospace;
-        white-space: pre-wrap;
-        animation: pulse 2s infinite;
-    }
-    @keyframes pulse {
-        0% {
-            border-color: #3B82F6;
-        }
-        50% {
-            border-color: #60A5FA;
-        }
-        100% {
-            border-color: #3B82F6;
-        }
-    }
-    
-    /* 步骤指示器 */
-    .step-container {
-        display: flex;
-        justify-content: space-between;
-        margin-bottom: 2rem;
-        position: relative;
-    }
-    .step-container::before {
-        content: "";
-        position: absolute;
-        top: 15px;
-        left: 0;
-        right: 0;
-        height: 2px;
-        background-color: #E5E7EB;
-        z-index: 1;
-    }
-    .step {
-        background-color: #FFFFFF;
-        border: 2px solid #E5E7EB;
-        border-radius: 50%;
-        width: 30px;
-        height: 30px;
-        display: flex;
-        align-items: center;
-        justify-content: center;
-        font-weight: bold;
-        color: #6B7280;
-        position: relative;
-        z-index: 2;
-    }
-    .step.active {
-        background-color: #3B82F6;
-        border-color: #3B82F6;
-        color: white;
-    }
-    .step.completed {
-        background-color: #10B981;
-        border-color: #10B981;
-        color: white;
-    }
-    .step-label {
-        position: absolute;
-        top: 35px;
-        font-size: 0.8rem;
-        color: #6B7280;
-        text-align: center;
-        width: 80px;
-        left: -25px;
-    }
-</style>
-""", unsafe_allow_html=True)
+# 自定义CSS：样式表在static/app.css中。缓存的只是文件读取和压缩（每个进程一次），
+# <style>标签每次rerun仍要重新输出：Streamlit会清除本次rerun没有输出的元素，只注入一次的样式在下次rerun时就会丢失
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+
+@st.cache_resource
+def load_css(name="app.css"):
+    """读取并压缩样式表，返回<style>标签"""
+    with open(os.path.join(STATIC_DIR, name), "r", encoding="utf-8") as f:
+        css = re.sub(r"/\*.*?\*/", "", f.read(), flags=re.S)
+    return f"<style>{' '.join(css.split())}</style>"
+
+st.markdown(load_css(), unsafe_allow_html=True)
 
 # 初始化会话状态
 if 'initialized' not in st.session_state:
@@ -203,6 +73,7 @@ if 'initialized' not in st.session_state:
     st.session_state.current_view = "config"
     st.session_state.current_iteration = 0
     st.session_state.max_iterations = 10
+    st.session_state.max_concurrency = DEFAULT_MAX_CONCURRENCY
     st.session_state.samples = []
     st.session_state.current_best_prompt = ""
     st.session_state.current_best_outputs = {}
@@ -211,207 +82,11 @@ if 'initialized' not in st.session_state:
     st.session_state.evaluations = {}
     st.session_state.analysis = ""
     st.session_state.optimization_history = []
+    st.session_state.usage = {}
+    st.session_state.stop_reason = ""
     st.session_state.is_optimizing = False
     st.session_state.available_models = []
 
-# 新增LLM服务类，用于替代Express后端
-class LLMService:
-    def __init__(self, api_key=None, base_url=None):
-        self.api_key = api_key
-        self.base_url = base_url or os.getenv("DEFAULT_API_BASE_URL", "https://api.siliconflow.cn")
-    
-    def get_headers(self):
-        headers = {"Content-Type": "application/json"}
-        if self.api_key:
-            headers["Authorization"] = f"Bearer {self.api_key}"
-        return headers
-    
-    def call_llm_api(self, endpoint, data):
-        try:
-            response = requests.post(
-                f"{self.base_url}/{endpoint}", 
-                json=data, 
-                headers=self.get_headers()
-            )
-            response.raise_for_status()
-            return response.json()
-        except Exception as e:
-            raise Exception(f"LLM API调用失败: {str(e)}")
-    
-    def call_llm_api_stream(self, endpoint, data):
-        """流式调用LLM API"""
-        try:
-            # 确保设置stream为True
-            data["stream"] = True
-            
-            response = requests.post(
-                f"{self.base_url}/{endpoint}", 
-                json=data, 
-                headers=self.get_headers(),
-                stream=True  # 设置requests为流式请求
-            )
-            response.raise_for_status()
-            return response
-        except Exception as e:
-            raise Exception(f"流式API调用失败: {str(e)}")
-    
-    def generate_samples(self, task_description):
-        # 实现样本生成
-        prompt = f"""请为以下任务生成5个测试样例，每个样例应包含问题和期望的回答标准：
-        
-任务描述：{task_description}
-
-请返回JSON格式：
-[
-    {{"question": "问题1", "expected": "期望标准1"}},
-    ...
-]
-"""
-        response = self.call_llm_api("v1/chat/completions", {
-            "model": "deepseek-ai/DeepSeek-V3",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.7
-        })
-        
-        try:
-            content = response.get("choices", [{}])[0].get("message", {}).get("content", "")
-            # 提取JSON部分
-            json_str = content[content.find("["):content.rfind("]")+1]
-            samples = json.loads(json_str)
-            # 给每个样本添加ID
-            for i, sample in enumerate(samples):
-                sample['id'] = i + 1
-            return samples
-        except:
-            # 如果解析失败，返回简化版样本
-            return [
-                {"question": "示例问题1", "expected": "期望回答标准1"},
-                {"question": "示例问题2", "expected": "期望回答标准2"}
-            ]
-    
-    def execute_prompt(self, prompt, question):
-        """执行提示词获取输出"""
-        full_prompt = f"{prompt}\n\n{question}"
-        response = self.call_llm_api("v1/chat/completions", {
-            "model": "deepseek-ai/DeepSeek-V3",
-            "messages": [{"role": "user", "content": full_prompt}],
-            "temperature": 0.3
-        })
-        return response.get("choices", [{}])[0].get("message", {}).get("content", "")
-    
-    def execute_prompt_stream(self, prompt, question, callback):
-        """带流式输出的执行提示词"""
-        full_prompt = f"{prompt}\n\n{question}"
-        response = self.call_llm_api_stream("v1/chat/completions", {
-            "model": "deepseek-ai/DeepSeek-V3",
-            "messages": [{"role": "user", "content": full_prompt}],
-            "temperature": 0.3
-        })
-        
-        # 累积完整响应
-        full_response = ""
-        
-        # 处理流式响应
-        for line in response.iter_lines():
-            if line:
-                line = line.decode('utf-8')
-                if line.startswith('data: '):
-                    data = line[6:]  # 移除 "data: " 前缀
-                    if data == "[DONE]":
-                        break
-                    
-                    try:
-                        json_data = json.loads(data)
-                        delta = json_data.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                        if delta:
-                            full_response += delta
-                            callback(delta, full_response)  # 回调函数处理每个增量
-                    except json.JSONDecodeError:
-                        continue
-        
-        return full_response
-    
-    def optimize_prompt(self, current_prompt, current_output, task_description, history=""):
-        """优化提示词"""
-        prompt = f"""请优化以下提示词，使其更有效地完成任务：
-
-任务描述：{task_description}
-
-当前提示词：
-{current_prompt}
-
-当前输出示例：
-{current_output}
-
-优化历史：
-{history}
-
-请直接返回优化后的完整提示词，不要有其他解释。"""
-        
-        response = self.call_llm_api("v1/chat/completions", {
-            "model": "deepseek-ai/DeepSeek-V3",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.7
-        })
-        return response.get("choices", [{}])[0].get("message", {}).get("content", "")
-    
-    def evaluate_outputs(self, output_a, output_b, task_description, question):
-        """评估输出质量"""
-        prompt = f"""请评估以下两个输出，哪一个更好地完成了任务：
-
-任务描述：{task_description}
-
-问题：{question}
-
-输出A：
-{output_a}
-
-输出B：
-{output_b}
-
-请给出详细评估，并明确指出哪个更好（A、B或相似）："""
-        
-        response = self.call_llm_api("v1/chat/completions", {
-            "model": "deepseek-ai/DeepSeek-V3",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.3
-        })
-        result = response.get("choices", [{}])[0].get("message", {}).get("content", "")
-        
-        # 简单解析结果
-        if "输出A更好" in result or "A更好" in result:
-            winner = "A"
-        elif "输出B更好" in result or "B更好" in result:
-            winner = "B"
-        else:
-            winner = "similar"
-            
-        return {
-            "details": result,
-            "winner": winner
-        }
-    
-    def analyze_changes(self, old_prompt, new_prompt, task_description):
-        """分析提示词变化"""
-        prompt = f"""请分析以下提示词的变化，并解释这些变化如何提升了提示词的效果：
-
-任务描述：{task_description}
-
-旧提示词：
-{old_prompt}
-
-新提示词：
-{new_prompt}
-
-请详细说明："""
-        
-        response = self.call_llm_api("v1/chat/completions", {
-            "model": "deepseek-ai/DeepSeek-V3",
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.5
-        })
-        return response.get("choices", [{}])[0].get("message", {}).get("content", "")
-
 # 获取可用模型列表
 def get_available_models():
     # 仅返回DeepSeek系列模型
@@ -423,10 +98,34 @@ def get_available_models():
 # 调用API函数已不再需要，因为使用LLMService类直接调用
 
 # 配置API
-def configure_api(api_key, base_url, models):
+def configure_api(api_key, base_url, models, use_cache=True, hedge=False):
     try:
+        # 设置了LLM_CASSETTE时录制或回放API调用，两个服务共用同一个录制文件；
+        # 命中缓存的请求不会被录制，回放时也不能让缓存代替录制的响应
+        cassette = Cassette.from_env()
+        use_cache = use_cache and cassette is None
+        # 响应缓存在进程内共享，重启优化或重复测试相同提示词时直接复用
+        response_cache = get_response_cache() if use_cache else None
+        judgment_cache = get_judgment_cache() if use_cache else None
+        # 同步与异步服务共用一个事件总线，界面只需订阅一次
+        events = EventBus()
+        # 重试/对冲策略和各角色的延迟统计也在两个服务之间共享
+        resilience = ResilientCaller(RetryPolicy.from_env(hedge=hedge))
         # 创建LLMService实例并保存在会话状态中
-        st.session_state.llm_service = LLMService(api_key=api_key, base_url=base_url)
+        st.session_state.llm_service = LLMService(
+            api_key=api_key, base_url=base_url,
+            response_cache=response_cache, judgment_cache=judgment_cache, models=models, events=events,
+            resilience=resilience, cassette=cassette
+        )
+        st.session_state.async_llm_service = AsyncLLMService(
+            api_key=api_key, base_url=base_url,
+            response_cache=response_cache, judgment_cache=judgment_cache, models=models, events=events,
+            resilience=resilience, cassette=cassette
+        )
+        # 两个服务的API用量都发布到同一总线，按迭代取走写入历史记录
+        st.session_state.usage_meter = UsageMeter(events)
+        # 记录各阶段、渲染和每次API调用的耗时，用于瀑布图和Chrome trace导出
+        st.session_state.tracer = Tracer(events)
         # 保存API配置信息
         st.session_state.api_key = api_key
         st.session_state.base_url = base_url
@@ -436,23 +135,6 @@ def configure_api(api_key, base_url, models):
         st.error(f"API配置失败: {str(e)}")
         return False
 
-# 生成测试样本
-def generate_samples(task_description):
-    try:
-        # 直接使用LLMService实例
-        if "llm_service" in st.session_state:
-            samples = st.session_state.llm_service.generate_samples(task_description)
-            # 给每个样本添加ID
-            for i, sample in enumerate(samples):
-                sample['id'] = i + 1
-            return samples
-        else:
-            st.error("请先配置API")
-            return []
-    except Exception as e:
-        st.error(f"生成样本失败: {str(e)}")
-        return []
-
 # 执行提示词
 def execute_prompt(prompt, question, use_stream=False):
     try:
@@ -462,14 +144,17 @@ def execute_prompt(prompt, question, use_stream=False):
                 # 创建一个空的占位符用于显示流式输出
                 output_placeholder = st.empty()
                 
-                # 定义回调函数处理流式输出
-                def stream_callback(delta, full_response):
-                    output_placeholder.markdown(full_response)
+                # 按时间窗口合并增量，避免每段增量都重绘整段markdown
+                coalescer = RenderCoalescer(output_placeholder.markdown)
                 
-                # 调用流式API
-                return st.session_state.llm_service.execute_prompt_stream(
-                    prompt, question, stream_callback
-                )
+                # 调用流式API，结束时补上最后一次渲染
+                service = st.session_state.llm_service
+                with EventQueue(service.events, types={"llm_call"}) as calls:
+                    try:
+                        return service.execute_prompt_stream(prompt, question, coalescer)
+                    finally:
+                        coalescer.flush()
+                        show_render_stats(coalescer, calls.drain())
             else:
                 # 使用原有的非流式API
                 return st.session_state.llm_service.execute_prompt(prompt, question)
@@ -480,184 +165,438 @@ def execute_prompt(prompt, question, use_stream=False):
         st.error(f"执行提示词失败: {str(e)}")
         return ""
 
-# 优化提示词
-def optimize_prompt(current_prompt, current_output, task_description, history=""):
-    try:
-        # 直接使用LLMService实例
-        if "llm_service" in st.session_state:
-            return st.session_state.llm_service.optimize_prompt(
-                current_prompt, 
-                current_output, 
-                task_description, 
-                history
-            )
-        else:
-            st.error("请先配置API")
-            return ""
-    except Exception as e:
-        st.error(f"优化提示词失败: {str(e)}")
-        return ""
+# 显示流式输出的渲染次数与token数
+def show_render_stats(coalescer, call_events, container=st):
+    stats = coalescer.stats()
+    usage = next((event.data["usage"] for event in call_events if event.data.get("usage")), None)
+    if usage and usage.get("completion_tokens"):
+        tokens = f"{usage['completion_tokens']} tokens"
+    else:
+        tokens = f"{stats['chars']} 字"
+    container.caption(f"渲染 {stats['renders']} 次 / 输出 {tokens}（{stats['deltas']} 个数据块）")
 
-# 评估输出
-def evaluate_outputs(output_a, output_b, task_description, question):
-    try:
-        # 直接使用LLMService实例
-        if "llm_service" in st.session_state:
-            result = st.session_state.llm_service.evaluate_outputs(
-                output_a, 
-                output_b, 
-                task_description, 
-                question
-            )
-            # 根据winner判断返回的结果
-            if result['winner'] == 'A':
-                return "A更好"
-            elif result['winner'] == 'B':
-                return "B更好"
-            else:
-                return "相似"
-        else:
-            st.error("请先配置API")
-            return "相似"
-    except Exception as e:
-        st.error(f"评估输出失败: {str(e)}")
-        return "相似"
+# 运行累计用量加上当前未完成迭代中已发生的调用
+def current_usage():
+    worker = current_worker()
+    if worker is not None and worker.active:
+        return worker.snapshot()["usage"]
+    usage = st.session_state.get('usage') or {}
+    meter = st.session_state.get('usage_meter')
+    if meter and st.session_state.get('is_optimizing'):
+        return add_usage(usage, meter.peek())
+    return usage
 
-# 分析提示变化
-def analyze_changes(old_prompt, new_prompt, task_description):
-    try:
-        # 直接使用LLMService实例
-        if "llm_service" in st.session_state:
-            return st.session_state.llm_service.analyze_changes(
-                old_prompt, 
-                new_prompt, 
-                task_description
-            )
-        else:
-            st.error("请先配置API")
-            return ""
-    except Exception as e:
-        st.error(f"分析提示变化失败: {str(e)}")
-        return ""
+def budget_text():
+    parts = []
+    if st.session_state.get('max_tokens'):
+        parts.append(f"{st.session_state.max_tokens} tokens")
+    if st.session_state.get('max_cost'):
+        parts.append(f"¥{st.session_state.max_cost:.2f}")
+    return f"（预算 {' / '.join(parts)}）" if parts else ""
+
+# 按角色的用量明细表
+def usage_table(usage):
+    return [
+        {
+            "角色": role,
+            "模型": item.get("model", ""),
+            "调用": item["calls"],
+            "输入tokens": item["prompt_tokens"],
+            "缓存命中": item["cached_tokens"],
+            "输出tokens": item["completion_tokens"],
+            "费用(元)": round(item["cost"], 4),
+            "平均耗时(s)": round(item["latency"] / item["calls"], 2) if item["calls"] else 0.0,
+        }
+        for role, item in usage.get("by_role", {}).items()
+    ]
+
+# 优化历史每页显示的迭代数；每次rerun只生成当前页的展开框和文本框，历史再长重绘耗时也不变
+HISTORY_PAGE_SIZE = int(os.getenv("SPO_HISTORY_PAGE_SIZE", "10"))
 
-# 执行当前最佳提示词
-def run_current_best_prompt():
-    outputs = {}
+def history_page(history, key):
+    """返回当前页的历史记录，最新的迭代在第1页；超过一页时显示页码"""
+    pages = max(1, math.ceil(len(history) / HISTORY_PAGE_SIZE))
+    page = 1
+    if pages > 1:
+        # 页数变化（新的迭代完成）时控件重置，回到最新的一页
+        page = st.number_input(
+            f"页码（共 {pages} 页 / {len(history)} 次迭代，最新的在前）",
+            min_value=1, max_value=pages, value=1, step=1, key=f"{key}_history_page"
+        )
+    start = (page - 1) * HISTORY_PAGE_SIZE
+    return history[::-1][start:start + HISTORY_PAGE_SIZE]
+
+# 每次迭代是否改进的柱状图，历史记录只追加，按每次迭代的结果缓存，rerun时不重复构建DataFrame和图表
+@st.cache_resource(max_entries=16)
+def improvement_chart(improved):
+    import pandas as pd
+    import altair as alt
+    
+    df = pd.DataFrame({
+        '迭代': list(range(1, len(improved) + 1)),
+        '是否改进': [1 if item else 0 for item in improved]
+    })
     
-    with st.spinner("正在执行当前提示词..."):
-        for sample in st.session_state.samples:
-            output = execute_prompt(st.session_state.current_best_prompt, sample['question'])
-            outputs[sample['id']] = output
+    base = alt.Chart(df).encode(
+        x=alt.X('迭代:O', axis=alt.Axis(title='迭代次数')),
+        y=alt.Y('是否改进:Q', axis=alt.Axis(title='改进状态'))
+    )
     
-    st.session_state.current_best_outputs = outputs
-    return outputs
+    return base.mark_bar(color='#3B82F6').encode(
+        color=alt.condition(
+            alt.datum['是否改进'] == 1,
+            alt.value('#10B981'),  # 成功改进
+            alt.value('#EF4444')   # 未改进
+        )
+    )
 
-# 获取优化历史摘要
-def get_optimization_history_summary():
-    if not st.session_state.optimization_history:
-        return ""
+# 之后的追踪span归入即将开始的迭代
+def begin_trace_iteration(state):
+    if "tracer" in st.session_state:
+        st.session_state.tracer.begin_iteration(state.current_iteration + 1)
+
+# 每次迭代的耗时瀑布图：界面步骤、引擎阶段、逐样本执行/评估、API调用和缓存命中
+def show_trace_waterfall(key):
+    # 后台运行的追踪记录在启动它的会话的tracer中，其他标签页也能查看
+    worker = current_worker()
+    tracer = (worker and worker.tracer) or st.session_state.get('tracer')
+    iterations = tracer.iterations() if tracer else []
+    if not iterations:
+        return
     
-    # 只取最近3次迭代的历史
-    recent_history = st.session_state.optimization_history[-3:]
+    import pandas as pd
+    import altair as alt
     
-    return "\n".join([
-        f"迭代{item['iteration']}: {'改进成功' if item['is_better'] else '未改进'}"
-        for item in recent_history
-    ])
+    st.markdown("<h2 class='sub-header'>耗时瀑布图</h2>", unsafe_allow_html=True)
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    iteration = st.selectbox(
+        "迭代",
+        options=iterations[::-1],
+        format_func=lambda i: "初始化" if i == 0 else f"迭代 {i}",
+        key=f"{key}_trace_iteration"
+    )
+    rows = waterfall_rows(tracer.iteration_spans(iteration))
+    chart = alt.Chart(pd.DataFrame(rows)).mark_bar().encode(
+        x=alt.X('start:Q', axis=alt.Axis(title='秒')),
+        x2='end:Q',
+        y=alt.Y('row:N', sort=None, axis=alt.Axis(title=None, labelLimit=320)),
+        color=alt.Color('category:N', legend=alt.Legend(title='类别')),
+        tooltip=['row', 'category', 'duration', 'details']
+    ).properties(height=max(120, 18 * len(rows)))
+    st.altair_chart(chart, use_container_width=True)
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button(
+            label="⏱️ 导出本次迭代的Chrome trace",
+            data=tracer.export(iteration),
+            file_name=f"spo-plus-trace-{iteration}.json",
+            mime="application/json",
+            key=f"{key}_trace_iteration_export",
+            use_container_width=True
+        )
+    with col2:
+        st.download_button(
+            label="⏱️ 导出全部Chrome trace",
+            data=tracer.export(),
+            file_name="spo-plus-trace.json",
+            mime="application/json",
+            key=f"{key}_trace_export",
+            use_container_width=True
+        )
+    st.caption("trace文件可在 chrome://tracing 或 https://ui.perfetto.dev 中打开")
+    st.markdown('</div>', unsafe_allow_html=True)
 
-# 判断是否应该更新最佳提示
-def should_update_best_prompt(evaluations):
-    better_count = 0
-    worse_count = 0
-    
-    for sample_id, result in evaluations.items():
-        if result == "B更好":
-            better_count += 1
-        elif result == "A更好":
-            worse_count += 1
-    
-    # 如果有更多样本认为新提示更好，则更新
-    return better_count > worse_count
+# 会话状态与引擎状态互相转换，界面只负责展示
+def load_engine_state():
+    return OptimizationState.from_dict(st.session_state)
 
-# 运行优化步骤
-def run_optimization_step():
-    if st.session_state.current_iteration >= st.session_state.max_iterations:
-        st.session_state.is_optimizing = False
+def save_engine_state(state):
+    for key, value in state.to_dict().items():
+        st.session_state[key] = value
+
+def get_engine(usage=None):
+    # 工作线程中不能访问st.session_state，引擎持有服务实例本身
+    run_id = st.session_state.get('run_id')
+    return OptimizationEngine(
+        st.session_state.llm_service,
+        max_concurrency=st.session_state.get('max_concurrency', DEFAULT_MAX_CONCURRENCY),
+        beam_width=st.session_state.get('beam_width', 1),
+        adaptive_eval=st.session_state.get('adaptive_eval', "off"),
+        batch_judging=st.session_state.get('batch_judging', False),
+        context_budget=st.session_state.get('context_budget'),
+        budget=Budget(max_tokens=st.session_state.get('max_tokens') or 0,
+                      max_cost=st.session_state.get('max_cost') or 0.0),
+        usage=usage or st.session_state.get('usage_meter'),
+        checkpoints=get_run_store().run(run_id) if run_id else None
+    )
+
+# 随运行一起保存的界面设置，重新打开运行时恢复
+RUN_SETTINGS = ("max_concurrency", "beam_width", "adaptive_eval", "batch_judging", "context_budget", "max_tokens",
+                "max_cost", "auto_mode", "use_streaming", "use_async", "background")
+
+def run_config(models, use_cache, hedge):
+    # API Key不写入运行存储
+    config = {key: st.session_state.get(key) for key in RUN_SETTINGS}
+    config.update(models=models, base_url=st.session_state.get('base_url', API_BASE_URL), use_cache=use_cache,
+                  hedge=hedge)
+    return config
+
+# 打开保存的运行：恢复状态和设置，未完成的运行可以点击“继续优化”从检查点接着跑
+def open_run(run_id):
+    state_data, config = get_run_store().load_run(run_id)
+    if state_data is None:
+        st.error("运行记录不存在")
+        return
+    for key in RUN_SETTINGS:
+        if config.get(key) is not None:
+            st.session_state[key] = config[key]
+    state = OptimizationState.from_dict(state_data)
+    save_engine_state(state)
+    st.session_state.run_id = run_id
+    st.session_state.initialized = True
+    st.session_state.is_optimizing = False
+    
+    # 运行正在后台进行（可能由其他标签页启动）：直接观看，状态取自工作线程，不需要API配置
+    worker = get_worker(run_id)
+    if worker is not None and worker.active:
+        sync_worker(worker)
+        st.session_state.background = True
+        st.session_state.current_view = "optimization"
+        return
+    
+    # 刷新页面后会话中没有服务实例，使用会话或环境变量中的API Key重新配置
+    if "usage_meter" in st.session_state:
+        # 之前打开的运行中未完成迭代的用量不计入这个运行
+        st.session_state.usage_meter.take()
+    if "tracer" in st.session_state:
+        st.session_state.tracer.clear()
+    if "llm_service" not in st.session_state:
+        api_key = st.session_state.get('api_key') or os.getenv("DEFAULT_API_KEY")
+        if api_key and config.get("models"):
+            configure_api(api_key, config.get("base_url", API_BASE_URL), config["models"],
+                          use_cache=config.get("use_cache", True), hedge=config.get("hedge", False))
+    if "llm_service" not in st.session_state:
+        st.warning("⚠️ 未配置API，只能查看该运行的结果")
         st.session_state.current_view = "results"
         return
     
-    st.session_state.current_iteration += 1
+    # 初始化中断（初始提示词尚未全部执行）时先补齐，已生成的样本和输出从检查点取回
+    if not state.current_best_outputs:
+        engine = get_engine()
+        progress_bar = st.progress(0, text="正在恢复初始化...")
+        with EventQueue(engine.events) as events:
+            state, errors = run_in_thread(
+                lambda: engine.initialize(state),
+                on_poll=progress_tracker(events, progress_bar)
+            )
+        progress_bar.empty()
+        show_sample_errors(errors)
+        save_engine_state(state)
+    st.session_state.current_view = "results" if state.finished else "optimization"
+
+def show_sample_errors(errors, action="执行"):
+    for sample_id, error in errors.items():
+        st.error(f"样本 {sample_id} {action}失败: {error}")
+
+# 等待后台任务完成，脚本线程轮询期间可以刷新界面
+def wait_with_polling(future, on_poll=None, poll_interval=0.1):
+    while True:
+        done, _ = wait([future], timeout=poll_interval)
+        if on_poll:
+            on_poll()
+        if done:
+            return future.result()
+
+# 在后台事件循环中运行协程
+def run_in_background_loop(coro, on_poll=None, poll_interval=0.1):
+    return wait_with_polling(get_background_loop().submit(coro), on_poll, poll_interval)
+
+# 在工作线程中运行阻塞的引擎调用，脚本线程只负责消费进度事件
+def run_in_thread(fn, on_poll=None, poll_interval=0.1):
+    future = Future()
     
-    # 1. 生成新提示候选
-    with st.spinner(f"正在执行第 {st.session_state.current_iteration} 次优化..."):
-        new_prompt = optimize_prompt(
-            st.session_state.current_best_prompt,
-            json.dumps(st.session_state.current_best_outputs),
-            st.session_state.task_description,
-            get_optimization_history_summary()
-        )
+    def target():
+        try:
+            future.set_result(fn())
+        except Exception as e:
+            future.set_exception(e)
+    
+    threading.Thread(target=target, name="spo-step", daemon=True).start()
+    return wait_with_polling(future, on_poll, poll_interval)
+
+# 流式输出网格：每行最多3个样本，每个样本一个标题和一个输出占位符
+def stream_grid(container, samples, per_row=3):
+    blocks = {}
+    for start in range(0, len(samples), per_row):
+        columns = container.columns(per_row)
+        for column, sample in zip(columns, samples[start:start + per_row]):
+            column.markdown(f"**样本 {sample['id']}**")
+            blocks[sample['id']] = column.empty()
+    return blocks
+
+STAGE_LABELS = {
+    "samples": "正在生成测试样本",
+    "baseline": "正在执行初始提示词",
+    "execute": "正在测试新提示词",
+    "evaluate": "正在评估输出质量",
+    "beam": "正在评估候选提示词",
+}
+
+# 根据进度事件刷新进度条：完成数来自sample_done，耗时来自llm_call
+def progress_tracker(events, progress_bar):
+    progress = {"stage": None, "total": 0, "done": 0, "calls": 0, "latency": 0.0}
+    
+    def poll():
+        for event in events.drain():
+            if event.type == "stage_started" and event.stage in STAGE_LABELS:
+                progress.update(stage=event.stage, total=event.data.get("total", 0), done=0)
+            elif event.type == "sample_done" and event.stage == progress["stage"]:
+                progress["done"] += 1
+            elif event.type == "llm_call":
+                progress["calls"] += 1
+                progress["latency"] += event.data["latency"]
         
-        if not new_prompt:
-            st.error("优化提示词失败")
-            st.session_state.is_optimizing = False
+        if progress["stage"] is None:
             return
+        text = STAGE_LABELS[progress["stage"]]
+        value = 0.0
+        if progress["total"]:
+            value = min(progress["done"] / progress["total"], 1.0)
+            text += f" {progress['done']}/{progress['total']}"
+        if progress["calls"]:
+            text += f" · 平均调用耗时 {progress['latency'] / progress['calls']:.1f}s"
+        progress_bar.progress(value, text=text)
+    
+    return poll
+
+# 后台运行：工作线程持有引擎执行迭代，脚本只轮询它的状态，关闭标签页不影响运行
+WORKER_POLL_INTERVAL = float(os.getenv("SPO_WORKER_POLL_INTERVAL", "1.0"))
+
+WORKER_STATUS = {
+    "running": "🔄 正在优化...",
+    "pausing": "⏸️ 本次迭代完成后暂停...",
+    "paused": "⏸️ 已暂停",
+    "stopping": "⏹️ 本次迭代完成后停止...",
+    "stopped": "⏹️ 已停止",
+    "finished": "✅ 已完成",
+    "failed": "❌ 运行出错",
+}
+
+STEP_LABELS = {
+    **STAGE_LABELS,
+    "propose": "正在生成优化后的提示词",
+    "analyze": "正在分析提示词变化",
+    "decide": "正在更新最佳提示词",
+}
+
+def current_worker():
+    run_id = st.session_state.get('run_id')
+    return get_worker(run_id) if run_id else None
+
+# 后台模式，或者当前运行由工作线程执行过（可能由其他会话启动）
+def background_mode():
+    return bool(st.session_state.get('background')) or current_worker() is not None
+
+# 启动工作线程：手动模式每次迭代后自动暂停，流式模式在快照中提供各样本已输出的文本
+def start_run_worker(state):
+    service = st.session_state.llm_service
+    # 工作线程结束时关闭自己的用量计量，不与会话共用
+    worker = start_worker(
+        st.session_state.run_id, get_engine(usage=UsageMeter(service.events)), state,
+        step_mode=not st.session_state.get('auto_mode', True),
+        stream=st.session_state.get('use_streaming', False),
+        tracer=st.session_state.get('tracer')
+    )
+    st.session_state.is_optimizing = True
+    return worker
+
+# 用工作线程的快照更新会话状态
+def sync_worker(worker):
+    snapshot = worker.snapshot()
+    save_engine_state(snapshot["state"])
+    st.session_state.is_optimizing = snapshot["status"] in ("running", "pausing", "stopping")
+    return snapshot
+
+# 后台运行的控制按钮：暂停和停止在当前迭代完成后生效
+def show_worker_controls(worker, snapshot):
+    status = snapshot["status"] if snapshot else None
+    if status == "failed":
+        st.error(f"❌ 优化失败: {snapshot['error']}")
+    
+    st.markdown('<div class="card">', unsafe_allow_html=True)
+    col1, col2 = st.columns(2)
+    if status in ("running", "pausing"):
+        with col1:
+            if st.button("⏸️ 暂停", key="pause_btn", disabled=status == "pausing", use_container_width=True):
+                worker.pause()
+                st.rerun()
+        with col2:
+            if st.button("⏹️ 停止", key="stop_btn", use_container_width=True):
+                worker.stop()
+                st.rerun()
+    elif status == "paused":
+        with col1:
+            if st.button("▶️ 继续优化", key="resume_btn", use_container_width=True):
+                worker.resume()
+                st.rerun()
+        with col2:
+            if st.button("✅ 完成优化", key="finish_btn", use_container_width=True):
+                worker.stop()
+                st.session_state.current_view = "results"
+                st.rerun()
+    elif status == "stopping":
+        st.markdown("⏹️ 正在停止，当前迭代完成后结束")
+    else:
+        # 没有工作线程（重新打开的运行）或已停止/出错：从当前状态启动新的工作线程
+        with col1:
+            if st.button("▶️ 继续优化", key="continue_btn", use_container_width=True):
+                if "llm_service" not in st.session_state:
+                    st.warning("⚠️ 未配置API，请先在配置页完成API配置")
+                else:
+                    start_run_worker(load_engine_state())
+                    st.rerun()
+        with col2:
+            if st.button("✅ 完成优化", key="finish_btn", use_container_width=True):
+                st.session_state.current_view = "results"
+                st.rerun()
+    st.markdown('</div>', unsafe_allow_html=True)
+
+# 轮询工作线程：进度和流式输出在原位刷新，迭代完成或状态变化时重新运行脚本显示新的状态
+def watch_worker(worker, snapshot):
+    state = snapshot["state"]
+    if state.current_best_outputs:
+        st.markdown(f"### 🔄 执行第 {state.current_iteration + 1} 次优化...")
+    else:
+        st.markdown("### 🔄 正在初始化...")
+    progress_bar = st.empty()
+    grid = st.container()
+    blocks = {}
+    rendered = {}
+    while True:
+        progress = snapshot["progress"]
+        if snapshot["status"] == "paused":
+            text = "已暂停，点击“继续优化”后进行下一次迭代"
+        else:
+            text = STEP_LABELS.get(progress["stage"], "正在准备下一次迭代")
+        value = 0.0
+        if progress["total"]:
+            value = min(progress["done"] / progress["total"], 1.0)
+            text += f" {progress['done']}/{progress['total']}"
+        progress_bar.progress(value, text=f"{text} · API用量: {format_usage(snapshot['usage'])}")
         
-        st.session_state.new_prompt = new_prompt
-        
-        # 2. 执行新提示
-        new_outputs = {}
-        for sample in st.session_state.samples:
-            output = execute_prompt(new_prompt, sample['question'])
-            new_outputs[sample['id']] = output
-        
-        st.session_state.new_outputs = new_outputs
-        
-        # 3. 评估新旧输出
-        evaluations = {}
-        for sample in st.session_state.samples:
-            sample_id = sample['id']
-            output_a = st.session_state.current_best_outputs.get(sample_id, "")
-            output_b = new_outputs.get(sample_id, "")
-            
-            evaluation = evaluate_outputs(
-                output_a,
-                output_b,
-                st.session_state.task_description,
-                sample['question']
-            )
-            
-            evaluations[sample_id] = evaluation
-        
-        st.session_state.evaluations = evaluations
-        
-        # 4. 分析提示变化
-        analysis = analyze_changes(
-            st.session_state.current_best_prompt,
-            new_prompt,
-            st.session_state.task_description
-        )
-        
-        st.session_state.analysis = analysis
-        
-        # 5. 根据评估结果更新最佳提示
-        is_better = should_update_best_prompt(evaluations)
-        if is_better:
-            st.session_state.current_best_prompt = new_prompt
-            st.session_state.current_best_outputs = new_outputs
+        if snapshot["partial"] and not blocks:
+            blocks = stream_grid(grid, state.samples)
+        for sample_id, output in snapshot["partial"].items():
+            if sample_id in blocks and rendered.get(sample_id) != output:
+                blocks[sample_id].markdown(output)
+                rendered[sample_id] = output
         
-        # 记录优化历史
-        st.session_state.optimization_history.append({
-            "iteration": st.session_state.current_iteration,
-            "prompt": new_prompt,
-            "is_better": is_better,
-            "analysis": analysis,
-            "evaluations": evaluations
-        })
-    
-    # 如果是自动模式，继续优化
-    if st.session_state.auto_mode:
-        time.sleep(1)  # 短暂延迟，让UI更新
-        run_optimization_step()
+        time.sleep(WORKER_POLL_INTERVAL)
+        latest = worker.snapshot()
+        if latest["state"] is not snapshot["state"] or latest["status"] != snapshot["status"]:
+            st.rerun()
+        snapshot = latest
 
 # 配置视图
 def show_config_view():
@@ -785,6 +724,60 @@ def show_config_view():
                 value=10,
                 help="系统将执行的最大优化次数"
             )
+            
+            max_concurrency = st.number_input(
+                "最大并发数",
+                min_value=1,
+                max_value=16,
+                value=DEFAULT_MAX_CONCURRENCY,
+                help="同时执行的样本请求数，流式模式下即同时输出的样本数，设为1则逐个执行"
+            )
+            
+            beam_width = st.number_input(
+                "每轮候选数",
+                min_value=1,
+                max_value=8,
+                value=1,
+                help="大于1时每次迭代生成多个候选提示词，先在少量样本上评估，只让表现较好的候选进入全部样本的评估"
+            )
+            
+            adaptive_eval = st.selectbox(
+                "自适应评估",
+                options=list(ADAPTIVE_MODES),
+                format_func=lambda mode: {"off": "关闭", "majority": "多数已定即停", "sprt": "序贯检验（SPRT）"}[mode],
+                help="评估结论已经确定时停止评估剩余样本，节省评估调用"
+            )
+            
+            batch_judging = st.checkbox(
+                "批量评估",
+                value=False,
+                help="一次评估请求携带所有样本，减少往返次数和重复的任务描述；开启后自适应评估不生效"
+            )
+            
+            context_budget = st.number_input(
+                "优化器上下文预算（token）",
+                min_value=200,
+                max_value=32000,
+                value=CONTEXT_TOKEN_BUDGET,
+                step=500,
+                help="生成新提示词时附带的样本输出总长度上限，优先保留上次评估中输掉的样本，超出部分截断或省略"
+            )
+            
+            max_tokens = st.number_input(
+                "token预算",
+                min_value=0,
+                value=int(os.getenv("LLM_MAX_TOKENS", "0")),
+                step=10000,
+                help="整个运行的API token上限，预计下一次迭代会超出时停止优化；0为不限制"
+            )
+            
+            max_cost = st.number_input(
+                "费用预算（元）",
+                min_value=0.0,
+                value=float(os.getenv("LLM_MAX_COST", "0")),
+                step=0.5,
+                help="按LLM_PRICES中的模型价格计算的费用上限，预计下一次迭代会超出时停止优化；0为不限制"
+            )
         
         with col2:
             auto_mode = st.checkbox(
@@ -793,11 +786,35 @@ def show_config_view():
                 help="开启后系统将自动完成全部优化过程，无需人工干预"
             )
             
+            background = st.checkbox(
+                "后台运行",
+                value=True,
+                help="优化在服务端的后台线程中进行，可以暂停、继续和停止；关闭或刷新页面不影响运行，多个标签页可以同时查看同一个运行"
+            )
+            
             use_streaming = st.checkbox(
                 "流式输出", 
                 value=True,
                 help="开启后将实时显示AI生成过程"
             )
+            
+            use_async = st.checkbox(
+                "异步并发",
+                value=False,
+                help="通过asyncio同时发出所有评估请求，非流式模式下执行请求也一并发出；流式模式的执行仍由并发的流式输出完成"
+            )
+            
+            use_cache = st.checkbox(
+                "响应缓存",
+                value=True,
+                help="相同提示词和问题的执行结果、相同输出对的评估结果直接复用缓存，不再重复调用模型"
+            )
+            
+            use_hedging = st.checkbox(
+                "对冲请求",
+                value=False,
+                help="某次调用超过该角色历史p95延迟仍未返回时再发一份相同请求，取先返回的结果，以少量额外调用换取更低的尾延迟"
+            )
         st.markdown('</div>', unsafe_allow_html=True)
         
         col1, col2 = st.columns([3, 1])
@@ -826,6 +843,8 @@ def show_config_view():
             
             # 保存流式输出设置
             st.session_state.use_streaming = use_streaming
+            st.session_state.use_async = use_async
+            st.session_state.background = background
             
             # 配置模型
             models = {
@@ -839,44 +858,54 @@ def show_config_view():
             st.session_state.task_description = task_description
             st.session_state.current_best_prompt = initial_prompt
             st.session_state.max_iterations = max_iterations
+            st.session_state.max_concurrency = max_concurrency
+            st.session_state.beam_width = beam_width
+            st.session_state.adaptive_eval = adaptive_eval
+            st.session_state.batch_judging = batch_judging
+            st.session_state.context_budget = context_budget
+            st.session_state.max_tokens = max_tokens
+            st.session_state.max_cost = max_cost
             st.session_state.auto_mode = auto_mode
             
             # 配置API
             with st.spinner("正在配置API..."):
                 try:
-                    result = configure_api(api_key, base_url, models)
+                    result = configure_api(api_key, base_url, models, use_cache=use_cache, hedge=use_hedging)
                     if result:
                         st.success("✅ API配置成功")
                         
-                        # 显示进度信息
-                        progress_text = "正在生成测试样本..."
-                        progress_bar = st.progress(0)
+                        # 生成测试样本并执行初始提示，进度条随真实完成的样本推进
+                        initial_state = OptimizationState(
+                            task_description=task_description,
+                            current_best_prompt=initial_prompt,
+                            max_iterations=max_iterations
+                        )
+                        # 创建运行记录，之后每个子阶段完成都会写入检查点
+                        st.session_state.run_id = get_run_store().create_run(
+                            initial_state, run_config(models, use_cache, use_hedging)
+                        )
+                        if background:
+                            # 初始化也由工作线程完成，进度在优化过程页显示
+                            save_engine_state(initial_state)
+                            start_run_worker(initial_state)
+                            st.session_state.initialized = True
+                            st.session_state.current_view = "optimization"
+                            st.rerun()
+                        engine = get_engine()
+                        progress_bar = st.progress(0, text="正在生成测试样本...")
+                        with EventQueue(engine.events) as events:
+                            state, errors = run_in_thread(
+                                lambda: engine.initialize(initial_state),
+                                on_poll=progress_tracker(events, progress_bar)
+                            )
+                        show_sample_errors(errors)
+                        save_engine_state(state)
                         
-                        # 生成测试样本
-                        with st.spinner(progress_text):
-                            progress_bar.progress(25)
-                            samples = generate_samples(task_description)
-                            
-                            if samples:
-                                progress_bar.progress(50)
-                                st.session_state.samples = samples
-                                
-                                # 执行初始提示
-                                progress_bar.progress(75)
-                                outputs = run_current_best_prompt()
-                                
-                                if outputs:
-                                    progress_bar.progress(100)
-                                    time.sleep(0.5)  # 给用户一点时间看到100%
-                                    st.success("✅ 初始化完成！正在进入优化过程...")
-                                    st.session_state.initialized = True
-                                    st.session_state.current_view = "optimization"
-                                    st.session_state.is_optimizing = True
-                                    time.sleep(1)  # 给用户一点时间阅读成功消息
-                                    st.rerun()
-                            else:
-                                progress_bar.progress(100)
-                                st.error("❌ 生成测试样本失败")
+                        st.success("✅ 初始化完成！正在进入优化过程...")
+                        st.session_state.initialized = True
+                        st.session_state.current_view = "optimization"
+                        st.session_state.is_optimizing = True
+                        st.rerun()
                     else:
                         st.error("❌ API配置失败")
                 except Exception as e:
@@ -969,6 +998,18 @@ def show_optimization_view():
     </div>
     """, unsafe_allow_html=True)
     
+    # 后台运行时先用工作线程的最新状态更新会话；运行刚完成时进入结果页
+    background = background_mode()
+    worker = current_worker()
+    snapshot = sync_worker(worker) if background and worker else None
+    if snapshot:
+        last_status = st.session_state.get('worker_status')
+        st.session_state.worker_status = (worker.run_id, snapshot["status"])
+        if snapshot["status"] == "finished" and last_status and last_status[0] == worker.run_id \
+                and last_status[1] in ACTIVE_STATUSES:
+            st.session_state.current_view = "results"
+            st.rerun()
+    
     # 状态栏
     progress_value = st.session_state.current_iteration / st.session_state.max_iterations
     
@@ -982,13 +1023,19 @@ def show_optimization_view():
         progress = st.progress(progress_value)
     
     with col3:
-        if st.session_state.is_optimizing:
+        if background:
+            status = WORKER_STATUS[snapshot["status"]] if snapshot else "⏸️ 等待操作..."
+        elif st.session_state.is_optimizing:
             status = "🔄 正在优化..."
         else:
             status = "⏸️ 等待操作..."
         st.markdown(f"<h4>状态: {status}</h4>", unsafe_allow_html=True)
+    st.caption(f"API用量: {format_usage(current_usage())}{budget_text()}")
     st.markdown('</div>', unsafe_allow_html=True)
     
+    if snapshot and st.session_state.current_iteration == 0:
+        show_sample_errors(snapshot["errors"])
+    
     # 如果是第一次迭代，显示引导提示
     if st.session_state.current_iteration == 0:
         st.markdown("""
@@ -1020,7 +1067,9 @@ def show_optimization_view():
             st.markdown('</div>', unsafe_allow_html=True)
         
         # 控制按钮
-        if not st.session_state.is_optimizing:
+        if background:
+            show_worker_controls(worker, snapshot)
+        elif not st.session_state.is_optimizing:
             st.markdown('<div class="card">', unsafe_allow_html=True)
             col1, col2 = st.columns(2)
             
@@ -1081,7 +1130,7 @@ def show_optimization_view():
             st.markdown("<h2 class='sub-header'>优化历史</h2>", unsafe_allow_html=True)
             
             st.markdown('<div class="card">', unsafe_allow_html=True)
-            for item in st.session_state.optimization_history:
+            for item in history_page(st.session_state.optimization_history, "optimization"):
                 css_class = "better" if item["is_better"] else "not-better"
                 icon = "✅" if item["is_better"] else "⚠️"
                 
@@ -1089,6 +1138,30 @@ def show_optimization_view():
                     st.markdown(f"**提示词:**")
                     st.text_area(f"prompt_{item['iteration']}", value=item['prompt'], height=100, label_visibility="collapsed")
                     
+                    if item.get('beam'):
+                        beam = item['beam']
+                        st.markdown(
+                            f"**束搜索:** {beam['candidates']} 个候选，{len(beam['rounds'])} 轮淘汰，"
+                            f"评估调用 {beam['evaluator_calls']}/{beam['full_evaluation_calls']}"
+                        )
+                    
+                    if item.get('adaptive'):
+                        adaptive = item['adaptive']
+                        text = f"**自适应评估:** 已评估 {adaptive['evaluated']} 个样本，节省评估调用 {adaptive['saved']}"
+                        if adaptive.get('abandoned'):
+                            text += f"，丢弃在途调用 {adaptive['abandoned']}"
+                        st.markdown(text)
+                    
+                    if item.get('context'):
+                        context = item['context']
+                        st.markdown(
+                            f"**优化器上下文:** {context['prompt_tokens_before']} → {context['prompt_tokens']} tokens"
+                            f"（{context['included']} 个样本，截断 {context['truncated']}，省略 {context['omitted']}）"
+                        )
+                    
+                    if item.get('usage'):
+                        st.markdown(f"**API用量:** {format_usage(item['usage'])}")
+                    
                     st.markdown("**评估结果:**")
                     for sample_id, result in item['evaluations'].items():
                         if result == "B更好":
@@ -1099,41 +1172,67 @@ def show_optimization_view():
                             result_emoji = "⚖️"
                         st.markdown(f"- 样本 {sample_id}: {result_emoji} {result}")
                     
-                    with st.expander("📊 详细分析", expanded=False):
-                        st.markdown(item['analysis'])
+                    # 展开框不能嵌套，详细分析直接显示在迭代的展开框中
+                    st.markdown("**📊 详细分析:**")
+                    st.markdown(item['analysis'])
             st.markdown('</div>', unsafe_allow_html=True)
     
-    # 如果正在优化且需要执行下一步
-    if st.session_state.is_optimizing:
+    show_trace_waterfall("optimization")
+    
+    # 后台运行时轮询工作线程，否则在脚本中执行下一步
+    if background:
+        if worker is not None and worker.active:
+            watch_worker(worker, snapshot)
+    elif st.session_state.is_optimizing:
         run_optimization_step_with_ui()
 
 # 带UI反馈的优化步骤执行
 def run_optimization_step_with_ui():
-    if st.session_state.current_iteration >= st.session_state.max_iterations:
+    engine = get_engine()
+    # 每次迭代开始前按当前预算检查，预计会超出时停止并进入结果页
+    state = engine.check_budget(load_engine_state())
+    if state.finished:
+        save_engine_state(state)
         st.session_state.is_optimizing = False
         st.session_state.current_view = "results"
         st.rerun()
         return
     
-    st.session_state.current_iteration += 1
+    total = len(state.samples)
+    begin_trace_iteration(state)
+    trace = engine.events.span
     
     # 创建容器来显示进度
     status_container = st.empty()
     output_container = st.empty()
     
-    status_container.markdown(f"### 🔄 执行第 {st.session_state.current_iteration} 次优化...")
+    status_container.markdown(f"### 🔄 执行第 {state.current_iteration + 1} 次优化...")
+    
+    # 束搜索模式：候选生成、逐轮淘汰和决策都由引擎完成
+    if engine.beam_width > 1:
+        output_container.markdown(f"🧠 正在生成 {engine.beam_width} 个候选提示词并逐轮淘汰...")
+        beam_progress = output_container.progress(0, text="正在生成候选提示词...")
+        try:
+            with EventQueue(engine.events) as events, trace("beam", category="step"):
+                state, record = run_in_thread(
+                    lambda: engine.beam_step(state),
+                    on_poll=progress_tracker(events, beam_progress)
+                )
+        except Exception as e:
+            output_container.error(f"❌ 优化提示词失败: {str(e)}")
+            st.session_state.is_optimizing = False
+            return
+        save_engine_state(state)
+        finish_optimization_step(status_container, output_container)
+        return
     
     # 1. 生成新提示候选
     output_container.markdown("🧠 正在生成优化后的提示词...")
-    new_prompt = optimize_prompt(
-        st.session_state.current_best_prompt,
-        json.dumps(st.session_state.current_best_outputs),
-        st.session_state.task_description,
-        get_optimization_history_summary()
-    )
-    
-    if not new_prompt:
-        output_container.error("❌ 优化提示词失败")
+    try:
+        with trace("optimize", category="step"):
+            new_prompt = engine.propose(state)
+    except Exception as e:
+        output_container.error(f"❌ 优化提示词失败: {str(e)}")
         st.session_state.is_optimizing = False
         return
     
@@ -1143,106 +1242,167 @@ def run_optimization_step_with_ui():
     # 2. 执行新提示
     output_container.markdown("🔍 正在测试新提示词...")
     
-    # 检查是否使用流式输出
+    # 检查是否使用流式输出或异步并发
     use_stream = st.session_state.get('use_streaming', False)
+    use_async = st.session_state.get('use_async', False)
     
     new_outputs = {}
-    # 为每个样本创建一个进度条
-    progress_bars = {}
-    output_blocks = {}
-    
-    for sample in st.session_state.samples:
-        sample_id = sample['id']
-        progress_bars[sample_id] = output_container.progress(0)
-        output_blocks[sample_id] = output_container.empty()
+    errors = {}
+    
+    if use_stream:
+        # 流式输出：所有样本在工作线程中同时流式执行，脚本线程按渲染间隔统一刷新各自的占位符
+        status_container.markdown(f"### 🔄 并发流式测试 {total} 个样本...")
+        grid = output_container.container()
+        exec_progress = grid.progress(0)
+        output_blocks = stream_grid(grid, state.samples)
+        buffer = StreamBuffer()
         
-        # 更新状态
-        status_container.markdown(f"### 🔄 测试样本 {sample_id}/{len(st.session_state.samples)}...")
+        def pump():
+            changed = buffer.drain()
+            if not changed:
+                return
+            with trace("render", category="step", samples=len(changed)):
+                for sample_id, text in changed.items():
+                    output_blocks[sample_id].markdown(text)
         
-        if use_stream:
-            # 使用流式输出
-            output_blocks[sample_id].markdown(f"生成样本 {sample_id} 的回答:")
-            output = execute_prompt(new_prompt, sample['question'], use_stream=True)
-        else:
-            # 常规输出
-            output = execute_prompt(new_prompt, sample['question'])
-            # 模拟进度
-            for i in range(10):
-                progress_bars[sample_id].progress((i+1)/10)
-                time.sleep(0.1)
-            output_blocks[sample_id].markdown(f"样本 {sample_id} 回答已完成")
+        with EventQueue(engine.events) as events, trace("execute", category="step"):
+            tracker = progress_tracker(events, exec_progress)
             
-        new_outputs[sample_id] = output
-        progress_bars[sample_id].progress(1.0)
-    
-    # 清理进度条和块
-    for sample_id in progress_bars:
-        progress_bars[sample_id].empty()
-        output_blocks[sample_id].empty()
+            def on_poll():
+                tracker()
+                pump()
+            
+            new_outputs, errors = run_in_thread(
+                lambda: engine.execute_stream(state, new_prompt, buffer.update),
+                on_poll=on_poll,
+                poll_interval=RENDER_INTERVAL
+            )
+        pump()
+        exec_progress.empty()
+        # 最终输出下方附上该样本的渲染次数
+        with trace("render", category="step", samples=len(output_blocks)):
+            for sample_id, block in output_blocks.items():
+                final = block.container()
+                final.markdown(new_outputs.get(sample_id, ""))
+                final.caption(f"渲染 {buffer.renders.get(sample_id, 0)} 次 / {buffer.deltas.get(sample_id, 0)} 个数据块")
+    elif use_async:
+        # 异步输出：协程在后台事件循环中扇出，脚本线程只负责按进度事件刷新界面
+        status_container.markdown(f"### 🔄 异步并发测试 {total} 个样本...")
+        exec_progress = output_container.progress(0)
         
+        # 只执行没有检查点的样本
+        restored = engine.restored(state, "execute")
+        with EventQueue(engine.events) as events, trace("execute", category="step"):
+            new_outputs, errors = run_in_background_loop(
+                st.session_state.async_llm_service.execute_all(
+                    new_prompt,
+                    [sample for sample in state.samples if sample['id'] not in restored],
+                    max_concurrency=engine.max_concurrency
+                ),
+                on_poll=progress_tracker(events, exec_progress)
+            )
+        engine.checkpoint_samples(state, "execute", new_outputs, errors)
+        new_outputs = {sample_id: output for sample_id, output in sorted({**restored, **new_outputs}.items())}
+        exec_progress.empty()
+    else:
+        # 常规输出：并发执行，按实际完成数更新进度
+        status_container.markdown(f"### 🔄 并发测试 {total} 个样本...")
+        exec_progress = output_container.progress(0)
+        
+        with EventQueue(engine.events) as events, trace("execute", category="step"):
+            new_outputs, errors = run_in_thread(
+                lambda: engine.execute(state, new_prompt),
+                on_poll=progress_tracker(events, exec_progress)
+            )
+        exec_progress.empty()
+    
+    show_sample_errors(errors)
     st.session_state.new_outputs = new_outputs
     output_container.markdown("✅ 测试完成")
     
     # 3. 评估新旧输出
     output_container.markdown("⚖️ 正在评估输出质量...")
-    evaluations = {}
-    
     eval_progress = output_container.progress(0)
-    for idx, sample in enumerate(st.session_state.samples):
-        sample_id = sample['id']
-        output_a = st.session_state.current_best_outputs.get(sample_id, "")
-        output_b = new_outputs.get(sample_id, "")
-        
-        evaluation = evaluate_outputs(
-            output_a,
-            output_b,
-            st.session_state.task_description,
-            sample['question']
-        )
-        
-        evaluations[sample_id] = evaluation
-        eval_progress.progress((idx + 1) / len(st.session_state.samples))
+    adaptive = None
+    
+    with EventQueue(engine.events) as events, trace("evaluate", category="step"):
+        if use_async and not engine.batch_judging and not engine.sequential_eval:
+            # 所有样本的评估同时发出，已有检查点的样本不再评估
+            restored = engine.restored(state, "evaluate")
+            results, eval_errors = run_in_background_loop(
+                st.session_state.async_llm_service.evaluate_all(
+                    state.current_best_outputs,
+                    new_outputs,
+                    [sample for sample in state.samples if sample['id'] not in restored],
+                    state.task_description,
+                    max_concurrency=engine.max_concurrency
+                ),
+                on_poll=progress_tracker(events, eval_progress)
+            )
+            evaluations = {sample_id: verdict_label(result['winner']) for sample_id, result in results.items()}
+            engine.checkpoint_samples(state, "evaluate", evaluations, eval_errors)
+            evaluations = dict(sorted({**restored, **evaluations}.items()))
+        elif engine.sequential_eval:
+            # 结论确定后不再评估剩余样本
+            evaluations, eval_errors, adaptive = run_in_thread(
+                lambda: engine.evaluate_sequential(state, new_outputs),
+                on_poll=progress_tracker(events, eval_progress)
+            )
+        else:
+            evaluations, eval_errors = run_in_thread(
+                lambda: engine.evaluate(state, new_outputs),
+                on_poll=progress_tracker(events, eval_progress)
+            )
     
     eval_progress.empty()
+    show_sample_errors(eval_errors, action="评估")
     st.session_state.evaluations = evaluations
-    output_container.markdown("✅ 评估完成")
+    if adaptive and adaptive['saved']:
+        output_container.markdown(
+            f"✅ 评估完成（结论已确定，跳过 {adaptive['saved']} 个样本"
+            + (f"，丢弃 {adaptive['abandoned']} 个在途调用的结果" if adaptive.get('abandoned') else "") + "）"
+        )
+    else:
+        output_container.markdown("✅ 评估完成")
     
     # 4. 分析提示变化
     output_container.markdown("🔎 正在分析提示词变化...")
-    analysis = analyze_changes(
-        st.session_state.current_best_prompt,
-        new_prompt,
-        st.session_state.task_description
-    )
+    try:
+        with trace("analyze", category="step"):
+            analysis = engine.analyze(state, new_prompt)
+    except Exception as e:
+        st.error(f"分析提示变化失败: {str(e)}")
+        analysis = ""
     
-    st.session_state.analysis = analysis
     output_container.markdown("✅ 分析完成")
     
-    # 5. 根据评估结果更新最佳提示
-    is_better = should_update_best_prompt(evaluations)
-    if is_better:
-        st.session_state.current_best_prompt = new_prompt
-        st.session_state.current_best_outputs = new_outputs
+    # 5. 根据评估结果更新最佳提示，并记录优化历史
+    step_errors = {}
+    if errors:
+        step_errors["execute"] = errors
+    if eval_errors:
+        step_errors["evaluate"] = eval_errors
+    with trace("decide", category="step"):
+        state, record = engine.decide(
+            state, new_prompt, new_outputs, evaluations, analysis, step_errors, adaptive=adaptive
+        )
+        save_engine_state(state)
+    
+    if record["is_better"]:
         output_container.markdown("🎉 发现更好的提示词！已更新为当前最佳提示。")
     else:
         output_container.markdown("📌 新提示词未能提供改进，保持当前最佳提示不变。")
     
-    # 记录优化历史
-    st.session_state.optimization_history.append({
-        "iteration": st.session_state.current_iteration,
-        "prompt": new_prompt,
-        "is_better": is_better,
-        "analysis": analysis,
-        "evaluations": evaluations
-    })
-    
+    finish_optimization_step(status_container, output_container)
+
+# 一次迭代结束后清理进度展示，并决定是否继续
+def finish_optimization_step(status_container, output_container):
     # 清空状态容器和输出容器
     status_container.empty()
     output_container.empty()
     
     # 如果是自动模式，继续优化
     if st.session_state.auto_mode:
-        time.sleep(1)  # 短暂延迟，让UI更新
         st.rerun()  # 重新加载页面继续优化
     else:
         st.session_state.is_optimizing = False
@@ -1298,8 +1458,30 @@ def show_results_view():
         st.info("👍 优化取得了一定成效，但仍有改进空间。")
     else:
         st.warning("⚠️ 优化过程较为困难，可能需要更好的初始提示词或更精确的任务描述。")
+    
+    if st.session_state.get('stop_reason'):
+        st.warning(f"⏹️ 优化提前停止：{st.session_state.stop_reason}")
     st.markdown('</div>', unsafe_allow_html=True)
     
+    # API用量：运行累计，按角色拆分
+    usage = st.session_state.get('usage') or {}
+    if usage.get("calls"):
+        st.markdown("<h2 class='sub-header'>API用量</h2>", unsafe_allow_html=True)
+        st.markdown('<div class="card">', unsafe_allow_html=True)
+        col1, col2, col3, col4 = st.columns(4)
+        with col1:
+            st.metric("调用次数", usage["calls"])
+        with col2:
+            st.metric("总tokens", total_tokens(usage))
+        with col3:
+            st.metric("缓存命中tokens", usage["cached_tokens"])
+        with col4:
+            st.metric("费用", f"¥{usage['cost']:.4f}")
+        st.dataframe(usage_table(usage), use_container_width=True, hide_index=True)
+        if usage.get("unreported"):
+            st.caption(f"{usage['unreported']} 次调用的响应中没有用量信息，token数按字符数估计")
+        st.markdown('</div>', unsafe_allow_html=True)
+    
     # 最终提示词
     st.markdown("<h2 class='sub-header'>最终优化提示词</h2>", unsafe_allow_html=True)
     
@@ -1357,34 +1539,11 @@ def show_results_view():
         
         st.markdown('<div class="card">', unsafe_allow_html=True)
         # 图表显示优化进度
-        iteration_data = [(i+1) for i in range(len(st.session_state.optimization_history))]
-        better_data = [1 if item["is_better"] else 0 for item in st.session_state.optimization_history]
-        
-        import pandas as pd
-        import altair as alt
-        
-        df = pd.DataFrame({
-            '迭代': iteration_data,
-            '是否改进': better_data
-        })
+        improved = tuple(item["is_better"] for item in st.session_state.optimization_history)
+        st.altair_chart(improvement_chart(improved), use_container_width=True)
         
-        base = alt.Chart(df).encode(
-            x=alt.X('迭代:O', axis=alt.Axis(title='迭代次数')),
-            y=alt.Y('是否改进:Q', axis=alt.Axis(title='改进状态'))
-        )
-        
-        bars = base.mark_bar(color='#3B82F6').encode(
-            color=alt.condition(
-                alt.datum['是否改进'] == 1,
-                alt.value('#10B981'),  # 成功改进
-                alt.value('#EF4444')   # 未改进
-            )
-        )
-        
-        st.altair_chart(bars, use_container_width=True)
-        
-        # 优化历史详情
-        for item in st.session_state.optimization_history:
+        # 优化历史详情，只生成当前页
+        for item in history_page(st.session_state.optimization_history, "results"):
             css_class = "better" if item["is_better"] else "not-better"
             icon = "✅" if item["is_better"] else "⚠️"
             
@@ -1404,6 +1563,9 @@ def show_results_view():
                 with col3:
                     st.metric("相似结果", similar_count)
                 
+                if item.get('usage'):
+                    st.markdown(f"**API用量:** {format_usage(item['usage'])}")
+                
                 st.markdown("**评估结果详情:**")
                 for sample_id, result in item['evaluations'].items():
                     if result == "B更好":
@@ -1417,34 +1579,37 @@ def show_results_view():
                         result_color = "#F59E0B"
                     st.markdown(f"<span style='color:{result_color}'>- 样本 {sample_id}: {result_emoji} {result}</span>", unsafe_allow_html=True)
                 
-                with st.expander("📊 详细分析", expanded=False):
-                    st.markdown(item['analysis'])
+                # 展开框不能嵌套，详细分析直接显示在迭代的展开框中
+                st.markdown("**📊 详细分析:**")
+                st.markdown(item['analysis'])
         st.markdown('</div>', unsafe_allow_html=True)
     
+    show_trace_waterfall("results")
+    
     # 导出和重置按钮
     st.markdown('<div class="card">', unsafe_allow_html=True)
     col1, col2 = st.columns(2)
     
     with col1:
-        if st.button("📥 导出历史", use_container_width=True):
-            export_data = {
-                "date": time.strftime("%Y-%m-%d %H:%M:%S"),
-                "task_description": st.session_state.task_description,
-                "initial_prompt": st.session_state.current_best_prompt,
-                "iterations": st.session_state.current_iteration,
-                "history": [{
-                    "iteration": item["iteration"],
-                    "prompt": item["prompt"],
-                    "is_better": item["is_better"],
-                    "analysis": item["analysis"]
-                } for item in st.session_state.optimization_history]
-            }
-            
+        # 导出JSONL运行日志：运行存储中有增量日志时直接提供文件，否则从当前状态逐行生成
+        file_name = f"spo-plus-run-{time.strftime('%Y%m%d-%H%M%S')}.jsonl"
+        run_id = st.session_state.get('run_id')
+        log_path = get_run_store().log_path(run_id) if run_id else None
+        if log_path and os.path.exists(log_path):
+            with open(log_path, "rb") as f:
+                st.download_button(
+                    label="📥 导出运行日志",
+                    data=f,
+                    file_name=file_name,
+                    mime="application/x-ndjson",
+                    use_container_width=True
+                )
+        else:
             st.download_button(
-                label="📥 下载JSON文件",
-                data=json.dumps(export_data, ensure_ascii=False, indent=2),
-                file_name=f"spo-plus-history-{time.strftime('%Y%m%d-%H%M%S')}.json",
-                mime="application/json",
+                label="📥 导出运行日志",
+                data="".join(export_lines(load_engine_state())),
+                file_name=file_name,
+                mime="application/x-ndjson",
                 use_container_width=True
             )
     
@@ -1469,6 +1634,7 @@ def show_results_view():
             st.session_state.current_view = "config"
             st.session_state.current_iteration = 0
             st.session_state.max_iterations = 10
+            st.session_state.max_concurrency = DEFAULT_MAX_CONCURRENCY
             st.session_state.samples = []
             st.session_state.current_best_prompt = ""
             st.session_state.current_best_outputs = {}
@@ -1477,6 +1643,8 @@ def show_results_view():
             st.session_state.evaluations = {}
             st.session_state.analysis = ""
             st.session_state.optimization_history = []
+            st.session_state.usage = {}
+            st.session_state.stop_reason = ""
             st.session_state.is_optimizing = False
             
             st.success("✅ 已重置！您可以开始新的优化任务。")
@@ -1505,6 +1673,91 @@ def main():
                 st.session_state.current_view = "results"
                 st.rerun()
         
+        # 保存的运行：刷新页面或重启后可以重新打开，未完成的运行从检查点继续
+        runs = get_run_store().list_runs(limit=10)
+        running = active_workers()
+        st.markdown("---")
+        st.markdown("### 历史运行")
+        for run in runs:
+            status = "🔄" if run['id'] in running else {"finished": "✅", "stopped": "⏹️"}.get(run['status'], "⏸️")
+            label = f"{status} {run['task_description'][:16]} · {run['current_iteration']}/{run['max_iterations']}"
+            if st.button(label, key=f"run_{run['id']}", help=time.strftime('%Y-%m-%d %H:%M', time.localtime(run['updated']))):
+                open_run(run['id'])
+                st.rerun()
+        
+        # 导入导出的JSONL运行日志，导入后与其他运行一样可以查看或继续优化
+        uploaded_log = st.file_uploader("导入运行日志", type=["jsonl"])
+        if uploaded_log is not None and st.button("📤 导入", key="import_run"):
+            try:
+                run_id, _ = get_run_store().import_run(uploaded_log)
+            except Exception as e:
+                st.error(f"导入失败: {str(e)}")
+            else:
+                open_run(run_id)
+                st.rerun()
+        
+        # 连接池统计
+        if "llm_service" in st.session_state:
+            stats = st.session_state.llm_service.get_transport_stats()
+            st.markdown("---")
+            st.markdown("### 连接池")
+            st.markdown(f"""
+            - 请求数: {stats['requests']}
+            - 连接复用: {stats['pool_hits']} / 新建连接: {stats['pool_misses']}
+            - 复用率: {stats['hit_rate']:.0%}
+            - 平均握手耗时: {stats['connect_time_avg'] * 1000:.0f} ms
+            - 节省握手时间: {stats['connect_time_saved']:.1f} s
+            """)
+            
+            rate_stats = st.session_state.llm_service.get_rate_limit_stats()
+            st.markdown("### 限流")
+            st.markdown(f"""
+            - 当前并发上限: {rate_stats['concurrency_limit']}（在途 {rate_stats['in_flight']}）
+            - 429限流: {rate_stats['throttled']} 次 / 服务端错误: {rate_stats['server_errors']} 次
+            - 排队等待: {rate_stats['wait_time']:.1f} s
+            """)
+            
+            latency_stats = st.session_state.llm_service.get_latency_stats()
+            if latency_stats['latency']:
+                st.markdown("### 调用延迟")
+                st.markdown("\n".join(
+                    f"- {role}: p50 {item['p50']:.1f}s / p95 {item['p95']:.1f}s / p99 {item['p99']:.1f}s（{item['count']} 次）"
+                    for role, item in latency_stats['latency'].items()
+                ))
+                st.markdown(
+                    f"- 重试: {latency_stats['retries']} 次 / 对冲: {latency_stats['hedges']} 次"
+                    f"（对冲胜出 {latency_stats['hedge_wins']} 次）"
+                )
+            
+            cache_stats = st.session_state.llm_service.get_cache_stats()
+            if cache_stats:
+                st.markdown("### 响应缓存")
+                st.markdown(f"""
+                - 内存命中: {cache_stats['memory_hits']} / 磁盘命中: {cache_stats['disk_hits']}
+                - 未命中: {cache_stats['misses']}
+                - 命中率: {cache_stats['hit_rate']:.0%}
+                - 磁盘占用: {cache_stats['disk_bytes'] / 1024:.0f} KB
+                """)
+            
+            judgment_stats = st.session_state.llm_service.get_judgment_stats()
+            if judgment_stats:
+                st.markdown("### 评估缓存")
+                st.markdown(f"""
+                - 直接命中: {judgment_stats['hits']} / 交换命中: {judgment_stats['swapped_hits']}
+                - 输出相同免评估: {judgment_stats['identical']}
+                - 未命中: {judgment_stats['misses']}
+                - 命中率: {judgment_stats['hit_rate']:.0%}
+                """)
+            
+            cassette_stats = st.session_state.llm_service.get_cassette_stats()
+            if cassette_stats:
+                st.markdown("### 录制与回放")
+                st.markdown(f"""
+                - 模式: {"录制" if cassette_stats['mode'] == "record" else "回放"}（{cassette_stats['path']}）
+                - 录制: {cassette_stats['recorded']} 次 / 回放: {cassette_stats['replayed']} 次
+                - 未匹配: {cassette_stats['misses']} 次
+                """)
+        
         st.markdown("---")
         st.markdown("### 关于")
         st.markdown("""
@@ -0,0 +1,224 @@
+"""优化循环基准：启动本地模拟接口，用OptimizationEngine跑完整的优化，不消耗API额度
+
+    python benchmarks/bench_engine.py                               # 全部场景，各5次迭代
+    python benchmarks/bench_engine.py --scenario baseline --scenario faults --iterations 10
+    python benchmarks/bench_engine.py --output before.json
+    python benchmarks/bench_engine.py --output after.json --compare before.json
+
+每个场景单独启动一个模拟服务（见 mock_server.py），连接池和限流器按地址隔离，不共享状态；
+响应缓存和评估缓存关闭，每次调用都发到模拟服务。报告每秒迭代数、每次迭代的调用数（按角色）、
+各阶段累计耗时、重试与失败次数和Python堆内存峰值（tracemalloc，会带来少量计时开销）。
+结果保存为JSON，--compare 与之前保存的结果逐项对比。
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, replace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_server import MockConfig, MockServer  # noqa: E402
+from spo_plus import EventBus, LLMService, OptimizationEngine, OptimizationState  # noqa: E402
+from spo_plus.resilience import ResilientCaller, RetryPolicy  # noqa: E402
+from spo_plus.usage import total_tokens  # noqa: E402
+
+# 场景：模拟服务配置 + 引擎参数；stream为True时执行阶段走流式接口（与界面的流式模式一致）
+SCENARIOS = {
+    "baseline": {"mock": MockConfig(latency="fixed:0.05")},
+    "long-tail": {"mock": MockConfig(latency="lognormal:0.05:0.8")},
+    "stream": {"mock": MockConfig(latency="fixed:0.05", stream_chunks=40, chunk_rate=400), "stream": True},
+    "faults": {"mock": MockConfig(latency="fixed:0.05", error_rate=0.1, throttle_rate=0.1, retry_after=0.1)},
+    "beam": {"mock": MockConfig(latency="fixed:0.05"), "engine": {"beam_width": 4}},
+    "batch-judging": {"mock": MockConfig(latency="fixed:0.05"), "engine": {"batch_judging": True}},
+}
+
+# 对比时展示的指标，以及数值越大越好还是越小越好
+COMPARE_METRICS = (
+    ("iterations_per_sec", "迭代/秒", True),
+    ("wall_time", "耗时(s)", False),
+    ("calls_per_iteration", "调用/迭代", False),
+    ("peak_memory_kb", "内存峰值(KB)", False),
+)
+
+
+class Collector:
+    """订阅事件总线，统计调用次数、重试、失败和各阶段耗时"""
+
+    def __init__(self, events):
+        self.reset()
+        events.subscribe(self)
+
+    def reset(self):
+        self.calls = {}
+        self.errors = 0
+        self.retries = 0
+        self.stage_time = {}
+
+    def __call__(self, event):
+        if event.type == "llm_call":
+            role = event.data.get("role") or "other"
+            self.calls[role] = self.calls.get(role, 0) + 1
+            self.errors += bool(event.data.get("error"))
+        elif event.type == "llm_retry":
+            self.retries += 1
+        elif event.type == "stage_finished":
+            self.stage_time[event.stage] = self.stage_time.get(event.stage, 0.0) + event.data["elapsed"]
+
+
+def stream_step(engine, state):
+    """与界面流式模式相同的一次迭代：执行阶段所有样本同时流式输出"""
+    new_prompt = engine.propose(state)
+    new_outputs, execute_errors = engine.execute_stream(state, new_prompt, lambda sample_id, delta, full: None)
+    evaluations, evaluate_errors = engine.evaluate(state, new_outputs)
+    analysis = engine.analyze(state, new_prompt)
+    errors = {name: value for name, value in (("execute", execute_errors), ("evaluate", evaluate_errors)) if value}
+    return engine.decide(state, new_prompt, new_outputs, evaluations, analysis, errors)
+
+
+def run_scenario(name, scenario, iterations, max_concurrency, mock_overrides):
+    mock = replace(scenario["mock"], **mock_overrides)
+    with MockServer(mock) as server:
+        events = EventBus()
+        service = LLMService(
+            api_key="bench", base_url=server.url, events=events,
+            resilience=ResilientCaller(RetryPolicy.from_env(hedge=False))
+        )
+        engine = OptimizationEngine(
+            service, max_concurrency=max_concurrency, events=events, **scenario.get("engine", {})
+        )
+        collector = Collector(events)
+        state = OptimizationState(task_description="基准测试任务", current_best_prompt="初始提示词",
+                                  max_iterations=iterations)
+
+        tracemalloc.start()
+        try:
+            start = time.perf_counter()
+            state, _ = engine.initialize(state)
+            init_time = time.perf_counter() - start
+            init_calls = sum(collector.calls.values())
+            collector.reset()
+            tracemalloc.reset_peak()
+
+            stream = scenario.get("stream")
+            start = time.perf_counter()
+            while not state.finished:
+                state, _ = stream_step(engine, state) if stream else engine.step(state)
+            wall_time = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        calls = sum(collector.calls.values())
+        return {
+            "name": name,
+            "config": {"mock": asdict(mock), "engine": scenario.get("engine", {}), "stream": bool(scenario.get("stream")),
+                       "max_concurrency": max_concurrency},
+            "samples": len(state.samples),
+            "iterations": state.current_iteration,
+            "init_time": round(init_time, 4),
+            "init_calls": init_calls,
+            "wall_time": round(wall_time, 4),
+            "iterations_per_sec": round(state.current_iteration / wall_time, 4) if wall_time else 0.0,
+            "calls": calls,
+            "calls_per_iteration": round(calls / max(1, state.current_iteration), 2),
+            "calls_by_role": collector.calls,
+            "errors": collector.errors,
+            "retries": collector.retries,
+            "stage_time": {stage: round(value, 4) for stage, value in sorted(collector.stage_time.items())},
+            "stage_time_per_iteration": {
+                stage: round(value / max(1, state.current_iteration), 4)
+                for stage, value in sorted(collector.stage_time.items())
+            },
+            "tokens": total_tokens(state.usage),
+            "peak_memory_kb": round(peak / 1024, 1),
+            "server": server.stats.snapshot(),
+        }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def print_result(result):
+    stages = " ".join(f"{stage}={value:.2f}s" for stage, value in result["stage_time_per_iteration"].items())
+    print(f"\n{result['name']}: {result['iterations']} 次迭代 / {result['samples']} 个样本")
+    print(f"  {result['iterations_per_sec']:.2f} 迭代/秒  {result['wall_time']:.2f} s  "
+          f"{result['calls_per_iteration']} 调用/迭代  重试 {result['retries']}  失败 {result['errors']}  "
+          f"服务端429 {result['server']['throttled']} / 500 {result['server']['errors']}  "
+          f"内存峰值 {result['peak_memory_kb']:.0f} KB")
+    print(f"  每次迭代各阶段耗时: {stages}")
+
+
+def compare(results, baseline):
+    """逐场景对比两次结果"""
+    previous = {item["name"]: item for item in baseline.get("scenarios", [])}
+    print(f"\n与 {baseline.get('revision') or '之前的结果'} 对比:")
+    for result in results:
+        old = previous.get(result["name"])
+        if not old:
+            continue
+        parts = []
+        for key, label, higher_is_better in COMPARE_METRICS:
+            before, after = old.get(key), result.get(key)
+            if not before or after is None:
+                continue
+            ratio = after / before
+            better = ratio >= 1 if higher_is_better else ratio <= 1
+            parts.append(f"{label} {before} → {after} ({ratio:.2f}x{'' if better else ' ↓'})")
+        print(f"  {result['name']}: " + "；".join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="优化循环基准（本地模拟接口）")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="只运行指定场景，可指定多次")
+    parser.add_argument("--iterations", type=int, default=5, help="每个场景的迭代次数")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="引擎的样本并发数")
+    parser.add_argument("--samples", type=int, default=None, help="覆盖模拟服务生成的样本数")
+    parser.add_argument("--latency", default=None, help="覆盖所有场景的延迟分布，如 lognormal:0.2:0.5")
+    parser.add_argument("--output", help="结果JSON文件")
+    parser.add_argument("--compare", help="与之前保存的结果JSON对比")
+    args = parser.parse_args()
+
+    mock_overrides = {}
+    if args.samples is not None:
+        mock_overrides["samples"] = args.samples
+    if args.latency:
+        mock_overrides["latency"] = args.latency
+
+    results = []
+    for name in args.scenario or list(SCENARIOS):
+        result = run_scenario(name, SCENARIOS[name], args.iterations, args.max_concurrency, mock_overrides)
+        print_result(result)
+        results.append(result)
+
+    report = {
+        "revision": _git_revision(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "iterations": args.iterations,
+        "scenarios": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\n结果已写入 {args.output}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
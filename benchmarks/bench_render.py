@@ -0,0 +1,128 @@
+"""界面重绘基准：用Streamlit的AppTest在不同历史长度下重复运行app.py，测量每次rerun的耗时
+
+    python benchmarks/bench_render.py                                  # 10 / 50 / 200 次迭代
+    python benchmarks/bench_render.py --iterations 200 --reruns 20 --output after.json
+    git show HEAD~1:app.py > /tmp/app_before.py && python benchmarks/bench_render.py --app /tmp/app_before.py
+
+会话状态中预置一次合成的优化运行（每次迭代带提示词、评估结果、分析和用量），分别停留在优化过程页和结果页，
+先运行一次预热（导入、缓存），之后每次rerun与自动模式下的 st.rerun() 相同。报告每次rerun耗时的中位数和p90，
+以及页面中的元素数量（展开框、文本框、图表）。AppTest不经过浏览器，测到的是脚本执行和生成元素的服务端耗时。
+需要安装requirements.txt中的streamlit。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+VIEWS = ("optimization", "results")
+
+
+def synthetic_state(iterations, samples=5, prompt_chars=1200):
+    """一次合成的优化运行，字段与app.py的会话状态一致"""
+    sample_list = [{"id": i + 1, "question": f"测试问题{i + 1}", "expected": "期望标准"} for i in range(samples)]
+    outputs = {sample["id"]: f"样本{sample['id']}的输出。" * 40 for sample in sample_list}
+    verdicts = ("B更好", "A更好", "相似")
+    history = []
+    for i in range(1, iterations + 1):
+        history.append({
+            "iteration": i,
+            "prompt": f"第{i}版提示词：" + "请按要求回答问题。" * (prompt_chars // 9),
+            "is_better": i % 3 == 0,
+            "evaluations": {sample["id"]: verdicts[(i + sample["id"]) % 3] for sample in sample_list},
+            "analysis": f"第{i}次迭代的变化分析。" * 20,
+            "context": {"prompt_tokens_before": 3000, "prompt_tokens": 1200, "included": samples, "truncated": 1,
+                        "omitted": 0},
+            "usage": {"calls": 12, "errors": 0, "unreported": 0, "prompt_tokens": 4000, "completion_tokens": 2000,
+                      "cached_tokens": 0, "latency": 30.0, "cost": 0.02, "by_role": {}},
+        })
+    return {
+        "initialized": True,
+        "api_configured": True,
+        "current_iteration": iterations,
+        "max_iterations": iterations,
+        "max_concurrency": 8,
+        "samples": sample_list,
+        "current_best_prompt": history[-1]["prompt"] if history else "初始提示词",
+        "current_best_outputs": outputs,
+        "new_prompt": history[-1]["prompt"] if history else "",
+        "new_outputs": outputs,
+        "evaluations": history[-1]["evaluations"] if history else {},
+        "analysis": history[-1]["analysis"] if history else "",
+        "optimization_history": history,
+        "usage": {},
+        "stop_reason": "",
+        "is_optimizing": False,
+        "available_models": [],
+    }
+
+
+def count_elements(at):
+    return {
+        "expanders": len(at.get("expandable")),
+        "text_areas": len(at.text_area),
+        "markdown": len(at.markdown),
+        "charts": len(at.get("arrow_vega_lite_chart")),
+    }
+
+
+def measure(app, view, iterations, reruns):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(app, default_timeout=300)
+    for key, value in synthetic_state(iterations).items():
+        at.session_state[key] = value
+    at.session_state["current_view"] = view
+    # 预热：首次运行包含导入和缓存填充
+    at.run()
+    if at.exception:
+        raise Exception(f"{view} 页运行失败: {at.exception[0].message}")
+    times = []
+    for _ in range(reruns):
+        start = time.perf_counter()
+        at.run()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return {
+        "view": view,
+        "iterations": iterations,
+        "median_ms": round(statistics.median(times) * 1000, 1),
+        "p90_ms": round(times[min(len(times) - 1, int(len(times) * 0.9))] * 1000, 1),
+        "elements": count_elements(at),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="界面重绘基准（Streamlit AppTest）")
+    parser.add_argument("--app", default=os.path.join(ROOT, "app.py"), help="要测量的app.py")
+    parser.add_argument("--iterations", type=int, action="append", help="历史长度，可指定多次，默认10/50/200")
+    parser.add_argument("--view", action="append", choices=VIEWS, help="只测量指定页面")
+    parser.add_argument("--reruns", type=int, default=10, help="每种情况测量的rerun次数")
+    parser.add_argument("--output", help="结果JSON文件")
+    args = parser.parse_args()
+
+    # 运行存储和缓存放到临时目录，不影响本机保存的运行
+    os.environ.setdefault("LLM_CACHE_DIR", tempfile.mkdtemp(prefix="spo-bench-"))
+    sys.path.insert(0, ROOT)
+
+    results = []
+    for view in args.view or VIEWS:
+        for iterations in args.iterations or (10, 50, 200):
+            result = measure(os.path.abspath(args.app), view, iterations, args.reruns)
+            elements = " ".join(f"{name}={count}" for name, count in result["elements"].items())
+            print(f"{view:>12} {iterations:>4} 次迭代: 中位数 {result['median_ms']:>8.1f} ms  "
+                  f"p90 {result['p90_ms']:>8.1f} ms  {elements}")
+            results.append(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"app": args.app, "reruns": args.reruns, "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""流式解析微基准：逐行解码 + json.loads + 字符串累加 对比 增量字节解析
+
+    python benchmarks/bench_sse.py                     # 合成的 2000/5000/20000 块流
+    python benchmarks/bench_sse.py --file capture.sse  # 录制的原始SSE响应体
+
+合成流的每一块与OpenAI兼容接口（如SiliconFlow上的DeepSeek-V3）返回的格式一致，
+按 --read-size 字节切分以模拟网络读取。两种实现都接上与界面相同的合并渲染（渲染函数为空操作）：
+改造前每个增量回调都拿到累计文本并保存最新一份，字符串累加时要复制全文；
+改造后回调只带增量，RenderCoalescer在渲染时才拼接。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spo_plus.render import RENDER_MAX_CHARS, RenderCoalescer  # noqa: E402
+from spo_plus.sse import ChatStream, orjson  # noqa: E402
+
+
+def synthetic_stream(chunks, delta="这是一段流式输出的内容，"):
+    """生成包含chunks个增量块、结束块、usage块和[DONE]的原始SSE响应体"""
+    lines = []
+    for i in range(chunks):
+        lines.append("data: " + json.dumps({
+            "id": "0195c1e1d0a4c2f6", "object": "chat.completion.chunk", "created": 1742000000,
+            "model": "deepseek-ai/DeepSeek-V3",
+            "choices": [{"index": 0, "delta": {"content": delta, "reasoning_content": None, "role": "assistant"},
+                         "finish_reason": None, "content_filter_results": {}}],
+            "system_fingerprint": "", "usage": None
+        }, ensure_ascii=False) + "\n\n")
+    lines.append("data: " + json.dumps({
+        "id": "0195c1e1d0a4c2f6", "object": "chat.completion.chunk", "created": 1742000000,
+        "model": "deepseek-ai/DeepSeek-V3",
+        "choices": [{"index": 0, "delta": {"content": ""}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 120, "completion_tokens": chunks * 8, "total_tokens": 120 + chunks * 8}
+    }) + "\n\n")
+    lines.append("data: [DONE]\n\n")
+    return "".join(lines).encode("utf-8")
+
+
+def split_reads(raw, read_size):
+    return [raw[i:i + read_size] for i in range(0, len(raw), read_size)]
+
+
+def _iter_lines(reads):
+    """与requests.Response.iter_lines相同的按行切分"""
+    pending = None
+    for chunk in reads:
+        if pending is not None:
+            chunk = pending + chunk
+        lines = chunk.splitlines()
+        if lines and lines[-1] and chunk and lines[-1][-1] == chunk[-1]:
+            pending = lines.pop()
+        else:
+            pending = None
+        yield from lines
+    if pending is not None:
+        yield pending
+
+
+def legacy_parse(reads, callback):
+    """改造前的实现：每行解码、json.loads、full_response += delta"""
+    full_response = ""
+    for line in _iter_lines(reads):
+        if not line:
+            continue
+        line = line.decode("utf-8")
+        if not line.startswith("data: "):
+            continue
+        data = line[6:]
+        if data == "[DONE]":
+            break
+        try:
+            json_data = json.loads(data)
+        except json.JSONDecodeError:
+            continue
+        delta = json_data.get("choices", [{}])[0].get("delta", {}).get("content", "") or ""
+        if delta:
+            full_response += delta
+            callback(delta, full_response)
+    return full_response
+
+
+class LegacyCoalescer:
+    """改造前的RenderCoalescer：回调 callback(delta, full)，保存最新的累计文本，积攒max_chars字渲染一次"""
+
+    def __init__(self, render, max_chars=RENDER_MAX_CHARS):
+        self.render = render
+        self.max_chars = max_chars
+        self._pending = 0
+        self._latest = None
+
+    def __call__(self, delta, full_response):
+        self._pending += len(delta)
+        self._latest = full_response
+        if self._pending >= self.max_chars:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self.render(self._latest)
+            self._pending = 0
+
+
+def incremental_parse(reads, callback, loads=None):
+    stream = ChatStream(loads=loads)
+    for chunk in reads:
+        delta = stream.feed(chunk)
+        if delta:
+            callback(delta)
+        if stream.done:
+            break
+    else:
+        delta = stream.close()
+        if delta:
+            callback(delta)
+    return stream.text
+
+
+def measure(fn, make_callback, reads, repeat):
+    """取repeat次中最快的一次，计时包括合并渲染；渲染次数只由字数决定，与运行快慢无关"""
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        callback = make_callback()
+        start = time.perf_counter()
+        result = fn(reads, callback)
+        callback.flush()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def run(name, raw, read_size, repeat):
+    reads = split_reads(raw, read_size)
+    events = raw.count(b"\n\n")
+    legacy = lambda: LegacyCoalescer(lambda text: None)  # noqa: E731
+    coalescer = lambda: RenderCoalescer(lambda text: None, interval=float("inf"))  # noqa: E731
+    parsers = [
+        ("逐行+json+累加", legacy_parse, legacy),
+        ("增量+json", lambda r, cb: incremental_parse(r, cb, json.loads), coalescer),
+    ]
+    if orjson:
+        parsers.append(("增量+orjson", lambda r, cb: incremental_parse(r, cb, orjson.loads), coalescer))
+
+    print(f"\n{name}: {events} 个事件, {len(raw) / 1024:.0f} KB, {len(reads)} 次读取")
+    baseline = None
+    expected = None
+    for label, fn, make_callback in parsers:
+        elapsed, text = measure(fn, make_callback, reads, repeat)
+        if expected is None:
+            expected = text
+        assert text == expected, f"{label} 解析结果不一致"
+        baseline = baseline or elapsed
+        print(f"  {label:<14} {elapsed * 1000:8.1f} ms  {events / elapsed:10.0f} 事件/s  "
+              f"{len(raw) / elapsed / 1e6:7.1f} MB/s  x{baseline / elapsed:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式解析微基准")
+    parser.add_argument("--file", action="append", help="录制的原始SSE响应体，可指定多次")
+    parser.add_argument("--chunks", type=int, nargs="+", default=[2000, 5000, 20000], help="合成流的增量块数")
+    parser.add_argument("--read-size", type=int, default=1024, help="模拟每次网络读取的字节数")
+    parser.add_argument("--repeat", type=int, default=5, help="取多次运行中的最快一次")
+    args = parser.parse_args()
+
+    if args.file:
+        for path in args.file:
+            with open(path, "rb") as f:
+                run(path, f.read(), args.read_size, args.repeat)
+    else:
+        for chunks in args.chunks:
+            run(f"合成流 {chunks} 块", synthetic_stream(chunks), args.read_size, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
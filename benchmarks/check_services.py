@@ -0,0 +1,136 @@
+"""同步与异步服务的一致性检查：对同一模拟接口分别用LLMService和AsyncLLMService发出相同的调用
+
+    python benchmarks/check_services.py
+
+两种服务共用BaseLLMService的请求体、缓存和响应处理，只有网络I/O不同。这里逐项比较：
+执行（普通与流式）的输出、评估和批量评估的结果结构、每种调用发到模拟接口的请求数，
+持续返回429时普通与流式执行各自的请求次数、限流计数和并发上限，
+以及服务端拒绝stream_options时流式执行的回退。每项检查各用一个新的模拟服务，限流器按地址隔离。
+有不一致时打印差异并以非零状态退出。
+"""
+import asyncio
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_server import MockConfig, MockServer  # noqa: E402
+from spo_plus import LLMService  # noqa: E402
+from spo_plus.async_service import AsyncLLMService  # noqa: E402
+from spo_plus.resilience import ResilientCaller, RetryPolicy  # noqa: E402
+
+PROMPT = "你是一个简洁的助手。"
+TASK = "回答用户的问题"
+ITEMS = [
+    {"id": 1, "question": "问题一", "output_a": "旧回答一", "output_b": "新回答一"},
+    {"id": 2, "question": "问题二", "output_a": "旧回答二", "output_b": "新回答二"},
+    {"id": 3, "question": "问题三", "output_a": "相同回答", "output_b": "相同回答"},
+]
+
+
+def scenario(service):
+    """同步服务上的调用序列，返回可比较的结果"""
+    deltas = []
+    return {
+        "execute": service.execute_prompt(PROMPT, "问题一"),
+        "stream": service.execute_prompt_stream(PROMPT, "问题一", deltas.append),
+        "stream_deltas": "".join(deltas),
+        "evaluate": sorted(service.evaluate_outputs("旧回答", "新回答", TASK, "问题一")),
+        "batch": sorted(service.evaluate_outputs_batch(ITEMS, TASK)[0]),
+        "candidates": len(service.optimize_prompt_candidates(PROMPT, "输出", TASK, n=3)),
+    }
+
+
+async def ascenario(service):
+    """异步服务上相同的调用序列"""
+    deltas = []
+    async with service:
+        return {
+            "execute": await service.execute_prompt(PROMPT, "问题一"),
+            "stream": await service.execute_prompt_stream(PROMPT, "问题一", deltas.append),
+            "stream_deltas": "".join(deltas),
+            "evaluate": sorted(await service.evaluate_outputs("旧回答", "新回答", TASK, "问题一")),
+            "batch": sorted((await service.evaluate_outputs_batch(ITEMS, TASK))[0]),
+            "candidates": len(await service.optimize_prompt_candidates(PROMPT, "输出", TASK, n=3)),
+        }
+
+
+def throttled(service):
+    """普通与流式执行各一次，返回各自的错误前缀"""
+    results = []
+    for call in (lambda: service.execute_prompt(PROMPT, "问题一"),
+                 lambda: service.execute_prompt_stream(PROMPT, "问题二", lambda delta: None)):
+        try:
+            call()
+            results.append("成功")
+        except Exception as e:
+            results.append(str(e).split(":")[0])
+    return results
+
+
+async def athrottled(service):
+    results = []
+    async with service:
+        for call in (lambda: service.execute_prompt(PROMPT, "问题一"),
+                     lambda: service.execute_prompt_stream(PROMPT, "问题二", lambda delta: None)):
+            try:
+                await call()
+                results.append("成功")
+            except Exception as e:
+                results.append(str(e).split(":")[0])
+    return results
+
+
+def streamed_twice(service):
+    """连续两次流式执行：第一次被拒绝后去掉stream_options重试，第二次直接不带"""
+    return [service.execute_prompt_stream(PROMPT, question, lambda delta: None) for question in ("问题一", "问题二")]
+
+
+async def astreamed_twice(service):
+    async with service:
+        return [await service.execute_prompt_stream(PROMPT, question, lambda delta: None)
+                for question in ("问题一", "问题二")]
+
+
+def run(config, sync_check, async_check):
+    """分别用两种服务跑一次，返回 (同步结果, 异步结果)，结果中带模拟接口的请求统计和限流计数"""
+    policy = RetryPolicy(base_delay=0.01, max_delay=0.05)
+    results = []
+    for make, check in ((LLMService, sync_check), (AsyncLLMService, async_check)):
+        with MockServer(config) as server:
+            service = make(base_url=server.url, resilience=ResilientCaller(policy))
+            result = check(service)
+            if asyncio.iscoroutine(result):
+                result = asyncio.run(result)
+            stats = server.stats.snapshot()
+            results.append({
+                "result": result,
+                "requests": stats["requests"],
+                "throttled": stats["throttled"],
+                "rate_limiter_throttled": service.get_rate_limit_stats()["throttled"],
+                "concurrency_limit": service.get_rate_limit_stats()["concurrency_limit"],
+            })
+    return results
+
+
+def compare(name, sync_result, async_result):
+    mismatches = [key for key in sync_result if sync_result[key] != async_result[key]]
+    print(f"{name}: {'不一致' if mismatches else '一致'}，请求数 {sync_result['requests']} / {async_result['requests']}")
+    for key in mismatches:
+        print(f"  {key}:\n    同步: {sync_result[key]}\n    异步: {async_result[key]}")
+    return not mismatches
+
+
+def main():
+    ok = compare("调用", *run(MockConfig(latency="fixed:0.01", stream_chunks=20, chunk_rate=0), scenario, ascenario))
+    ok &= compare("限流", *run(MockConfig(latency="fixed:0", throttle_rate=1.0, retry_after=0.01),
+                               throttled, athrottled))
+    ok &= compare("拒绝stream_options", *run(MockConfig(latency="fixed:0", chunk_rate=0, reject_stream_options=True),
+                                             streamed_twice, astreamed_twice))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,334 @@
+"""本地模拟的OpenAI兼容接口（/v1/chat/completions），用于不消耗API额度的基准测试和联调
+
+    python benchmarks/mock_server.py --port 18080 --latency lognormal:0.3:0.5 --error-rate 0.02
+    DEFAULT_API_BASE_URL=http://127.0.0.1:18080 streamlit run app.py
+
+按请求内容识别调用类型（生成样本、优化、执行、评估、批量评估、分析）并返回能被 spo_plus.prompts 解析的内容，
+响应带usage。可配置：
+- 延迟分布：fixed:秒 / uniform:最小:最大 / normal:均值:标准差 / lognormal:中位数:sigma / exp:均值，
+  可按调用类型单独指定
+- 流式：请求带 stream=true 时按 chunk_rate 块/秒输出 stream_chunks 个增量块，
+  请求带 stream_options.include_usage 时最后一块带usage
+- 故障注入：按比例返回500，或返回带Retry-After的429；可以拒绝带stream_options的请求（返回400）
+"""
+import argparse
+import json
+import math
+import random
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 按提示词开头识别调用类型，与 spo_plus.prompts 中的模板一致
+KINDS = (
+    ("samples", "请为以下任务生成"),
+    ("optimize", "请优化以下提示词"),
+    ("evaluate_batch", "请逐一评估"),
+    ("evaluate", "请评估以下两个输出"),
+    ("analyze", "请分析以下提示词的变化"),
+)
+
+
+def parse_latency(spec):
+    """把延迟分布描述解析为无参采样函数的工厂：rng -> 秒数"""
+    spec = str(spec or "0").strip()
+    name, _, rest = spec.partition(":")
+    if not rest:
+        try:
+            value = float(name)
+        except ValueError:
+            raise Exception(f"无法解析的延迟分布: {spec}")
+        return lambda rng: value
+    params = [float(part) for part in rest.split(":")]
+    if name == "fixed":
+        return lambda rng: params[0]
+    if name == "uniform":
+        return lambda rng: rng.uniform(params[0], params[1])
+    if name == "normal":
+        return lambda rng: max(0.0, rng.gauss(params[0], params[1]))
+    if name == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(params[0]), params[1])
+    if name == "exp":
+        return lambda rng: rng.expovariate(1.0 / params[0])
+    raise Exception(f"未知的延迟分布: {name}")
+
+
+@dataclass
+class MockConfig:
+    latency: str = "fixed:0.05"
+    # 按调用类型覆盖延迟分布，如 {"execute": "lognormal:0.3:0.5"}
+    kind_latency: dict = field(default_factory=dict)
+    samples: int = 5                  # 生成样本调用返回的样本数
+    output_chars: int = 400           # 执行和优化调用返回的文本长度
+    stream_chunks: int = 40           # 流式响应的增量块数
+    chunk_rate: float = 400.0         # 流式响应每秒输出的块数，0表示不限速
+    error_rate: float = 0.0           # 返回500的比例
+    throttle_rate: float = 0.0        # 返回429的比例
+    retry_after: float = 0.05         # 429响应的Retry-After秒数
+    reject_stream_options: bool = False  # 对带stream_options的请求返回400，模拟不接受该字段的服务端
+    better_rate: float = 0.4          # 评估结论为"B更好"的比例，其余在A更好和相似之间平分
+    seed: int = 0
+
+
+class MockStats:
+    """按调用类型统计请求数和注入的故障数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = {}
+        self.errors = 0
+        self.throttled = 0
+        self.streams = 0
+
+    def add(self, name, kind=None):
+        with self._lock:
+            if name == "request":
+                self.requests[kind] = self.requests.get(kind, 0) + 1
+            else:
+                setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "requests": dict(self.requests),
+                "total": sum(self.requests.values()),
+                "errors": self.errors,
+                "throttled": self.throttled,
+                "streams": self.streams,
+            }
+
+
+def request_kind(content):
+    for kind, prefix in KINDS:
+        if content.startswith(prefix):
+            return kind
+    return "execute"
+
+
+def _filler(chars, seed):
+    text = f"这是模拟输出{seed}，用于基准测试。"
+    return (text * (chars // len(text) + 1))[:chars]
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端关闭连接池时断开的空闲连接不算错误
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class MockServer:
+    """在后台线程中运行的模拟服务，可作为上下文管理器使用"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or MockConfig()
+        self.stats = MockStats()
+        self._rng = random.Random(self.config.seed)
+        self._rng_lock = threading.Lock()
+        self._latency = parse_latency(self.config.latency)
+        self._kind_latency = {kind: parse_latency(spec) for kind, spec in self.config.kind_latency.items()}
+        self.httpd = _HTTPServer((host, port), self._handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _random(self):
+        with self._rng_lock:
+            return self._rng.random()
+
+    def _sample_latency(self, kind):
+        with self._rng_lock:
+            return self._kind_latency.get(kind, self._latency)(self._rng)
+
+    def respond(self, kind, content):
+        """返回 (回复文本, usage)"""
+        config = self.config
+        roll = self._random()
+        if kind == "samples":
+            text = json.dumps([
+                {"question": f"测试问题{i + 1}：{_filler(40, i)}", "expected": "期望标准"} for i in range(config.samples)
+            ], ensure_ascii=False)
+        elif kind == "optimize":
+            text = f"优化后的提示词（版本{int(roll * 1e6)}）：" + _filler(config.output_chars, int(roll * 100))
+        elif kind == "evaluate":
+            text = "评估：" + self._verdict(roll)
+        elif kind == "evaluate_batch":
+            ids = re.findall(r"样本ID: (\S+)", content)
+            text = json.dumps([
+                {"id": sample_id, "winner": {"B更好": "B", "A更好": "A"}.get(self._verdict(self._random()), "similar"),
+                 "reason": "模拟"} for sample_id in ids
+            ], ensure_ascii=False)
+        elif kind == "analyze":
+            text = "变化分析：" + _filler(200, 0)
+        else:
+            text = _filler(config.output_chars, len(content))
+        usage = {
+            "prompt_tokens": max(1, len(content) // 2),
+            "completion_tokens": max(1, len(text) // 2),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        return text, usage
+
+    def _verdict(self, roll):
+        if roll < self.config.better_rate:
+            return "B更好"
+        return "A更好" if roll < (1 + self.config.better_rate) / 2 else "相似"
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                content = "".join(message.get("content", "") for message in body.get("messages", []))
+                kind = request_kind(content)
+                server.stats.add("request", kind)
+                if server.config.reject_stream_options and "stream_options" in body:
+                    server.stats.add("errors")
+                    return self._json(400, {"error": {"message": "Unrecognized request argument: stream_options"}})
+                time.sleep(server._sample_latency(kind))
+
+                roll = server._random()
+                if roll < server.config.throttle_rate:
+                    server.stats.add("throttled")
+                    return self._json(429, {"error": {"message": "rate limited"}},
+                                      {"Retry-After": str(server.config.retry_after)})
+                if roll < server.config.throttle_rate + server.config.error_rate:
+                    server.stats.add("errors")
+                    return self._json(500, {"error": {"message": "injected error"}})
+
+                if body.get("stream"):
+                    server.stats.add("streams")
+                    return self._stream(body, *server.respond(kind, content))
+                # 支持n参数：一次请求返回多个候选
+                choices = [server.respond(kind, content) for _ in range(max(1, int(body.get("n") or 1)))]
+                usage = dict(choices[0][1])
+                usage["completion_tokens"] = sum(item[1]["completion_tokens"] for item in choices)
+                usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+                self._json(200, {
+                    "id": "mock", "object": "chat.completion", "model": body.get("model"),
+                    "choices": [
+                        {"index": index, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}
+                        for index, (text, _) in enumerate(choices)
+                    ],
+                    "usage": usage,
+                })
+
+            def _json(self, status, data, headers=None):
+                payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _chunk(self, text):
+                data = text.encode("utf-8")
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def _stream(self, body, text, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                count = max(1, server.config.stream_chunks)
+                size = max(1, math.ceil(len(text) / count))
+                interval = 1.0 / server.config.chunk_rate if server.config.chunk_rate > 0 else 0.0
+                for start in range(0, len(text), size):
+                    self._chunk("data: " + json.dumps({
+                        "object": "chat.completion.chunk", "model": body.get("model"),
+                        "choices": [{"index": 0, "delta": {"content": text[start:start + size]}, "finish_reason": None}],
+                    }, ensure_ascii=False) + "\n\n")
+                    if interval:
+                        time.sleep(interval)
+                last = {
+                    "object": "chat.completion.chunk", "model": body.get("model"),
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                }
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    last["usage"] = usage
+                self._chunk("data: " + json.dumps(last) + "\n\n")
+                self._chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def add_mock_arguments(parser):
+    defaults = MockConfig()
+    parser.add_argument("--latency", default=defaults.latency, help="延迟分布，如 fixed:0.05、lognormal:0.3:0.5")
+    parser.add_argument("--kind-latency", action="append", default=[],
+                        help="按调用类型覆盖延迟，如 execute=lognormal:0.3:0.5，可指定多次")
+    parser.add_argument("--samples", type=int, default=defaults.samples, help="生成的测试样本数")
+    parser.add_argument("--output-chars", type=int, default=defaults.output_chars, help="执行/优化输出的长度")
+    parser.add_argument("--stream-chunks", type=int, default=defaults.stream_chunks, help="流式响应的增量块数")
+    parser.add_argument("--chunk-rate", type=float, default=defaults.chunk_rate, help="流式响应每秒块数，0为不限速")
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate, help="返回500的比例")
+    parser.add_argument("--throttle-rate", type=float, default=defaults.throttle_rate, help="返回429的比例")
+    parser.add_argument("--retry-after", type=float, default=defaults.retry_after, help="429响应的Retry-After秒数")
+    parser.add_argument("--reject-stream-options", action="store_true", help="对带stream_options的请求返回400")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def config_from_args(args):
+    kind_latency = dict(item.split("=", 1) for item in args.kind_latency)
+    return MockConfig(
+        latency=args.latency, kind_latency=kind_latency, samples=args.samples, output_chars=args.output_chars,
+        stream_chunks=args.stream_chunks, chunk_rate=args.chunk_rate, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+        reject_stream_options=args.reject_stream_options, seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的OpenAI兼容接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    server = MockServer(config_from_args(args), host=args.host, port=args.port)
+    print(f"模拟服务已启动: {server.url}/v1/chat/completions", flush=True)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(json.dumps(server.stats.snapshot(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""SPO+ 提示优化核心库（与Streamlit界面解耦）"""
+from .async_service import AsyncLLMService, BackgroundLoop, get_background_loop
+from .cache import JudgmentCache, ResponseCache, cache_key, get_judgment_cache, get_response_cache
+from .cassette import Cassette
+from .events import Event, EventBus, EventQueue
+from .engine import (
+    OptimizationEngine,
+    OptimizationState,
+    get_optimization_history_summary,
+    should_update_best_prompt,
+)
+from .llm_service import LLMService
+from .render import RenderCoalescer, StreamBuffer
+from .ratelimit import RateLimitConfig, RateLimiter, get_rate_limiter
+from .resilience import LatencyTracker, ResilientCaller, RetryPolicy
+from .store import Run, RunStore, get_run_store
+from .tracing import Span, Tracer
+from .transport import PoolConfig, TransportStats, close_all_sessions, get_session
+from .usage import Budget, UsageMeter
+from .worker import RunWorker, get_worker, start_worker
+
+__all__ = [
+    "AsyncLLMService",
+    "BackgroundLoop",
+    "Budget",
+    "Cassette",
+    "Event",
+    "EventBus",
+    "EventQueue",
+    "JudgmentCache",
+    "LLMService",
+    "LatencyTracker",
+    "OptimizationEngine",
+    "OptimizationState",
+    "PoolConfig",
+    "RateLimitConfig",
+    "RateLimiter",
+    "RenderCoalescer",
+    "ResilientCaller",
+    "ResponseCache",
+    "RetryPolicy",
+    "Run",
+    "RunStore",
+    "RunWorker",
+    "Span",
+    "StreamBuffer",
+    "Tracer",
+    "TransportStats",
+    "UsageMeter",
+    "cache_key",
+    "close_all_sessions",
+    "get_background_loop",
+    "get_judgment_cache",
+    "get_optimization_history_summary",
+    "get_rate_limiter",
+    "get_response_cache",
+    "get_run_store",
+    "get_session",
+    "get_worker",
+    "should_update_best_prompt",
+    "start_worker",
+]
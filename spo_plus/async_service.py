@@ -0,0 +1,346 @@
+"""异步LLM服务：基于单个httpx.AsyncClient的协程版LLMService
+
+所有方法与LLMService同名同参，返回协程；请求体、缓存和响应处理继承自BaseLLMService，
+这里只有httpx的网络I/O和asyncio的并发。execute_all / evaluate_all 在所有样本上并发扇出请求；
+BackgroundLoop让Streamlit脚本线程提交协程后继续刷新界面，而不是阻塞等待。
+"""
+import asyncio
+import inspect
+import threading
+import time
+from contextlib import AsyncExitStack, asynccontextmanager
+
+import httpx
+
+from . import prompts
+from .prompts import CHAT_ENDPOINT, message_content
+from .parallel import DEFAULT_MAX_CONCURRENCY
+from .llm_service import EVAL_BATCH_MAX_CHARS, BaseLLMService
+from .ratelimit import estimate_tokens
+from .resilience import is_context_overflow
+from .sse import ChatStream
+
+
+class AsyncLLMService(BaseLLMService):
+    def __init__(self, api_key=None, base_url=None, pool_config=None, transport=None, response_cache=None,
+                 judgment_cache=None, models=None, events=None, rate_limiter=None, resilience=None, cassette=None):
+        super().__init__(api_key, base_url, pool_config, response_cache, judgment_cache, models, events,
+                         rate_limiter, resilience, cassette)
+        # 允许注入httpx传输层，便于对接本地OpenAI兼容替身
+        self._transport = transport
+        self._client = None
+
+    @property
+    def client(self):
+        """懒创建AsyncClient，保证它绑定在实际运行协程的事件循环上"""
+        if self._client is None:
+            maxsize = self.pool_config.maxsize_for(httpx.URL(self.base_url).host)
+            limits = httpx.Limits(max_connections=maxsize, max_keepalive_connections=maxsize)
+            transport = self._transport
+            # 录制/回放包装在传输层之外
+            if self.cassette is not None:
+                transport = self.cassette.async_transport(transport or httpx.AsyncHTTPTransport(limits=limits))
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.get_headers(),
+                limits=limits,
+                timeout=httpx.Timeout(self.pool_config.read_timeout, connect=self.pool_config.connect_timeout),
+                transport=transport,
+            )
+        return self._client
+
+    def get_headers(self):
+        headers = super().get_headers()
+        if self.pool_config.gzip:
+            headers["Accept-Encoding"] = "gzip, deflate"
+        return headers
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    @asynccontextmanager
+    async def _request(self, endpoint, data, stream=False):
+        """经过限流器发出请求，产出未检查状态码的响应，退出时关闭响应；与LLMService._request相同
+
+        并发名额一直占用到退出；非流式请求在产出前读完响应体。429在Retry-After之后重新排队。
+        """
+        model = data.get("model")
+        tokens = estimate_tokens(data)
+        attempt = 0
+        while True:
+            async with self.rate_limiter.aslot(model, tokens) as started, \
+                    self.client.stream("POST", f"/{endpoint}", json=data) as response:
+                if not self._throttled(response, attempt, started):
+                    if not stream:
+                        await response.aread()
+                    yield response
+                    return
+            attempt += 1
+
+    async def _request_json(self, endpoint, data):
+        async with self._request(endpoint, data) as response:
+            return self._read_json(response, data)
+
+    async def _open_stream(self, endpoint, data):
+        """建立流式连接，返回 (AsyncExitStack, 响应)；关闭AsyncExitStack时关闭响应并归还并发名额"""
+        stack = AsyncExitStack()
+        response = await stack.enter_async_context(self._request(endpoint, data, stream=True))
+        try:
+            response.raise_for_status()
+        except Exception:
+            await stack.aclose()
+            raise
+        return stack, response
+
+    async def call_llm_api(self, endpoint, data, role=None):
+        start = time.perf_counter()
+        try:
+            result = await self.resilience.acall(
+                role, lambda: self._request_json(endpoint, data), on_retry=self._on_retry(role)
+            )
+        except Exception as e:
+            raise self._call_failed(data, role, start, e) from e
+        return self._call_done(data, role, start, result)
+
+    @asynccontextmanager
+    async def call_llm_api_stream(self, endpoint, data, role=None):
+        """流式调用LLM API，产出已检查状态码的响应；只重试建立连接阶段，与LLMService相同"""
+        try:
+            try:
+                stack, response = await self._connect_stream(endpoint, self._stream_payload(data), role)
+            except Exception as e:
+                if not self._stream_options_rejected(e):
+                    raise
+                stack, response = await self._connect_stream(endpoint, self._stream_payload(data, usage=False), role)
+                self.stream_usage = False
+        except Exception as e:
+            raise Exception(f"流式API调用失败: {str(e)}")
+        async with stack:
+            yield response
+
+    async def _connect_stream(self, endpoint, payload, role):
+        return await self.resilience.acall(
+            None, lambda: self._open_stream(endpoint, payload), hedge=False, on_retry=self._on_retry(role)
+        )
+
+    async def generate_samples(self, task_description):
+        response = await self.call_llm_api(CHAT_ENDPOINT, self._samples_payload(task_description), role="optimizer")
+        return prompts.parse_samples(message_content(response))
+
+    async def execute_prompt(self, prompt, question):
+        """执行提示词获取输出"""
+        payload = self._execute_payload(prompt, question)
+        key, cached = self._cached_execute(payload)
+        if cached is not None:
+            self._cache_hit("executor", payload["model"], "response")
+            return cached
+
+        content = message_content(await self.call_llm_api(CHAT_ENDPOINT, payload, role="executor"))
+        self._store_response(key, content)
+        return content
+
+    async def execute_prompt_stream(self, prompt, question, callback):
+        """带流式输出的执行提示词，callback(本块新增文本)可以是普通函数或协程函数"""
+        data = self._execute_payload(prompt, question)
+        key, cached = self._cached_execute(data)
+        if cached is not None:
+            self._cache_hit("executor", data["model"], "response")
+            result = callback(cached)
+            if inspect.isawaitable(result):
+                await result
+            return cached
+
+        stream = ChatStream()
+        start = time.perf_counter()
+        # 流式响应在读完之前一直占用并发名额
+        async with self.call_llm_api_stream(CHAT_ENDPOINT, data, role="executor") as response:
+            async for chunk in response.aiter_bytes():
+                await self._emit_delta(stream.feed(chunk), callback)
+                if stream.done:
+                    break
+            else:
+                await self._emit_delta(stream.close(), callback)
+        return self._stream_done(data, stream, start, key)
+
+    async def _emit_delta(self, delta, callback):
+        if not delta:
+            return
+        self.events.publish("tokens", chars=len(delta))
+        result = callback(delta)
+        if inspect.isawaitable(result):
+            await result
+
+    async def optimize_prompt(self, current_prompt, current_output, task_description, history=""):
+        """优化提示词"""
+        response = await self.call_llm_api(
+            CHAT_ENDPOINT, self._optimize_payload(current_prompt, current_output, task_description, history),
+            role="optimizer"
+        )
+        return message_content(response)
+
+    async def optimize_prompt_candidates(self, current_prompt, current_output, task_description, history="", n=1):
+        """一次生成n个候选提示词，服务端不支持n参数时并发补足"""
+        payload = self._optimize_payload(current_prompt, current_output, task_description, history, n)
+        candidates = self._candidates(await self.call_llm_api(CHAT_ENDPOINT, payload, role="optimizer"))
+
+        missing = n - len(candidates)
+        if missing > 0:
+            results = await asyncio.gather(
+                *(self.optimize_prompt(current_prompt, current_output, task_description, history) for _ in range(missing)),
+                return_exceptions=True
+            )
+            candidates += [result for result in results if isinstance(result, str)]
+
+        return self._unique(candidates, n)
+
+    async def evaluate_outputs(self, output_a, output_b, task_description, question):
+        """评估输出质量"""
+        verdict = self._known_verdict(output_a, output_b, task_description, question)
+        if verdict is not None:
+            return verdict
+
+        payload = self._evaluate_payload(output_a, output_b, task_description, question)
+        verdict = prompts.parse_verdict(message_content(await self.call_llm_api(CHAT_ENDPOINT, payload, role="evaluator")))
+        self._store_verdict(output_a, output_b, task_description, question, verdict)
+        return verdict
+
+    async def evaluate_outputs_batch(self, items, task_description, max_chars=EVAL_BATCH_MAX_CHARS,
+                                     max_workers=DEFAULT_MAX_CONCURRENCY):
+        """一次评估请求评估多个样本，返回按样本ID排序的 (verdicts, errors)，各批并发发出"""
+        verdicts, pending = self._pending_judgments(items, task_description)
+        chunks = prompts.chunk_judgments(pending, task_description, max_chars)
+        parsed_chunks = await asyncio.gather(
+            *(self._judge_chunk(chunk, task_description) for chunk in chunks), return_exceptions=True
+        )
+        errors = {}
+        fallback = self._collect_judgments(chunks, parsed_chunks, task_description, verdicts, errors)
+
+        async def run(item):
+            return await self.evaluate_outputs(item["output_a"], item["output_b"], task_description, item["question"])
+
+        results, fallback_errors = await _gather_by_sample(
+            fallback, run, max_workers, None, default=prompts.parse_verdict("")
+        )
+        verdicts.update(results)
+        errors.update(fallback_errors)
+        return {sample_id: verdicts[sample_id] for sample_id in sorted(verdicts)}, errors
+
+    async def _judge_chunk(self, chunk, task_description):
+        """批量评估一批样本，返回解析成功的 {样本ID: 评估结果}；单个样本直接交给逐样本评估"""
+        if len(chunk) < 2:
+            return {}
+        payload = self._judge_payload(chunk, task_description)
+        try:
+            content = message_content(await self.call_llm_api(CHAT_ENDPOINT, payload, role="evaluator"))
+        except Exception as e:
+            # 只有超出上下文长度时拆分才有意义，其他错误原样抛出
+            if not is_context_overflow(e):
+                raise
+            middle = len(chunk) // 2
+            first, second = await asyncio.gather(
+                self._judge_chunk(chunk[:middle], task_description),
+                self._judge_chunk(chunk[middle:], task_description)
+            )
+            return {**first, **second}
+        return prompts.parse_batch_verdicts(content, [item["id"] for item in chunk])
+
+    async def analyze_changes(self, old_prompt, new_prompt, task_description):
+        """分析提示词变化"""
+        response = await self.call_llm_api(
+            CHAT_ENDPOINT, self._analyze_payload(old_prompt, new_prompt, task_description), role="analyzer"
+        )
+        return message_content(response)
+
+    async def execute_all(self, prompt, samples, max_concurrency=DEFAULT_MAX_CONCURRENCY, on_result=None):
+        """并发执行所有样本，返回按样本ID排序的 (outputs, errors)
+
+        on_result在事件循环线程中回调，不能直接操作Streamlit元素
+        """
+        async def run(sample):
+            return await self.execute_prompt(prompt, sample['question'])
+
+        with self.events.stage("execute", total=len(samples)):
+            return await _gather_by_sample(samples, run, max_concurrency, on_result, default="",
+                                           events=self.events, stage="execute")
+
+    async def evaluate_all(self, outputs_a, outputs_b, samples, task_description,
+                           max_concurrency=DEFAULT_MAX_CONCURRENCY, on_result=None):
+        """并发评估所有样本的新旧输出，返回 (results, errors)，失败样本记为相似"""
+        async def run(sample):
+            return await self.evaluate_outputs(
+                outputs_a.get(sample['id'], ""),
+                outputs_b.get(sample['id'], ""),
+                task_description,
+                sample['question']
+            )
+
+        with self.events.stage("evaluate", total=len(samples)):
+            return await _gather_by_sample(
+                samples, run, max_concurrency, on_result,
+                default=prompts.parse_verdict(""), events=self.events, stage="evaluate"
+            )
+
+
+async def _gather_by_sample(samples, run, max_concurrency, on_result, default, events=None, stage=None):
+    """以信号量限制在途请求数，单样本失败不影响其他样本"""
+    semaphore = asyncio.Semaphore(max(1, int(max_concurrency or 1)))
+    results = {}
+    errors = {}
+
+    async def guarded(sample):
+        sample_id = sample['id']
+        async with semaphore:
+            try:
+                if events:
+                    with events.span(stage, category="sample", sample_id=sample_id):
+                        results[sample_id] = await run(sample)
+                else:
+                    results[sample_id] = await run(sample)
+            except Exception as e:
+                results[sample_id] = default
+                errors[sample_id] = str(e)
+        if events:
+            events.publish("sample_done", stage=stage, sample_id=sample_id, error=errors.get(sample_id))
+        if on_result:
+            on_result(sample_id, results[sample_id], errors.get(sample_id))
+
+    await asyncio.gather(*(guarded(sample) for sample in samples))
+    return {sample_id: results[sample_id] for sample_id in sorted(results)}, errors
+
+
+class BackgroundLoop:
+    """在守护线程中常驻的事件循环，供同步代码提交协程"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="spo-asyncio", daemon=True)
+        self.thread.start()
+
+    def submit(self, coro):
+        """提交协程，立即返回concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """提交协程并等待结果"""
+        return self.submit(coro).result(timeout)
+
+
+_background_loop = None
+_background_loop_lock = threading.Lock()
+
+
+def get_background_loop():
+    """进程内共享的后台事件循环（跨Streamlit rerun和会话复用）"""
+    global _background_loop
+    with _background_loop_lock:
+        if _background_loop is None:
+            _background_loop = BackgroundLoop()
+        return _background_loop
@@ -0,0 +1,229 @@
+"""批量优化：按清单在进程池中并行优化多个任务
+
+清单为JSONL（每行一个任务）或YAML（任务列表），每个任务包含：
+    task_description, initial_prompt, max_iterations（默认10）, models（可选，按角色指定模型）,
+    id（可选）, samples（可选，省略则自动生成）, beam_width（可选，覆盖全局候选数）,
+    max_tokens / max_cost（可选，覆盖全局的token/费用预算）
+
+每个任务的结果写入 output_dir/<id>.json，运行日志 output_dir/<id>.jsonl 在每次迭代后追加一行，
+同时作为检查点。重新运行同一清单时跳过已完成的任务，未完成（含因预算停止）的任务重放日志后从最近一次迭代继续。
+所有工作进程共享一个信号量，限制对上游API的总在途请求数。
+"""
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .cache import get_judgment_cache, get_response_cache
+from .engine import OptimizationEngine, OptimizationState
+from .llm_service import LLMService
+from .resilience import ResilientCaller, RetryPolicy
+from .runlog import RunLog, load_run_log
+from .usage import Budget, total_tokens
+
+try:
+    import yaml
+except ImportError:  # PyYAML为可选依赖，只在读取YAML清单时需要
+    yaml = None
+
+SUMMARY_FIELDS = ["id", "status", "iterations", "improvements", "final_prompt_chars", "tokens", "cost", "elapsed",
+                  "error"]
+
+
+def load_manifest(path):
+    """读取清单，返回带id的任务列表"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".yaml", ".yml")):
+            if yaml is None:
+                raise Exception("读取YAML清单需要安装PyYAML")
+            entries = yaml.safe_load(f) or []
+        else:
+            entries = [json.loads(line) for line in f if line.strip()]
+
+    tasks = []
+    for index, entry in enumerate(entries):
+        if not entry.get("task_description") or not entry.get("initial_prompt"):
+            raise Exception(f"清单第{index + 1}项缺少task_description或initial_prompt")
+        task = dict(entry)
+        task.setdefault("id", _default_task_id(index, entry))
+        task.setdefault("max_iterations", 10)
+        tasks.append(task)
+    return tasks
+
+
+def _default_task_id(index, entry):
+    digest = hashlib.sha1(
+        (entry["task_description"] + "\0" + entry["initial_prompt"]).encode("utf-8")
+    ).hexdigest()[:8]
+    return f"{index + 1:03d}-{digest}"
+
+
+def result_path(output_dir, task_id):
+    return os.path.join(output_dir, f"{task_id}.json")
+
+
+def log_path(output_dir, task_id):
+    return os.path.join(output_dir, f"{task_id}.jsonl")
+
+
+def _write_json(path, data):
+    """先写临时文件再替换，进程中途崩溃也不会留下半个文件"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_completed(output_dir, task_id):
+    result = _read_json(result_path(output_dir, task_id))
+    return bool(result) and result.get("status") == "completed"
+
+
+_worker_limiter = None
+
+
+def _init_worker(limiter):
+    global _worker_limiter
+    _worker_limiter = limiter
+
+
+def run_task(task, output_dir, service_options, engine_options):
+    """在工作进程中优化单个任务，返回摘要"""
+    start = time.time()
+    task_id = task["id"]
+    use_cache = service_options.get("use_cache", True)
+    service = LLMService(
+        api_key=service_options.get("api_key"),
+        base_url=service_options.get("base_url"),
+        response_cache=get_response_cache() if use_cache else None,
+        judgment_cache=get_judgment_cache() if use_cache else None,
+        models=task.get("models"),
+        limiter=_worker_limiter,
+        resilience=ResilientCaller(RetryPolicy.from_env(hedge=service_options.get("hedge")))
+    )
+    options = dict(engine_options)
+    if task.get("beam_width"):
+        options["beam_width"] = task["beam_width"]
+    if task.get("max_tokens") or task.get("max_cost"):
+        options["budget"] = Budget(max_tokens=int(task.get("max_tokens") or 0), max_cost=float(task.get("max_cost") or 0))
+    engine = OptimizationEngine(service, **options)
+
+    run_log = RunLog(log_path(output_dir, task_id))
+    try:
+        if run_log.started:
+            # 重放日志，从上次中断的迭代继续
+            state = load_run_log(run_log.lines())
+        else:
+            state = OptimizationState(
+                task_description=task["task_description"],
+                current_best_prompt=task["initial_prompt"],
+                max_iterations=int(task["max_iterations"]),
+                samples=task.get("samples") or []
+            )
+            state, _ = engine.initialize(state)
+            run_log.start(state)
+
+        state = engine.run(state, on_iteration=run_log.append)
+        status = "stopped" if state.stop_reason else "completed"
+        result = {"id": task_id, "status": status, "task": task, "result": state.to_dict()}
+    except Exception as e:
+        result = {"id": task_id, "status": "failed", "task": task, "error": str(e)}
+
+    result["elapsed"] = time.time() - start
+    _write_json(result_path(output_dir, task_id), result)
+    return summarize(result)
+
+
+def summarize(result):
+    """把单个任务的结果压缩为汇总表中的一行"""
+    state = result.get("result") or {}
+    history = state.get("optimization_history", [])
+    return {
+        "id": result["id"],
+        "status": result["status"],
+        "iterations": state.get("current_iteration", 0),
+        "improvements": sum(1 for item in history if item["is_better"]),
+        "final_prompt_chars": len(state.get("current_best_prompt", "")),
+        "tokens": total_tokens(state.get("usage")),
+        "cost": round((state.get("usage") or {}).get("cost", 0.0), 4),
+        "elapsed": round(result.get("elapsed", 0.0), 2),
+        "error": result.get("error") or state.get("stop_reason", ""),
+    }
+
+
+def write_summary(output_dir, rows):
+    rows = sorted(rows, key=lambda row: row["id"])
+    _write_json(os.path.join(output_dir, "summary.json"), rows)
+    with open(os.path.join(output_dir, "summary.csv"), "w", encoding="utf-8", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return rows
+
+
+def format_summary(rows):
+    """把汇总行格式化为纯文本表格"""
+    headers = ["id", "status", "iterations", "improvements", "tokens", "cost", "elapsed", "error"]
+    table = [headers] + [[str(row[name]) for name in headers] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(headers))]
+    return "\n".join(
+        "  ".join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip()
+        for line in table
+    )
+
+
+def run_batch(manifest, output_dir, service_options=None, processes=4, max_inflight=8,
+              engine_options=None, on_task_done=None):
+    """并行运行清单中的所有任务，返回汇总行
+
+    - processes: 工作进程数（同时优化的任务数）
+    - max_inflight: 所有进程合计的上游在途请求上限
+    - engine_options: 传给OptimizationEngine的参数，如单个任务内部的样本并发数max_concurrency
+    """
+    service_options = service_options or {}
+    engine_options = engine_options or {}
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = load_manifest(manifest) if isinstance(manifest, str) else manifest
+
+    rows = []
+    pending = []
+    for task in tasks:
+        if is_completed(output_dir, task["id"]):
+            rows.append(summarize(_read_json(result_path(output_dir, task["id"]))))
+        else:
+            pending.append(task)
+
+    if pending:
+        with multiprocessing.Manager() as manager:
+            limiter = manager.BoundedSemaphore(max_inflight)
+            with ProcessPoolExecutor(
+                max_workers=max(1, min(processes, len(pending))),
+                initializer=_init_worker,
+                initargs=(limiter,)
+            ) as pool:
+                futures = {
+                    pool.submit(run_task, task, output_dir, service_options, engine_options): task
+                    for task in pending
+                }
+                for future in as_completed(futures):
+                    try:
+                        row = future.result()
+                    except Exception as e:
+                        # 任务在run_task之外失败（参数无法序列化、工作进程崩溃等），记为失败并继续其他任务
+                        row = summarize({"id": futures[future]["id"], "status": "failed", "error": str(e)})
+                    rows.append(row)
+                    if on_task_done:
+                        on_task_done(row, len(rows), len(tasks))
+
+    return write_summary(output_dir, rows)
@@ -0,0 +1,282 @@
+"""内容寻址的响应缓存：内存LRU + 磁盘两级
+
+缓存键是 (base_url, model, messages, temperature, max_tokens) 的SHA-256，
+相同提示词、相同问题、相同参数的执行请求直接复用之前的结果。
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def cache_key(base_url, payload):
+    """根据请求参数计算缓存键"""
+    material = {
+        "base_url": base_url,
+        "model": payload.get("model"),
+        "messages": payload.get("messages"),
+        "temperature": payload.get("temperature"),
+        "max_tokens": payload.get("max_tokens"),
+    }
+    encoded = json.dumps(material, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """两级响应缓存，线程安全
+
+    - 内存层：固定容量的LRU
+    - 磁盘层：每个键一个JSON文件，超过ttl视为过期，总大小超过max_disk_bytes时
+      按最近访问时间淘汰
+    """
+
+    def __init__(self, memory_size=256, directory=None, max_disk_bytes=100 * 1024 * 1024, ttl=7 * 24 * 3600):
+        self.memory_size = memory_size
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @classmethod
+    def from_env(cls, subdir="responses"):
+        """从环境变量读取配置，LLM_CACHE_DIR为缓存根目录，置空则只使用内存层"""
+        root = os.getenv("LLM_CACHE_DIR", os.path.join("~", ".cache", "spo-plus"))
+        return cls(
+            memory_size=int(os.getenv("LLM_CACHE_MEMORY_SIZE", "256")),
+            directory=os.path.join(os.path.expanduser(root), subdir) if root else None,
+            max_disk_bytes=int(float(os.getenv("LLM_CACHE_MAX_MB", "100")) * 1024 * 1024),
+            ttl=float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+        )
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """命中返回缓存值，未命中返回None"""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return self._memory[key]
+
+            value = self._read_disk(key)
+            if value is not None:
+                self.disk_hits += 1
+                self._remember(key, value)
+                return value
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+            self._write_disk(key, value)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            for path, _, _ in self._disk_entries():
+                os.remove(path)
+            self._disk_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": hits / total if total else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_bytes": self._current_disk_bytes(),
+                "evictions": self.evictions,
+            }
+
+    def _remember(self, key, value):
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                self._remove(path)
+                return None
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)["value"]
+        except (OSError, ValueError, KeyError):
+            return None
+        # 更新访问时间，淘汰时按最近使用排序
+        os.utime(path, None)
+        return value
+
+    def _write_disk(self, key, value):
+        if not self.directory:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        previous = os.path.getsize(path) if os.path.exists(path) else 0
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"created": time.time(), "value": value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._disk_bytes = self._current_disk_bytes() + os.path.getsize(path) - previous
+        if self._disk_bytes > self.max_disk_bytes:
+            self._evict_disk()
+
+    def _current_disk_bytes(self):
+        if self._disk_bytes is None:
+            self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+        return self._disk_bytes
+
+    def _disk_entries(self):
+        """列出磁盘缓存文件 (path, size, mtime)"""
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict_disk(self):
+        """先删除过期项，再按最近访问时间从旧到新淘汰，直到低于容量的90%"""
+        now = time.time()
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_disk_bytes * 0.9
+        for path, size, mtime in entries:
+            expired = self.ttl and now - mtime > self.ttl
+            if not expired and total <= target:
+                continue
+            self._remove(path)
+            total -= size
+        self._disk_bytes = total
+
+    def _remove(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        self.evictions += 1
+        if self._disk_bytes is not None:
+            self._disk_bytes = max(self._disk_bytes - size, 0)
+
+
+def _digest(text):
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def judgment_key(task_description, question, output_a, output_b, model):
+    """成对评估的缓存键，输出A/B的顺序是键的一部分"""
+    parts = [_digest(task_description), _digest(question), _digest(output_a), _digest(output_b), model or ""]
+    return "judgment:" + _digest("|".join(parts))
+
+
+def swap_verdict(verdict):
+    """交换A/B后对应的评估结论"""
+    winner = {"A": "B", "B": "A"}.get(verdict.get("winner"), "similar")
+    return dict(verdict, winner=winner, swapped=not verdict.get("swapped", False))
+
+
+class JudgmentCache:
+    """成对评估结果缓存，支持A/B对称查询
+
+    查询 (A, B) 未命中时再查 (B, A)，命中则把结论反转后返回。
+    存储层可以是任意提供 get/set 的对象，默认使用ResponseCache。
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.swapped_hits = 0
+        self.identical = 0
+        self.misses = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(ResponseCache.from_env(subdir="judgments"))
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def record_identical(self):
+        self._count("identical")
+
+    def get(self, task_description, question, output_a, output_b, model):
+        verdict = self.store.get(judgment_key(task_description, question, output_a, output_b, model))
+        if verdict is not None:
+            self._count("hits")
+            return dict(verdict, cached=True)
+
+        verdict = self.store.get(judgment_key(task_description, question, output_b, output_a, model))
+        if verdict is not None:
+            self._count("swapped_hits")
+            return dict(swap_verdict(verdict), cached=True)
+
+        self._count("misses")
+        return None
+
+    def set(self, task_description, question, output_a, output_b, model, verdict):
+        self.store.set(judgment_key(task_description, question, output_a, output_b, model), verdict)
+
+    def stats(self):
+        with self._lock:
+            answered = self.hits + self.swapped_hits + self.identical
+            total = answered + self.misses
+            return {
+                "hits": self.hits,
+                "swapped_hits": self.swapped_hits,
+                "identical": self.identical,
+                "misses": self.misses,
+                "hit_rate": answered / total if total else 0.0,
+            }
+
+
+_response_cache = None
+_judgment_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """进程内共享的响应缓存（跨Streamlit rerun和会话复用内存层）"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache.from_env()
+        return _response_cache
+
+
+def get_judgment_cache():
+    """进程内共享的成对评估缓存"""
+    global _judgment_cache
+    with _response_cache_lock:
+        if _judgment_cache is None:
+            _judgment_cache = JudgmentCache.from_env()
+        return _judgment_cache
@@ -0,0 +1,335 @@
+"""录制与回放：把每次API请求和响应（包括流式数据块及其时间）写入录制文件，之后离线回放
+
+录制文件为JSONL，每行一次交互：
+- 普通请求：{"key", "request", "status", "headers", "elapsed", "body"}，elapsed为完整响应的耗时
+- 流式请求：{"key", "request", "status", "headers", "elapsed", "chunks", "duration"}，
+  elapsed为收到响应头的耗时，chunks为 [[相对请求开始的秒数, 文本], ...]
+
+key由请求体计算（不含地址和密钥），相同的请求按录制顺序依次回放，回放次数超过录制次数时重复最后一次；
+录制中的429/5xx响应也会原样回放，重试和限流的行为与录制时一致。录制时每次交互追加一行，
+进程中途退出也能回放已完成的部分，读取时跳过不完整的行。
+
+回放默认立即返回；realtime=True 时按录制的耗时等待，流式数据块按原来的时间间隔输出。
+同步服务通过包装Session接入，异步服务通过httpx传输层接入，两者可以共用同一个Cassette。
+"""
+import asyncio
+import codecs
+import hashlib
+import json
+import os
+import threading
+import time
+from http.client import responses as HTTP_REASONS
+
+import httpx
+import requests
+from requests.structures import CaseInsensitiveDict
+
+MODES = ("record", "replay")
+
+# 录制的响应头，其余响应头与回放无关
+_HEADERS = ("content-type", "retry-after")
+
+
+def request_key(payload):
+    """请求体的键，字段顺序不影响结果；stream_options只决定是否返回用量，不参与计算"""
+    payload = {name: value for name, value in payload.items() if name != "stream_options"}
+    encoded = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    """一个录制文件，线程安全；mode为record时追加写入，为replay时读取并按请求回放"""
+
+    def __init__(self, path, mode="replay", realtime=False):
+        if mode not in MODES:
+            raise Exception(f"未知的录制模式: {mode}")
+        self.path = path
+        self.mode = mode
+        self.realtime = realtime
+        self._lock = threading.Lock()
+        # 回放：键 -> 按录制顺序的交互列表，以及每个键已回放的次数
+        self._entries = {}
+        self._cursors = {}
+        self._stats = {"recorded": 0, "replayed": 0, "misses": 0}
+        if mode == "replay":
+            self._load()
+        else:
+            self._prepare()
+
+    @classmethod
+    def from_env(cls):
+        """LLM_CASSETTE为录制文件路径，未设置时返回None"""
+        path = os.getenv("LLM_CASSETTE")
+        if not path:
+            return None
+        return cls(
+            path,
+            mode=os.getenv("LLM_CASSETTE_MODE", "replay"),
+            realtime=os.getenv("LLM_CASSETTE_REALTIME", "false").lower() == "true",
+        )
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            raise Exception(f"录制文件不存在: {self.path}")
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # 录制进程中途退出留下的半行
+                    continue
+                # 按录制的请求体重新计算键，键的计算方式变化后（如忽略stream_options）旧的录制仍可回放
+                key = request_key(entry["request"]) if "request" in entry else entry["key"]
+                self._entries.setdefault(key, []).append(entry)
+
+    def _prepare(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # 上次录制中途退出时最后一行不完整，先换行，避免新记录接在半行后面
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            with open(self.path, "rb+") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
+
+    def record(self, entry):
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+            self._stats["recorded"] += 1
+
+    def lookup(self, payload):
+        """返回与请求体匹配的下一条录制交互，没有录制过该请求时抛出异常"""
+        key = request_key(payload)
+        with self._lock:
+            entries = self._entries.get(key)
+            if not entries:
+                self._stats["misses"] += 1
+                raise Exception(f"录制文件中没有匹配的请求（模型 {payload.get('model')}），请求内容可能在录制后发生了变化")
+            index = self._cursors.get(key, 0)
+            self._cursors[key] = index + 1
+            self._stats["replayed"] += 1
+        return entries[min(index, len(entries) - 1)]
+
+    def rewind(self):
+        """从头开始回放"""
+        with self._lock:
+            self._cursors.clear()
+
+    def delay(self, start, offset):
+        """按录制时间回放时，距离请求开始offset秒的时刻还需等待的秒数"""
+        if not self.realtime:
+            return 0.0
+        return max(0.0, start + offset - time.perf_counter())
+
+    def wait(self, start, offset):
+        delay = self.delay(start, offset)
+        if delay:
+            time.sleep(delay)
+
+    async def await_(self, start, offset):
+        delay = self.delay(start, offset)
+        if delay:
+            await asyncio.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            return {"mode": self.mode, "path": self.path, "entries": len(self), **self._stats}
+
+    def wrap_session(self, session):
+        """包装requests Session，供LLMService使用"""
+        return CassetteSession(self, session)
+
+    def async_transport(self, transport=None):
+        """httpx传输层，供AsyncLLMService使用；transport为录制时实际发出请求的传输层"""
+        return CassetteTransport(self, transport)
+
+
+class _Recording:
+    """一次交互的录制：累积数据块，结束时写入一行"""
+
+    def __init__(self, cassette, payload, status, headers, start):
+        self.cassette = cassette
+        self.start = start
+        self.entry = {
+            "key": request_key(payload),
+            "request": payload,
+            "status": status,
+            "headers": {name: headers[name] for name in _HEADERS if name in headers},
+            "elapsed": round(time.perf_counter() - start, 4),
+        }
+        self.chunks = []
+        # 数据块可能在多字节字符中间断开，未完整的字节留到下一块再解码
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._finished = False
+
+    def add(self, data):
+        text = self._decoder.decode(data)
+        if text:
+            self.chunks.append([round(time.perf_counter() - self.start, 4), text])
+
+    def finish(self, stream):
+        if self._finished:
+            return
+        self._finished = True
+        tail = self._decoder.decode(b"", final=True)
+        if tail:
+            self.chunks.append([round(time.perf_counter() - self.start, 4), tail])
+        if stream:
+            self.entry["chunks"] = self.chunks
+            self.entry["duration"] = round(time.perf_counter() - self.start, 4)
+        else:
+            self.entry["body"] = "".join(text for _, text in self.chunks)
+            self.entry["elapsed"] = round(time.perf_counter() - self.start, 4)
+        self.cassette.record(self.entry)
+
+
+def _requests_response(status, headers, url, raw=None, body=None):
+    response = requests.Response()
+    response.status_code = status
+    response.reason = HTTP_REASONS.get(status, "")
+    response.headers = CaseInsensitiveDict(headers)
+    response.url = url
+    response.encoding = "utf-8"
+    response.raw = raw
+    if body is not None:
+        response._content = body.encode("utf-8")
+        response._content_consumed = True
+    return response
+
+
+class _ReplayBody:
+    """requests响应raw的替身：按录制的数据块输出"""
+
+    def __init__(self, cassette, chunks, start):
+        self.cassette = cassette
+        self.chunks = chunks
+        self.start = start
+
+    def stream(self, chunk_size=None, decode_content=True):
+        for offset, text in self.chunks:
+            self.cassette.wait(self.start, offset)
+            yield text.encode("utf-8")
+
+    def close(self):
+        pass
+
+
+class _RecordingBody:
+    """包装真实的流式响应：边输出边录制，读完或提前关闭时写入录制文件"""
+
+    def __init__(self, response, recording):
+        self.response = response
+        self.recording = recording
+
+    def stream(self, chunk_size=None, decode_content=True):
+        for chunk in self.response.iter_content(chunk_size=None):
+            self.recording.add(chunk)
+            yield chunk
+        self.recording.finish(stream=True)
+
+    def close(self):
+        self.recording.finish(stream=True)
+        self.response.close()
+
+
+class CassetteSession:
+    """LLMService使用的Session替身：录制时转发给真实Session，回放时不发出网络请求"""
+
+    def __init__(self, cassette, session):
+        self.cassette = cassette
+        self.session = session
+
+    @property
+    def stats(self):
+        return self.session.stats
+
+    def post(self, url, json=None, stream=False, **kwargs):
+        start = time.perf_counter()
+        if self.cassette.mode == "replay":
+            entry = self.cassette.lookup(json)
+            self.cassette.wait(start, entry["elapsed"])
+            if "chunks" in entry:
+                return _requests_response(entry["status"], entry["headers"], url,
+                                          raw=_ReplayBody(self.cassette, entry["chunks"], start))
+            return _requests_response(entry["status"], entry["headers"], url, body=entry["body"])
+
+        response = self.session.post(url, json=json, stream=stream, **kwargs)
+        recording = _Recording(self.cassette, json, response.status_code, response.headers, start)
+        if stream:
+            return _requests_response(response.status_code, response.headers, url,
+                                      raw=_RecordingBody(response, recording))
+        recording.add(response.content)
+        recording.finish(stream=False)
+        return response
+
+    def close(self):
+        self.session.close()
+
+
+class _AsyncReplayStream(httpx.AsyncByteStream):
+    def __init__(self, cassette, chunks, start):
+        self.cassette = cassette
+        self.chunks = chunks
+        self.start = start
+
+    async def __aiter__(self):
+        for offset, text in self.chunks:
+            await self.cassette.await_(self.start, offset)
+            yield text.encode("utf-8")
+
+
+class _AsyncRecordingStream(httpx.AsyncByteStream):
+    def __init__(self, stream, recording, streaming):
+        self.stream = stream
+        self.recording = recording
+        self.streaming = streaming
+
+    async def __aiter__(self):
+        async for chunk in self.stream:
+            self.recording.add(chunk)
+            yield chunk
+        self.recording.finish(self.streaming)
+
+    async def aclose(self):
+        self.recording.finish(self.streaming)
+        await self.stream.aclose()
+
+
+class CassetteTransport(httpx.AsyncBaseTransport):
+    """AsyncLLMService使用的httpx传输层：录制时转发给真实传输层，回放时不发出网络请求"""
+
+    def __init__(self, cassette, transport=None):
+        self.cassette = cassette
+        self.transport = transport
+
+    async def handle_async_request(self, request):
+        start = time.perf_counter()
+        payload = json.loads(request.content or b"{}")
+        if self.cassette.mode == "replay":
+            entry = self.cassette.lookup(payload)
+            await self.cassette.await_(start, entry["elapsed"])
+            chunks = entry.get("chunks")
+            if chunks is None:
+                chunks = [[entry["elapsed"], entry["body"]]]
+            return httpx.Response(entry["status"], headers=entry["headers"],
+                                  stream=_AsyncReplayStream(self.cassette, chunks, start), request=request)
+
+        # 传输层拿到的是未解压的字节，录制时要求服务端不压缩
+        request.headers["Accept-Encoding"] = "identity"
+        response = await self.transport.handle_async_request(request)
+        recording = _Recording(self.cassette, payload, response.status_code, response.headers, start)
+        return httpx.Response(
+            response.status_code, headers=response.headers, request=request, extensions=response.extensions,
+            stream=_AsyncRecordingStream(response.stream, recording, bool(payload.get("stream")))
+        )
+
+    async def aclose(self):
+        if self.transport is not None:
+            await self.transport.aclose()
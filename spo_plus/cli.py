@@ -0,0 +1,270 @@
+"""命令行入口
+
+    python -m spo_plus optimize --task "..." --prompt "..." --iterations 5
+    python -m spo_plus optimize --resume <运行ID>
+    python -m spo_plus optimize --task "..." --prompt "..." --record run.cassette.jsonl
+    python -m spo_plus optimize --task "..." --prompt "..." --replay run.cassette.jsonl
+    python -m spo_plus export --run-id <运行ID> --output run.jsonl
+    python -m spo_plus import --file run.jsonl
+    python -m spo_plus batch --manifest tasks.jsonl --output-dir results/
+
+结果以JSON输出到标准输出（或 --output 指定的文件），进度信息写到标准错误。
+"""
+import argparse
+import json
+import os
+import sys
+
+from dotenv import load_dotenv
+
+from .batch import format_summary, run_batch
+from .cache import get_judgment_cache, get_response_cache
+from .cassette import Cassette
+from .engine import OptimizationEngine, OptimizationState
+from .llm_service import LLMService
+from .parallel import DEFAULT_MAX_CONCURRENCY
+from .resilience import ResilientCaller, RetryPolicy
+from .sequential import ADAPTIVE_MODES
+from .runlog import write_run_log
+from .store import get_run_store
+from .tracing import Tracer
+from .usage import Budget, format_usage
+
+
+def _read_text(value):
+    """参数以@开头时读取对应文件内容"""
+    if value and value.startswith("@"):
+        with open(value[1:], "r", encoding="utf-8") as f:
+            return f.read()
+    return value
+
+
+def build_service(args, cassette=None):
+    # 命中缓存的请求不会被录制，回放时也不能让缓存代替录制的响应
+    use_cache = not args.no_cache and cassette is None
+    return LLMService(
+        api_key=args.api_key,
+        base_url=args.base_url,
+        response_cache=get_response_cache() if use_cache else None,
+        judgment_cache=get_judgment_cache() if use_cache else None,
+        resilience=ResilientCaller(RetryPolicy.from_env(hedge=args.hedge or None)),
+        cassette=cassette
+    )
+
+
+def build_cassette(args):
+    """--record / --replay 优先，未指定时读取LLM_CASSETTE"""
+    if args.record:
+        return Cassette(args.record, mode="record")
+    if args.replay:
+        return Cassette(args.replay, mode="replay", realtime=args.realtime)
+    return Cassette.from_env()
+
+
+def engine_options(args):
+    return {
+        "max_concurrency": args.max_concurrency,
+        "beam_width": args.beam_width,
+        "halving_eta": args.halving_eta,
+        "adaptive_eval": args.adaptive_eval,
+        "batch_judging": args.batch_judging,
+        "context_budget": args.context_budget
+    }
+
+
+def build_budget(args):
+    """命令行参数优先，未指定时读取LLM_MAX_TOKENS/LLM_MAX_COST"""
+    default = Budget.from_env()
+    return Budget(
+        max_tokens=default.max_tokens if args.max_tokens is None else args.max_tokens,
+        max_cost=default.max_cost if args.max_cost is None else args.max_cost
+    )
+
+
+def cmd_optimize(args):
+    store = get_run_store(args.run_store) if args.run_store or args.resume else None
+    if args.resume:
+        data, _ = store.load_run(args.resume)
+        if data is None:
+            print(f"运行 {args.resume} 不存在", file=sys.stderr)
+            return 1
+        state = OptimizationState.from_dict(data)
+        run_id = args.resume
+    else:
+        if not (args.task and args.prompt):
+            print("新运行需要 --task 和 --prompt", file=sys.stderr)
+            return 2
+        state = OptimizationState(
+            task_description=_read_text(args.task),
+            current_best_prompt=_read_text(args.prompt),
+            max_iterations=args.iterations
+        )
+        if args.samples:
+            with open(args.samples, "r", encoding="utf-8") as f:
+                state.samples = json.load(f)
+            for i, sample in enumerate(state.samples):
+                sample.setdefault('id', i + 1)
+        run_id = store.create_run(state, {"engine": engine_options(args)}) if store else None
+    if run_id:
+        print(f"运行ID: {run_id}（中断后可用 --resume {run_id} 继续）", file=sys.stderr)
+
+    cassette = build_cassette(args)
+    engine = OptimizationEngine(
+        build_service(args, cassette), checkpoints=store.run(run_id) if store else None, budget=build_budget(args),
+        **engine_options(args)
+    )
+    tracer = Tracer(engine.events) if args.trace else None
+    try:
+        state = _optimize(engine, state, tracer)
+    finally:
+        if tracer:
+            with open(args.trace, "w", encoding="utf-8") as f:
+                f.write(tracer.export())
+            print(f"追踪已写入 {args.trace}（可在 chrome://tracing 或 ui.perfetto.dev 中打开）", file=sys.stderr)
+    if cassette:
+        stats = cassette.stats()
+        print(f"录制 {stats['recorded']} 次 / 回放 {stats['replayed']} 次（{cassette.path}）", file=sys.stderr)
+    _write_json(state.to_dict(), args.output)
+    return 0
+
+
+def _optimize(engine, state, tracer=None):
+    # 续跑时初始化已完成则直接进入迭代
+    if not state.current_best_outputs:
+        state, errors = engine.initialize(state)
+        for sample_id, error in errors.items():
+            print(f"样本 {sample_id} 执行失败: {error}", file=sys.stderr)
+    if tracer:
+        tracer.begin_iteration(state.current_iteration + 1)
+
+    def on_iteration(state, record):
+        status = "改进成功" if record["is_better"] else "未改进"
+        context = record["context"]
+        print(f"迭代{record['iteration']}/{state.max_iterations}: {status}"
+              f"（优化提示词 {context['prompt_tokens_before']} → {context['prompt_tokens']} tokens）"
+              f" {format_usage(record['usage'])}", file=sys.stderr)
+
+    state = engine.run(state, on_iteration=on_iteration)
+    print(f"总用量: {format_usage(state.usage)}", file=sys.stderr)
+    if state.stop_reason:
+        print(f"提前停止: {state.stop_reason}", file=sys.stderr)
+    return state
+
+
+def cmd_batch(args):
+    def on_task_done(row, done, total):
+        print(f"[{done}/{total}] {row['id']}: {row['status']}", file=sys.stderr)
+
+    rows = run_batch(
+        args.manifest,
+        args.output_dir,
+        service_options={
+            "api_key": args.api_key,
+            "base_url": args.base_url,
+            "use_cache": not args.no_cache,
+            "hedge": args.hedge or None
+        },
+        processes=args.processes,
+        max_inflight=args.max_inflight,
+        engine_options={**engine_options(args), "budget": build_budget(args)},
+        on_task_done=on_task_done
+    )
+    print(format_summary(rows))
+    return 0 if all(row["status"] in ("completed", "stopped") for row in rows) else 1
+
+
+def cmd_export(args):
+    lines = get_run_store(args.run_store).export_run(args.run_id)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            count = write_run_log(f, lines)
+    else:
+        count = write_run_log(sys.stdout, lines)
+    print(f"已导出 {count} 行", file=sys.stderr)
+    return 0
+
+
+def cmd_import(args):
+    with open(args.file, "r", encoding="utf-8") as f:
+        run_id, state = get_run_store(args.run_store).import_run(f)
+    print(f"已导入运行 {run_id}（迭代 {state.current_iteration}/{state.max_iterations}），"
+          f"可用 optimize --resume {run_id} 继续", file=sys.stderr)
+    print(run_id)
+    return 0
+
+
+def _write_json(data, output):
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+def add_service_arguments(parser):
+    parser.add_argument("--api-key", default=os.getenv("DEFAULT_API_KEY"), help="API密钥，默认读取DEFAULT_API_KEY")
+    parser.add_argument("--base-url", default=os.getenv("DEFAULT_API_BASE_URL", "https://api.siliconflow.cn"))
+    parser.add_argument("--max-concurrency", type=int, default=DEFAULT_MAX_CONCURRENCY, help="同时在途的请求数")
+    parser.add_argument("--no-cache", action="store_true", help="禁用响应缓存和评估缓存")
+    parser.add_argument("--hedge", action="store_true", help="调用超过该角色p95延迟时发出对冲请求，取先返回的结果")
+    parser.add_argument("--beam-width", type=int, default=1, help="每次迭代生成的候选数，大于1时启用束搜索")
+    parser.add_argument("--halving-eta", type=int, default=2, help="束搜索每轮保留 1/eta 的候选")
+    parser.add_argument("--adaptive-eval", choices=ADAPTIVE_MODES, default="off",
+                        help="自适应评估：结论确定后停止剩余评估（majority精确规则，sprt序贯检验）")
+    parser.add_argument("--context-budget", type=int, default=None,
+                        help="优化器上下文中样本输出的token预算，默认读取LLM_OPTIMIZER_CONTEXT_TOKENS")
+    parser.add_argument("--batch-judging", action="store_true",
+                        help="批量评估：一次评估请求携带所有样本，无法解析的样本回退为逐个评估")
+    parser.add_argument("--max-tokens", type=int, default=None,
+                        help="每个运行的token预算，预计下一次迭代会超出时停止，默认读取LLM_MAX_TOKENS（0为不限制）")
+    parser.add_argument("--max-cost", type=float, default=None,
+                        help="每个运行的费用预算（元，按LLM_PRICES计价），默认读取LLM_MAX_COST（0为不限制）")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="spo_plus", description="SPO+ 提示词优化命令行")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    optimize = subparsers.add_parser("optimize", help="优化单个提示词")
+    optimize.add_argument("--task", help="任务需求描述，@path 表示从文件读取")
+    optimize.add_argument("--prompt", help="初始提示词，@path 表示从文件读取")
+    optimize.add_argument("--iterations", type=int, default=10, help="最大迭代次数")
+    optimize.add_argument("--samples", help="测试样本JSON文件，省略则自动生成")
+    optimize.add_argument("--output", help="结果JSON文件，省略则输出到标准输出")
+    optimize.add_argument("--run-store", help="保存运行和检查点的SQLite文件，默认不保存（SPO_RUN_STORE 为 --resume 的默认位置）")
+    optimize.add_argument("--resume", help="从检查点继续指定ID的运行")
+    optimize.add_argument("--trace", help="把各阶段和每次API调用的耗时写入Chrome trace JSON文件")
+    cassette = optimize.add_mutually_exclusive_group()
+    cassette.add_argument("--record", help="把每次API请求和响应（含流式数据块的时间）追加写入录制文件")
+    cassette.add_argument("--replay", help="从录制文件回放API响应，不访问网络（录制和回放时不使用缓存）")
+    optimize.add_argument("--realtime", action="store_true", help="回放时按录制的耗时等待，默认立即返回")
+    add_service_arguments(optimize)
+    optimize.set_defaults(func=cmd_optimize)
+
+    batch = subparsers.add_parser("batch", help="按清单批量优化，可中断后重新运行以继续")
+    batch.add_argument("--manifest", required=True, help="JSONL或YAML清单")
+    batch.add_argument("--output-dir", required=True, help="每个任务的结果文件及汇总表的输出目录")
+    batch.add_argument("--processes", type=int, default=4, help="同时优化的任务数")
+    batch.add_argument("--max-inflight", type=int, default=8, help="所有进程合计的上游在途请求上限")
+    add_service_arguments(batch)
+    batch.set_defaults(func=cmd_batch)
+
+    export = subparsers.add_parser("export", help="逐行导出运行的JSONL日志")
+    export.add_argument("--run-id", required=True)
+    export.add_argument("--output", help="输出文件，省略则输出到标准输出")
+    export.add_argument("--run-store", help="运行存储的SQLite文件，默认取SPO_RUN_STORE")
+    export.set_defaults(func=cmd_export)
+
+    import_ = subparsers.add_parser("import", help="导入JSONL运行日志，之后可以查看或继续优化")
+    import_.add_argument("--file", required=True)
+    import_.add_argument("--run-store", help="运行存储的SQLite文件，默认取SPO_RUN_STORE")
+    import_.set_defaults(func=cmd_import)
+    return parser
+
+
+def main(argv=None):
+    load_dotenv()
+    # load_dotenv之后重新构建参数默认值，使.env中的配置生效
+    args = build_parser().parse_args(argv)
+    return args.func(args)
@@ -0,0 +1,90 @@
+"""优化器上下文：在token预算内挑选、截断当前最佳提示词的输出
+
+原来把所有样本的完整输出 json.dumps 后交给优化模型，中文被转义成 \\uXXXX，
+提示词长度随样本数和回答长度线性增长。这里按预算组织上下文：
+- 上次评估中当前最佳提示词输掉的样本排在最前，其次是打平的，最后是赢的
+- 每个样本分到剩余预算的平均份额，超出时保留开头和结尾、中间省略
+- 预算不够平分时优先保证排在前面的样本，放不下的样本省略并注明数量
+- 序列化时不做ASCII转义
+"""
+import json
+import os
+import re
+
+# 优化器上下文中样本输出部分的默认token预算
+CONTEXT_TOKEN_BUDGET = int(os.getenv("LLM_OPTIMIZER_CONTEXT_TOKENS", "3000"))
+# 单个样本至少分到的token数，剩余预算低于此值时不再加入新样本
+MIN_SAMPLE_TOKENS = 80
+
+TRUNCATION_MARK = "\n…（中间省略）…\n"
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+
+def count_tokens(text):
+    """估算token数：中日文字符约0.6个token，其他字符约0.3个token（与常见BPE分词器的实测比例相近）"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    return int(cjk * 0.6 + (len(text) - cjk) * 0.3) + 1
+
+
+def truncate_to_tokens(text, max_tokens):
+    """超出max_tokens时保留开头约2/3和结尾约1/3"""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text, False
+    keep = max(1, int(len(text) * max_tokens / tokens) - len(TRUNCATION_MARK))
+    head = keep * 2 // 3
+    return text[:head] + TRUNCATION_MARK + text[len(text) - (keep - head):], True
+
+
+def losing_verdict(history):
+    """上次评估中表示当前最佳提示词输掉的结论
+
+    上次迭代改进成功时新提示词（B）成为最佳，它输掉的是"A更好"；否则最佳仍是A，输掉的是"B更好"。
+    """
+    if not history:
+        return None
+    return "A更好" if history[-1]["is_better"] else "B更好"
+
+
+def prioritize(samples, evaluations, losing):
+    """按 输掉 → 打平/未评估 → 赢 排序，同组内保持样本原顺序"""
+    def rank(sample):
+        verdict = evaluations.get(sample['id'])
+        if verdict is None or verdict == "相似":
+            return 1
+        return 0 if verdict == losing else 2
+    return sorted(samples, key=rank)
+
+
+def build_output_context(samples, outputs, history=None, evaluations=None, budget=None):
+    """返回 (上下文文本, 统计)，统计中包含 included / truncated / omitted 样本数和上下文token数"""
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    ordered = prioritize(samples, evaluations or {}, losing_verdict(history))
+    ordered = [sample for sample in ordered if sample['id'] in outputs]
+
+    selected = {}
+    truncated = 0
+    remaining = budget
+    for index, sample in enumerate(ordered):
+        # 预算不够平分时优先保证排在前面的样本
+        if remaining < MIN_SAMPLE_TOKENS:
+            break
+        share = max(MIN_SAMPLE_TOKENS, remaining // (len(ordered) - index))
+        output, was_truncated = truncate_to_tokens(outputs[sample['id']], share)
+        selected[str(sample['id'])] = output
+        truncated += was_truncated
+        remaining -= count_tokens(output)
+
+    text = json.dumps(selected, ensure_ascii=False, indent=1)
+    omitted = len(ordered) - len(selected)
+    if omitted:
+        text += f"\n（另有{omitted}个样本的输出因长度限制省略）"
+    return text, {
+        "included": len(selected),
+        "truncated": truncated,
+        "omitted": omitted,
+        "tokens": count_tokens(text),
+    }
@@ -0,0 +1,592 @@
+"""无界面的优化引擎：显式状态 + 纯步进函数
+
+OptimizationEngine不依赖Streamlit，可在命令行、定时任务或后台进程中运行；
+Streamlit视图只负责把session_state与OptimizationState互相转换并展示结果。
+"""
+import copy
+import json
+import math
+from dataclasses import asdict, dataclass, field, fields, replace
+
+from .context import build_output_context, count_tokens
+from .events import EventBus
+from .parallel import DEFAULT_MAX_CONCURRENCY, map_samples
+from .prompts import optimize_prompt_text, verdict_label
+from .sequential import evaluate_adaptive
+from .usage import UsageMeter, add_usage
+
+
+@dataclass
+class OptimizationState:
+    """一次优化运行的完整状态，字段名与Streamlit会话状态保持一致"""
+    task_description: str = ""
+    current_best_prompt: str = ""
+    max_iterations: int = 10
+    current_iteration: int = 0
+    samples: list = field(default_factory=list)
+    current_best_outputs: dict = field(default_factory=dict)
+    new_prompt: str = ""
+    new_outputs: dict = field(default_factory=dict)
+    evaluations: dict = field(default_factory=dict)
+    analysis: str = ""
+    optimization_history: list = field(default_factory=list)
+    # 运行累计的token用量与费用（usage.add_usage的结构）
+    usage: dict = field(default_factory=dict)
+    # 因预算等原因提前停止时的说明
+    stop_reason: str = ""
+
+    @property
+    def finished(self):
+        return self.current_iteration >= self.max_iterations or bool(self.stop_reason)
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        """从字典（会话状态或JSON）恢复状态，JSON中的样本ID键会被还原为int"""
+        values = {f.name: copy.deepcopy(data[f.name]) for f in fields(cls) if f.name in data}
+        for name in ("current_best_outputs", "new_outputs", "evaluations"):
+            if name in values:
+                values[name] = _int_keys(values[name])
+        for item in values.get("optimization_history", []):
+            if "evaluations" in item:
+                item["evaluations"] = _int_keys(item["evaluations"])
+        return cls(**values)
+
+
+def _score(evaluations):
+    """候选得分：认为新提示更好的样本数减去更差的样本数"""
+    results = list(evaluations.values())
+    return results.count("B更好") - results.count("A更好")
+
+
+def _int_keys(mapping):
+    return {int(key) if isinstance(key, str) and key.isdigit() else key: value for key, value in mapping.items()}
+
+
+# 获取优化历史摘要
+def get_optimization_history_summary(history):
+    if not history:
+        return ""
+
+    # 只取最近3次迭代的历史
+    recent_history = history[-3:]
+
+    return "\n".join([
+        f"迭代{item['iteration']}: {'改进成功' if item['is_better'] else '未改进'}"
+        for item in recent_history
+    ])
+
+
+# 判断是否应该更新最佳提示
+def should_update_best_prompt(evaluations):
+    better_count = 0
+    worse_count = 0
+
+    for sample_id, result in evaluations.items():
+        if result == "B更好":
+            better_count += 1
+        elif result == "A更好":
+            worse_count += 1
+
+    # 如果有更多样本认为新提示更好，则更新
+    return better_count > worse_count
+
+
+class OptimizationEngine:
+    """驱动 优化 → 执行 → 评估 → 分析 → 决策 的迭代流程
+
+    各阶段方法只读取传入的状态、不修改它；decide/step 返回新的状态对象。
+    界面可以逐个调用阶段方法插入自己的展示逻辑，也可以直接调用 step/run。
+    """
+
+    def __init__(self, service, max_concurrency=DEFAULT_MAX_CONCURRENCY, beam_width=1, halving_eta=2,
+                 beam_min_samples=2, adaptive_eval="off", batch_judging=False, events=None, checkpoints=None,
+                 context_budget=None, budget=None, usage=None):
+        self.service = service
+        # 运行存储中的一次运行（store.Run）：每个子阶段完成后写检查点，中断后只补跑缺失的部分
+        self.checkpoints = checkpoints
+        # 默认与服务共用事件总线，订阅一次即可收到阶段、样本和API调用事件
+        self.events = events or getattr(service, "events", None) or EventBus()
+        self.max_concurrency = max_concurrency
+        # 自适应评估："off" 评估全部样本；"majority"/"sprt" 结论确定后提前停止
+        self.adaptive_eval = adaptive_eval or "off"
+        # 批量评估：一次评估请求携带所有样本，优先于自适应评估
+        self.batch_judging = batch_judging
+        # 束搜索：每次迭代生成beam_width个候选，按successive halving逐轮淘汰
+        self.beam_width = max(1, int(beam_width))
+        self.halving_eta = max(2, int(halving_eta))
+        self.beam_min_samples = max(1, int(beam_min_samples))
+        # 优化器上下文中样本输出的token预算，None时使用LLM_OPTIMIZER_CONTEXT_TOKENS
+        self.context_budget = context_budget
+        # token/费用预算（usage.Budget）：预计下一次迭代会超出时停止运行
+        self.budget = budget
+        # 用量统计：每次迭代取走期间的API用量；界面每次重新创建引擎，需要传入会话中共享的UsageMeter
+        self.usage = usage or UsageMeter(self.events)
+
+    def _sample_callback(self, stage, on_result=None):
+        """包装on_result：每个样本完成时先发布sample_done事件"""
+        def callback(sample_id, result, error):
+            self.events.publish("sample_done", stage=stage, sample_id=sample_id, error=error)
+            if on_result:
+                on_result(sample_id, result, error)
+        return callback
+
+    @staticmethod
+    def _checkpoint_iteration(state, stage):
+        # 初始化阶段（测试样本、初始提示词输出）记在第0次迭代
+        return 0 if stage in ("samples", "baseline") else state.current_iteration + 1
+
+    def _restore(self, state, stage):
+        """当前迭代中整个阶段已保存的结果，没有检查点时返回None"""
+        if not self.checkpoints:
+            return None
+        return self.checkpoints.restore(self._checkpoint_iteration(state, stage), stage)
+
+    def _checkpoint(self, state, stage, value):
+        if self.checkpoints:
+            self.checkpoints.save(self._checkpoint_iteration(state, stage), stage, value)
+
+    def restored(self, state, stage):
+        """当前迭代中该阶段已保存的逐样本结果 {样本ID: 结果}"""
+        if not self.checkpoints:
+            return {}
+        return self.checkpoints.restore_samples(self._checkpoint_iteration(state, stage), stage)
+
+    def checkpoint_samples(self, state, stage, results, errors=None):
+        """保存在引擎之外（如异步服务）得到的逐样本结果，失败的样本不保存"""
+        if not self.checkpoints:
+            return
+        iteration = self._checkpoint_iteration(state, stage)
+        for sample_id, result in results.items():
+            if sample_id not in (errors or {}):
+                self.checkpoints.save(iteration, stage, result, sample_id)
+
+    def _traced(self, stage, fn):
+        def traced(sample):
+            with self.events.span(stage, category="sample", sample_id=sample['id']):
+                return fn(sample)
+        return traced
+
+    def _resumable(self, state, stage, fn, on_result=None):
+        """包装逐样本函数和完成回调，返回 (fn, on_result)
+
+        已有检查点的样本直接返回保存的结果、不调用API；新结果在完成回调（调用线程）中写入检查点。
+        实际执行的样本各记录一个追踪span。
+        """
+        callback = self._sample_callback(stage, on_result)
+        fn = self._traced(stage, fn)
+        if not self.checkpoints:
+            return fn, callback
+        iteration = self._checkpoint_iteration(state, stage)
+        restored = self.checkpoints.restore_samples(iteration, stage)
+
+        def run(sample):
+            if sample['id'] in restored:
+                return restored[sample['id']]
+            return fn(sample)
+
+        def done(sample_id, result, error):
+            if error is None and sample_id not in restored:
+                self.checkpoints.save(iteration, stage, result, sample_id)
+            callback(sample_id, result, error)
+
+        return run, done
+
+    def generate_samples(self, task_description):
+        with self.events.stage("samples"):
+            samples = self.service.generate_samples(task_description)
+        # 给每个样本添加ID
+        for i, sample in enumerate(samples):
+            sample['id'] = i + 1
+        return samples
+
+    def run_current_best_prompt(self, state, on_result=None):
+        """执行当前最佳提示词，返回 (outputs, errors)"""
+        return self.execute(state, state.current_best_prompt, on_result=on_result, stage="baseline")
+
+    def initialize(self, state, on_result=None):
+        """生成测试样本（若尚未提供）并执行初始提示词，返回 (新状态, errors)"""
+        samples = state.samples or self._restore(state, "samples")
+        if not samples:
+            samples = self.generate_samples(state.task_description)
+            if samples:
+                self._checkpoint(state, "samples", samples)
+        if not samples:
+            raise Exception("生成测试样本失败")
+        state = replace(state, samples=samples)
+        outputs, errors = self.run_current_best_prompt(state, on_result=on_result)
+        state = replace(state, current_best_outputs=outputs, usage=add_usage(state.usage, self.usage.take()))
+        if self.checkpoints:
+            self.checkpoints.save_state(state)
+        return state, errors
+
+    def optimizer_context(self, state):
+        """优化器看到的当前输出：在token预算内挑选、截断，返回 (文本, 统计)
+
+        统计中的prompt_tokens_before/prompt_tokens为改用预算前后整个优化提示词的估算token数。
+        """
+        history = get_optimization_history_summary(state.optimization_history)
+        text, info = build_output_context(
+            state.samples, state.current_best_outputs, state.optimization_history, state.evaluations,
+            self.context_budget
+        )
+        info["prompt_tokens_before"] = count_tokens(optimize_prompt_text(
+            state.current_best_prompt, json.dumps(state.current_best_outputs), state.task_description, history
+        ))
+        info["prompt_tokens"] = count_tokens(optimize_prompt_text(
+            state.current_best_prompt, text, state.task_description, history
+        ))
+        return text, info
+
+    def propose(self, state):
+        """1. 生成新提示候选"""
+        restored = self._restore(state, "propose")
+        if restored:
+            return restored
+        with self.events.stage("propose"):
+            context, info = self.optimizer_context(state)
+            self.events.publish("context", **info)
+            new_prompt = self.service.optimize_prompt(
+                state.current_best_prompt,
+                context,
+                state.task_description,
+                get_optimization_history_summary(state.optimization_history)
+            )
+        if not new_prompt:
+            raise Exception("优化提示词失败")
+        self._checkpoint(state, "propose", new_prompt)
+        return new_prompt
+
+    def execute(self, state, prompt, on_result=None, stage="execute"):
+        """2. 并发执行提示词，返回 (outputs, errors)"""
+        run, done = self._resumable(
+            state, stage, lambda sample: self.service.execute_prompt(prompt, sample['question']), on_result
+        )
+        with self.events.stage(stage, total=len(state.samples)):
+            return map_samples(run, state.samples, max_workers=self.max_concurrency, on_result=done)
+
+    def execute_stream(self, state, prompt, on_delta, on_result=None, stage="execute"):
+        """2. 并发流式执行提示词，返回 (outputs, errors)
+
+        on_delta(sample_id, delta) 在工作线程中回调，只带本块新增文本，界面需自行累积并转到脚本线程渲染。
+        """
+        def stream(sample):
+            return self.service.execute_prompt_stream(
+                prompt,
+                sample['question'],
+                lambda delta: on_delta(sample['id'], delta)
+            )
+
+        run, done = self._resumable(state, stage, stream, on_result)
+        with self.events.stage(stage, total=len(state.samples)):
+            return map_samples(run, state.samples, max_workers=self.max_concurrency, on_result=done)
+
+    def _judge(self, state, new_outputs, sample):
+        result = self.service.evaluate_outputs(
+            state.current_best_outputs.get(sample['id'], ""),
+            new_outputs.get(sample['id'], ""),
+            state.task_description,
+            sample['question']
+        )
+        return verdict_label(result['winner'])
+
+    @property
+    def sequential_eval(self):
+        return self.adaptive_eval != "off" and not self.batch_judging
+
+    def evaluate(self, state, new_outputs, on_result=None):
+        """3. 评估新旧输出，返回 (evaluations, errors)，失败的样本记为相似"""
+        if self.batch_judging:
+            return self.evaluate_batch(state, new_outputs, on_result)
+        run, done = self._resumable(
+            state, "evaluate", lambda sample: self._judge(state, new_outputs, sample), on_result
+        )
+        with self.events.stage("evaluate", total=len(state.samples)):
+            return map_samples(run, state.samples, max_workers=self.max_concurrency, on_result=done, default="相似")
+
+    def evaluate_batch(self, state, new_outputs, on_result=None):
+        """3. 批量评估：所有样本合并为一次（超长时分批）评估请求，返回 (evaluations, errors)"""
+        restored = self.restored(state, "evaluate")
+        items = [
+            {
+                "id": sample['id'],
+                "question": sample['question'],
+                "output_a": state.current_best_outputs.get(sample['id'], ""),
+                "output_b": new_outputs.get(sample['id'], "")
+            }
+            for sample in state.samples
+            if sample['id'] not in restored
+        ]
+        with self.events.stage("evaluate", total=len(state.samples)):
+            verdicts, errors = self.service.evaluate_outputs_batch(
+                items, state.task_description, max_workers=self.max_concurrency
+            ) if items else ({}, {})
+            callback = self._sample_callback("evaluate", on_result)
+            evaluations = {}
+            for sample in state.samples:
+                sample_id = sample['id']
+                if sample_id in restored:
+                    evaluations[sample_id] = restored[sample_id]
+                elif sample_id in verdicts:
+                    evaluations[sample_id] = verdict_label(verdicts[sample_id]['winner'])
+                    if sample_id not in errors:
+                        self.checkpoint_samples(state, "evaluate", {sample_id: evaluations[sample_id]})
+                else:
+                    continue
+                callback(sample_id, evaluations[sample_id], errors.get(sample_id))
+        return evaluations, errors
+
+    def evaluate_sequential(self, state, new_outputs, on_result=None):
+        """3. 自适应评估，结论确定后停止，返回 (evaluations, errors, info)
+
+        info中的saved为本次迭代节省（没有发出）的评估调用数，abandoned为结论确定时仍在途、结果被丢弃的调用数。
+        """
+        run, done = self._resumable(
+            state, "evaluate", lambda sample: self._judge(state, new_outputs, sample), on_result
+        )
+        with self.events.stage("evaluate", total=len(state.samples)):
+            return evaluate_adaptive(
+                run,
+                state.samples,
+                mode=self.adaptive_eval,
+                max_workers=self.max_concurrency,
+                on_result=done
+            )
+
+    def analyze(self, state, new_prompt):
+        """4. 分析提示变化"""
+        restored = self._restore(state, "analyze")
+        if restored is not None:
+            return restored
+        with self.events.stage("analyze"):
+            analysis = self.service.analyze_changes(
+                state.current_best_prompt,
+                new_prompt,
+                state.task_description
+            )
+        self._checkpoint(state, "analyze", analysis)
+        return analysis
+
+    def decide(self, state, new_prompt, new_outputs, evaluations, analysis, errors=None, **extra):
+        """5. 根据评估结果决定是否更新最佳提示，返回 (新状态, 历史记录)
+
+        extra中的字段（如adaptive、beam）一并写入历史记录；配置了运行存储时保存新状态。
+        """
+        with self.events.stage("decide"):
+            return self._decide(state, new_prompt, new_outputs, evaluations, analysis, errors, **extra)
+
+    def _decide(self, state, new_prompt, new_outputs, evaluations, analysis, errors=None, **extra):
+        is_better = should_update_best_prompt(evaluations)
+        iteration = state.current_iteration + 1
+        record = {
+            "iteration": iteration,
+            "prompt": new_prompt,
+            "is_better": is_better,
+            "analysis": analysis,
+            "evaluations": evaluations
+        }
+        if errors:
+            record["errors"] = errors
+        # 优化器上下文压缩前后的token数，按迭代记录
+        record["context"] = self.optimizer_context(state)[1]
+        record.update({key: value for key, value in extra.items() if value})
+        # 本次迭代（含生成候选、执行、评估、分析）的API用量
+        record["usage"] = self.usage.take()
+
+        new_state = replace(
+            state,
+            current_iteration=iteration,
+            new_prompt=new_prompt,
+            new_outputs=new_outputs,
+            evaluations=evaluations,
+            analysis=analysis,
+            current_best_prompt=new_prompt if is_better else state.current_best_prompt,
+            current_best_outputs=new_outputs if is_better else state.current_best_outputs,
+            optimization_history=state.optimization_history + [record],
+            usage=add_usage(state.usage, record["usage"])
+        )
+        if self.checkpoints:
+            self.checkpoints.save_state(new_state, record)
+        self.events.publish("iteration_finished", iteration=iteration, is_better=is_better, usage=record["usage"])
+        return new_state, record
+
+    def propose_candidates(self, state):
+        """1. 一次生成beam_width个候选提示"""
+        restored = self._restore(state, "candidates")
+        if restored:
+            return restored
+        with self.events.stage("propose"):
+            context, info = self.optimizer_context(state)
+            self.events.publish("context", **info)
+            candidates = self.service.optimize_prompt_candidates(
+                state.current_best_prompt,
+                context,
+                state.task_description,
+                get_optimization_history_summary(state.optimization_history),
+                n=self.beam_width
+            )
+        if not candidates:
+            raise Exception("优化提示词失败")
+        self._checkpoint(state, "candidates", candidates)
+        return candidates
+
+    def beam_search(self, state, candidates):
+        """2-3. 用successive halving在候选间分配执行和评估预算
+
+        第一轮所有候选只在前beam_min_samples个样本上执行和评估，按(更好 - 更差)得分
+        保留前 1/halving_eta，下一轮样本数乘以halving_eta，直到只剩一个候选或覆盖全部样本；
+        最终胜出者总会在全部样本上完成评估，以便沿用多数决策。
+        返回 (胜出候选下标, 每个候选的输出, 每个候选的评估, 搜索摘要, errors)
+        """
+        samples = state.samples
+        total = len(samples)
+        outputs = {index: {} for index in range(len(candidates))}
+        evaluations = {index: {} for index in range(len(candidates))}
+        errors = {}
+        rounds = []
+        evaluator_calls = 0
+
+        survivors = list(range(len(candidates)))
+        budget = min(total, self.beam_min_samples)
+        while True:
+            # 只补跑本轮新增的 (候选, 样本) 组合
+            pairs = [
+                {"id": (index, sample['id']), "candidate": index, "sample": sample}
+                for index in survivors
+                for sample in samples[:budget]
+                if sample['id'] not in evaluations[index]
+            ]
+            run, done = self._resumable(
+                state, "beam", lambda pair: self._execute_and_judge(state, candidates[pair["candidate"]], pair["sample"])
+            )
+            with self.events.stage("beam", total=len(pairs), samples=budget, candidates=len(survivors)):
+                results, pair_errors = map_samples(
+                    run,
+                    pairs,
+                    max_workers=self.max_concurrency,
+                    on_result=done,
+                    default=("", "相似")
+                )
+            for (index, sample_id), (output, verdict) in results.items():
+                outputs[index][sample_id] = output
+                evaluations[index][sample_id] = verdict
+            for (index, sample_id), error in pair_errors.items():
+                errors[f"{index}:{sample_id}"] = error
+            evaluator_calls += len(pairs)
+
+            survivors.sort(key=lambda index: (-_score(evaluations[index]), index))
+            rounds.append({
+                "samples": budget,
+                "candidates": len(survivors),
+                "scores": {index: _score(evaluations[index]) for index in survivors}
+            })
+            if budget >= total:
+                break
+            survivors = survivors[:max(1, math.ceil(len(survivors) / self.halving_eta))]
+            # 只剩一个候选时直接补齐全部样本
+            budget = total if len(survivors) == 1 else min(total, budget * self.halving_eta)
+
+        summary = {
+            "candidates": len(candidates),
+            "rounds": rounds,
+            "evaluator_calls": evaluator_calls,
+            "full_evaluation_calls": len(candidates) * total
+        }
+        return survivors[0], outputs, evaluations, summary, errors
+
+    def _execute_and_judge(self, state, prompt, sample):
+        output = self.service.execute_prompt(prompt, sample['question'])
+        result = self.service.evaluate_outputs(
+            state.current_best_outputs.get(sample['id'], ""),
+            output,
+            state.task_description,
+            sample['question']
+        )
+        return output, verdict_label(result['winner'])
+
+    def beam_step(self, state):
+        """束搜索模式下的一次迭代，返回 (新状态, 历史记录)"""
+        candidates = self.propose_candidates(state)
+        winner, outputs, evaluations, summary, errors = self.beam_search(state, candidates)
+        new_prompt = candidates[winner]
+
+        step_errors = {"beam": errors} if errors else {}
+        try:
+            analysis = self.analyze(state, new_prompt)
+        except Exception as e:
+            analysis = ""
+            step_errors["analyze"] = str(e)
+
+        return self.decide(
+            state, new_prompt, outputs[winner], evaluations[winner], analysis, step_errors, beam=summary
+        )
+
+    def step(self, state, on_delta=None):
+        """执行一次完整迭代，返回 (新状态, 历史记录)
+
+        指定on_delta(sample_id, delta)时执行阶段走流式接口（束搜索不支持流式）。
+        """
+        if self.beam_width > 1:
+            return self.beam_step(state)
+
+        new_prompt = self.propose(state)
+        if on_delta:
+            new_outputs, execute_errors = self.execute_stream(state, new_prompt, on_delta)
+        else:
+            new_outputs, execute_errors = self.execute(state, new_prompt)
+        adaptive = None
+        if self.sequential_eval:
+            evaluations, evaluate_errors, adaptive = self.evaluate_sequential(state, new_outputs)
+        else:
+            evaluations, evaluate_errors = self.evaluate(state, new_outputs)
+
+        errors = {}
+        if execute_errors:
+            errors["execute"] = execute_errors
+        if evaluate_errors:
+            errors["evaluate"] = evaluate_errors
+
+        # 分析只用于展示，失败不影响决策
+        try:
+            analysis = self.analyze(state, new_prompt)
+        except Exception as e:
+            analysis = ""
+            errors["analyze"] = str(e)
+
+        return self.decide(state, new_prompt, new_outputs, evaluations, analysis, errors, adaptive=adaptive)
+
+    @staticmethod
+    def iteration_estimate(state):
+        """下一次迭代的预计用量：取已完成迭代中用量最大的一次，还没有迭代时为None"""
+        usages = [item["usage"] for item in state.optimization_history if item.get("usage")]
+        return max(usages, key=lambda usage: (usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0),
+                                              usage.get("cost", 0)), default=None)
+
+    def check_budget(self, state):
+        """按当前预算重新判断是否停止，返回新状态
+
+        预计下一次迭代会超出预算时设置stop_reason；预算放宽后续跑时清除之前的stop_reason。
+        """
+        if state.current_iteration >= state.max_iterations:
+            return state
+        reason = (self.budget.check(state.usage, self.iteration_estimate(state)) if self.budget else None) or ""
+        if reason == state.stop_reason:
+            return state
+        state = replace(state, stop_reason=reason)
+        if reason:
+            self.events.publish("budget_stop", reason=reason, usage=state.usage)
+        if self.checkpoints:
+            self.checkpoints.save_state(state)
+        return state
+
+    def run(self, state, on_iteration=None):
+        """迭代直到达到最大次数或预算用尽，on_iteration(state, record) 在每次迭代后回调"""
+        state = self.check_budget(state)
+        while not state.finished:
+            state, record = self.step(state)
+            if on_iteration:
+                on_iteration(state, record)
+            state = self.check_budget(state)
+        return state
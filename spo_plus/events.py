@@ -0,0 +1,120 @@
+"""进度事件总线：引擎和服务发布结构化事件，界面或命令行订阅后展示真实进度
+
+事件类型：
+- stage_started / stage_finished：阶段开始/结束，stage 为 samples/baseline/propose/execute/evaluate/analyze/beam/
+  decide，逐样本的阶段附带样本总数 total，结束事件附带 elapsed 和（失败时）error
+- sample_done：某阶段中单个样本完成，附带 sample_id 和（失败时）error
+- tokens：流式输出收到一段增量，附带 chars
+- llm_call：一次API调用结束（含重试），附带 model、role、latency、响应中的 usage 和（失败时）error
+- llm_retry：可重试的错误后即将重试，附带 role、attempt 和 error
+- cache_hit：命中响应缓存或评估缓存（或两份输出相同免评估），没有发出API调用，附带 role、model 和 cache
+- span：一段计时代码结束（用于追踪），stage 为名称，附带开始时间 start、elapsed、category 和其他属性
+- iteration_finished：一次迭代结束，附带 iteration、is_better 和该次迭代的 usage
+- budget_stop：预计下一次迭代会超出token/费用预算，运行停止，附带 reason 和已用的 usage
+- context：生成候选前组织好优化器上下文，附带样本的 included/truncated/omitted 数、
+  上下文 tokens，以及压缩前后整个优化提示词的 prompt_tokens_before/prompt_tokens
+"""
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+
+@dataclass(frozen=True)
+class Event:
+    type: str
+    stage: str = None
+    sample_id: object = None
+    data: dict = field(default_factory=dict)
+    time: float = field(default_factory=time.time)
+
+
+class EventBus:
+    """同步分发的事件总线，可以在任意线程发布，订阅者在发布线程中被调用"""
+
+    def __init__(self):
+        self._handlers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, handler):
+        with self._lock:
+            self._handlers.append(handler)
+        return handler
+
+    def unsubscribe(self, handler):
+        with self._lock:
+            if handler in self._handlers:
+                self._handlers.remove(handler)
+
+    def publish(self, event_type, stage=None, sample_id=None, **data):
+        event = Event(event_type, stage=stage, sample_id=sample_id, data=data)
+        with self._lock:
+            handlers = list(self._handlers)
+        for handler in handlers:
+            try:
+                handler(event)
+            except Exception:
+                # 订阅者出错不影响优化流程
+                pass
+        return event
+
+    @contextmanager
+    def stage(self, name, **data):
+        """发布阶段开始事件，退出时发布带耗时的结束事件"""
+        self.publish("stage_started", stage=name, **data)
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.publish("stage_finished", stage=name, elapsed=time.perf_counter() - start, error=str(e), **data)
+            raise
+        self.publish("stage_finished", stage=name, elapsed=time.perf_counter() - start, **data)
+
+    @contextmanager
+    def span(self, name, category="span", sample_id=None, **data):
+        """计时一段代码，结束时发布一个span事件；只用于追踪，进度展示不消费它"""
+        start = time.time()
+        begin = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.publish("span", stage=name, sample_id=sample_id, start=start, elapsed=time.perf_counter() - begin,
+                         category=category, error=str(e), **data)
+            raise
+        self.publish("span", stage=name, sample_id=sample_id, start=start, elapsed=time.perf_counter() - begin,
+                     category=category, **data)
+
+
+class EventQueue:
+    """线程安全的事件缓冲：工作线程中发布的事件在订阅方线程中统一取出
+
+    Streamlit元素只能在脚本线程中更新，界面通过 drain() 在轮询时消费事件。
+    """
+
+    def __init__(self, bus, types=None):
+        self.bus = bus
+        self.types = set(types) if types else None
+        self._queue = queue.SimpleQueue()
+        bus.subscribe(self)
+
+    def __call__(self, event):
+        if self.types is None or event.type in self.types:
+            self._queue.put(event)
+
+    def drain(self):
+        events = []
+        while True:
+            try:
+                events.append(self._queue.get_nowait())
+            except queue.Empty:
+                return events
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
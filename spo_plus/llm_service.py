@@ -0,0 +1,497 @@
+"""LLM服务：封装对OpenAI兼容接口的调用
+
+BaseLLMService包含同步与异步服务共用的部分：请求体构造、缓存读写、限流反馈、事件发布和响应解析。
+LLMService（requests）与AsyncLLMService（httpx）只实现网络I/O和多个请求的并发方式。
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager, nullcontext
+
+from . import prompts
+from .cache import cache_key
+from .events import EventBus
+from .parallel import DEFAULT_MAX_CONCURRENCY, map_samples
+from .prompts import CHAT_ENDPOINT, DEFAULT_MODELS, chat_payload, message_content
+from .ratelimit import estimate_tokens, estimate_usage, get_rate_limiter, parse_retry_after
+from .resilience import ResilientCaller, is_context_overflow
+from .sse import ChatStream
+from .transport import PoolConfig, get_session
+
+# 批量评估单次请求的提示词长度上限（字符），超出时自动分批
+EVAL_BATCH_MAX_CHARS = int(os.getenv("LLM_EVAL_BATCH_MAX_CHARS", "24000"))
+# 流式请求是否带 stream_options.include_usage，让服务端在最后一块返回用量
+STREAM_USAGE = os.getenv("LLM_STREAM_USAGE", "true").lower() == "true"
+
+
+class BaseLLMService:
+    """同步与异步服务共用的配置、请求体、缓存和响应处理，不做网络I/O"""
+
+    def __init__(self, api_key=None, base_url=None, pool_config=None, response_cache=None, judgment_cache=None,
+                 models=None, events=None, rate_limiter=None, resilience=None, cassette=None):
+        self.api_key = api_key
+        self.base_url = base_url or os.getenv("DEFAULT_API_BASE_URL", "https://api.siliconflow.cn")
+        self.pool_config = pool_config or PoolConfig.from_env()
+        # 录制/回放：录制时照常发出请求并写入录制文件，回放时不访问网络
+        self.cassette = cassette
+        # 执行结果与成对评估结果缓存（None表示不缓存）
+        self.response_cache = response_cache
+        self.judgment_cache = judgment_cache
+        # 各角色使用的模型，未指定的角色使用默认模型
+        self.models = {**DEFAULT_MODELS, **(models or {})}
+        # 按API Key共享的客户端限流器：令牌桶 + AIMD自适应并发，同步与异步服务共用
+        self.rate_limiter = rate_limiter or get_rate_limiter(self.base_url, api_key)
+        # 重试与对冲，按角色统计延迟分位数
+        self.resilience = resilience or ResilientCaller()
+        # 进度事件总线：每次API调用发布llm_call，流式增量发布tokens；两种服务共用时界面可以统一订阅
+        self.events = events or EventBus()
+        # 服务端不接受stream_options时关闭，之后的流式请求不再携带
+        self.stream_usage = STREAM_USAGE
+
+    def get_headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
+
+    def get_cache_stats(self):
+        """响应缓存命中统计"""
+        return self.response_cache.stats() if self.response_cache else None
+
+    def get_rate_limit_stats(self):
+        """限流器当前并发上限、限流次数与排队耗时"""
+        return self.rate_limiter.stats()
+
+    def get_latency_stats(self):
+        """按角色的p50/p95/p99延迟，以及重试和对冲次数"""
+        return self.resilience.stats()
+
+    def get_judgment_stats(self):
+        """成对评估缓存命中统计"""
+        return self.judgment_cache.stats() if self.judgment_cache else None
+
+    def get_cassette_stats(self):
+        """录制/回放的交互数"""
+        return self.cassette.stats() if self.cassette else None
+
+    # 响应处理
+
+    def _throttled(self, response, attempt, started):
+        """429/5xx时让限流器降低并发上限，返回是否应在Retry-After之后重新排队（仅429，最多throttle_retries次）
+
+        429只在这里重新排队，ResilientCaller不重试429；5xx交给ResilientCaller重试。
+        """
+        status = response.status_code
+        if status != 429 and status < 500:
+            return False
+        self.rate_limiter.on_throttle(status, parse_retry_after(response.headers.get("Retry-After")), started)
+        return status == 429 and attempt < self.rate_limiter.config.throttle_retries
+
+    def _stream_payload(self, data, usage=None):
+        """流式请求体；usage（默认为stream_usage）为True时请求服务端在最后一块返回用量"""
+        payload = dict(data, stream=True)
+        if self.stream_usage if usage is None else usage:
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def _stream_options_rejected(self, error):
+        """带stream_options的流式请求返回400，可能是服务端不接受该字段，应去掉后再试一次"""
+        return self.stream_usage and getattr(getattr(error, "response", None), "status_code", None) == 400
+
+    def _read_json(self, response, data):
+        """检查状态码并解析JSON，异常保持原始类型以便判断能否重试"""
+        response.raise_for_status()
+        result = response.json()
+        self.rate_limiter.on_success(data.get("model"), estimate_tokens(data), result.get("usage"))
+        return result
+
+    def _on_retry(self, role):
+        return lambda attempt, error: self.events.publish("llm_retry", role=role, attempt=attempt, error=str(error))
+
+    def _call_failed(self, data, role, start, error):
+        self.events.publish("llm_call", model=data.get("model"), role=role,
+                            latency=time.perf_counter() - start, error=str(error))
+        return Exception(f"LLM API调用失败: {str(error)}")
+
+    def _call_done(self, data, role, start, result):
+        usage = result.get("usage") or estimate_usage(data, "".join(self._candidates(result)))
+        self.events.publish("llm_call", model=data.get("model"), role=role, latency=time.perf_counter() - start,
+                            usage=usage)
+        return result
+
+    def _stream_done(self, payload, stream, start, key):
+        """流式响应读完后反馈限流器、发布带finish_reason和usage的llm_call并写入缓存，返回完整文本
+
+        请求带stream_options.include_usage，服务端不支持、最后一块没有usage时按字符数估计。
+        """
+        full_response = stream.text
+        usage = stream.usage or estimate_usage(payload, full_response)
+        self.rate_limiter.on_success(payload["model"], estimate_tokens(payload), usage)
+        self.events.publish(
+            "llm_call", model=payload["model"], role="executor", latency=time.perf_counter() - start,
+            finish_reason=stream.finish_reason, usage=usage
+        )
+        self._store_response(key, full_response)
+        return full_response
+
+    # 请求体
+
+    def _samples_payload(self, task_description):
+        return chat_payload(prompts.samples_prompt(task_description), 0.7, self.models["optimizer"])
+
+    def _execute_payload(self, prompt, question):
+        return chat_payload(prompts.execute_content(prompt, question), 0.3, self.models["executor"])
+
+    def _optimize_payload(self, current_prompt, current_output, task_description, history="", n=1):
+        payload = chat_payload(
+            prompts.optimize_prompt_text(current_prompt, current_output, task_description, history), 0.7,
+            self.models["optimizer"]
+        )
+        if n > 1:
+            payload["n"] = n
+        return payload
+
+    def _evaluate_payload(self, output_a, output_b, task_description, question):
+        return chat_payload(
+            prompts.evaluate_prompt_text(output_a, output_b, task_description, question), 0.3, self.models["evaluator"]
+        )
+
+    def _judge_payload(self, chunk, task_description):
+        return chat_payload(
+            prompts.evaluate_batch_prompt_text(task_description, chunk), 0.3, self.models["evaluator"]
+        )
+
+    def _analyze_payload(self, old_prompt, new_prompt, task_description):
+        return chat_payload(
+            prompts.analyze_prompt_text(old_prompt, new_prompt, task_description), 0.5, self.models["analyzer"]
+        )
+
+    @staticmethod
+    def _candidates(response):
+        """响应中各choice的非空文本"""
+        candidates = [
+            choice.get("message", {}).get("content", "")
+            for choice in response.get("choices", [])
+        ]
+        return [candidate for candidate in candidates if candidate]
+
+    @staticmethod
+    def _unique(candidates, n):
+        return list(dict.fromkeys(candidate for candidate in candidates if candidate))[:n]
+
+    # 缓存
+
+    def _cached_execute(self, payload):
+        """返回 (缓存键, 缓存内容)，未启用缓存时均为None"""
+        if not self.response_cache:
+            return None, None
+        key = cache_key(self.base_url, payload)
+        return key, self.response_cache.get(key)
+
+    def _store_response(self, key, content):
+        if key and content:
+            self.response_cache.set(key, content)
+
+    def _cache_hit(self, role, model, cache):
+        """没有发出API调用的结果也发布事件，追踪中可以看到缓存命中"""
+        self.events.publish("cache_hit", role=role, model=model, cache=cache)
+
+    def _known_verdict(self, output_a, output_b, task_description, question):
+        """输出相同或命中评估缓存时返回评估结果，否则返回None"""
+        model = self.models["evaluator"]
+        # 两个输出完全相同时直接判为相似
+        if output_a == output_b:
+            if self.judgment_cache:
+                self.judgment_cache.record_identical()
+            self._cache_hit("evaluator", model, "identical")
+            return prompts.identical_verdict()
+        if self.judgment_cache:
+            cached = self.judgment_cache.get(task_description, question, output_a, output_b, model)
+            if cached is not None:
+                self._cache_hit("evaluator", model, "judgment")
+                return cached
+        return None
+
+    def _store_verdict(self, output_a, output_b, task_description, question, verdict):
+        if self.judgment_cache and verdict["details"]:
+            self.judgment_cache.set(task_description, question, output_a, output_b, self.models["evaluator"], verdict)
+
+    def _pending_judgments(self, items, task_description):
+        """返回 (不需要请求的评估结果, 需要请求的样本)"""
+        verdicts = {}
+        pending = []
+        for item in items:
+            verdict = self._known_verdict(item["output_a"], item["output_b"], task_description, item["question"])
+            if verdict is None:
+                pending.append(item)
+            else:
+                verdicts[item["id"]] = verdict
+        return verdicts, pending
+
+    def _collect_judgments(self, chunks, parsed_chunks, task_description, verdicts, errors):
+        """把各批解析成功的结果写入verdicts和评估缓存，返回需要逐样本评估的样本
+
+        批量请求失败（不是超出上下文长度）的批次中的样本记为相似并写入errors，不再逐样本重试。
+        """
+        fallback = []
+        for chunk, parsed in zip(chunks, parsed_chunks):
+            if isinstance(parsed, Exception):
+                for item in chunk:
+                    verdicts[item["id"]] = prompts.parse_verdict("")
+                    errors[item["id"]] = str(parsed)
+                continue
+            for item in chunk:
+                verdict = parsed.get(item["id"])
+                if verdict is None:
+                    fallback.append(item)
+                    continue
+                verdicts[item["id"]] = verdict
+                self._store_verdict(item["output_a"], item["output_b"], task_description, item["question"], verdict)
+        return fallback
+
+
+class LLMService(BaseLLMService):
+    def __init__(self, api_key=None, base_url=None, pool_config=None, response_cache=None, judgment_cache=None,
+                 models=None, limiter=None, events=None, rate_limiter=None, resilience=None, cassette=None):
+        super().__init__(api_key, base_url, pool_config, response_cache, judgment_cache, models, events,
+                         rate_limiter, resilience, cassette)
+        # 连接池按主机在进程内共享，跨rerun和会话复用长连接
+        self.session = get_session(self.base_url, self.pool_config)
+        if cassette is not None:
+            self.session = cassette.wrap_session(self.session)
+        # 可选的并发限制器（上下文管理器），如批量模式下跨进程共享的信号量
+        self.limiter = limiter
+
+    @contextmanager
+    def _request(self, endpoint, data, stream=False):
+        """经过限流器发出请求，产出未检查状态码的响应，退出时关闭响应
+
+        并发名额和跨进程信号量一直占用到退出，流式响应读完之前也算在途请求。
+        429/5xx会让限流器降低并发上限；429在Retry-After之后重新排队，最多throttle_retries次。
+        """
+        model = data.get("model")
+        tokens = estimate_tokens(data)
+        attempt = 0
+        while True:
+            # 先在进程内排队，再占用跨进程的信号量，避免排队时阻塞其他进程
+            with self.rate_limiter.slot(model, tokens) as started, self.limiter or nullcontext():
+                response = self.session.post(
+                    f"{self.base_url}/{endpoint}",
+                    json=data,
+                    headers=self.get_headers(),
+                    timeout=self.pool_config.timeout,
+                    stream=stream
+                )
+                with response:
+                    if not self._throttled(response, attempt, started):
+                        yield response
+                        return
+            attempt += 1
+
+    def _request_json(self, endpoint, data):
+        """发出一次请求并解析JSON"""
+        with self._request(endpoint, data) as response:
+            return self._read_json(response, data)
+
+    def _open_stream(self, endpoint, data):
+        """建立流式连接，返回 (ExitStack, 响应)；关闭ExitStack时关闭响应并归还并发名额"""
+        stack = ExitStack()
+        response = stack.enter_context(self._request(endpoint, data, stream=True))  # 设置requests为流式请求
+        try:
+            response.raise_for_status()
+        except Exception:
+            stack.close()
+            raise
+        return stack, response
+
+    def call_llm_api(self, endpoint, data, role=None):
+        """调用LLM API，可重试的错误自动重试；启用对冲时超过该角色p95延迟会再发一份请求"""
+        start = time.perf_counter()
+        try:
+            result = self.resilience.call(
+                role, lambda: self._request_json(endpoint, data), on_retry=self._on_retry(role)
+            )
+        except Exception as e:
+            # 保留原始异常作为__cause__，调用方可以据此区分错误类型（如超出上下文长度）
+            raise self._call_failed(data, role, start, e) from e
+        return self._call_done(data, role, start, result)
+
+    @contextmanager
+    def call_llm_api_stream(self, endpoint, data, role=None):
+        """流式调用LLM API，产出已检查状态码的响应，读完或提前退出时关闭
+
+        只重试建立连接阶段，已开始输出的流不重试也不对冲。
+        """
+        try:
+            try:
+                stack, response = self._connect_stream(endpoint, self._stream_payload(data), role)
+            except Exception as e:
+                if not self._stream_options_rejected(e):
+                    raise
+                # 去掉stream_options再试一次，成功后本服务不再携带，用量改为按字符数估计
+                stack, response = self._connect_stream(endpoint, self._stream_payload(data, usage=False), role)
+                self.stream_usage = False
+        except Exception as e:
+            raise Exception(f"流式API调用失败: {str(e)}")
+        with stack:
+            yield response
+
+    def _connect_stream(self, endpoint, payload, role):
+        return self.resilience.call(
+            None, lambda: self._open_stream(endpoint, payload), hedge=False, on_retry=self._on_retry(role)
+        )
+
+    def get_transport_stats(self):
+        """连接池命中与握手耗时统计"""
+        return self.session.stats.snapshot()
+
+    def generate_samples(self, task_description):
+        # 实现样本生成
+        response = self.call_llm_api(CHAT_ENDPOINT, self._samples_payload(task_description), role="optimizer")
+        return prompts.parse_samples(message_content(response))
+
+    def execute_prompt(self, prompt, question):
+        """执行提示词获取输出"""
+        payload = self._execute_payload(prompt, question)
+        key, cached = self._cached_execute(payload)
+        if cached is not None:
+            self._cache_hit("executor", payload["model"], "response")
+            return cached
+
+        content = message_content(self.call_llm_api(CHAT_ENDPOINT, payload, role="executor"))
+        self._store_response(key, content)
+        return content
+
+    def execute_prompt_stream(self, prompt, question, callback):
+        """带流式输出的执行提示词
+
+        每读到一个网络数据块回调一次 callback(本块新增文本)，需要累计文本的调用方自行保存增量、
+        在渲染时才拼接（见 render.join_deltas），避免每个数据块都复制一遍已输出的全文。
+        结束后在llm_call事件中附带finish_reason和usage。
+        """
+        payload = self._execute_payload(prompt, question)
+        key, cached = self._cached_execute(payload)
+        if cached is not None:
+            self._cache_hit("executor", payload["model"], "response")
+            # 命中缓存时一次性回调完整结果
+            callback(cached)
+            return cached
+
+        start = time.perf_counter()
+
+        # 按原始字节块增量解析
+        stream = ChatStream()
+
+        # 处理流式响应；提前break时也要关闭响应，把连接归还连接池、并发名额归还限流器
+        with self.call_llm_api_stream(CHAT_ENDPOINT, payload, role="executor") as response:
+            for chunk in response.iter_content(chunk_size=None):
+                self._emit_delta(stream.feed(chunk), callback)
+                if stream.done:
+                    break
+            else:
+                self._emit_delta(stream.close(), callback)
+
+        return self._stream_done(payload, stream, start, key)
+
+    def _emit_delta(self, delta, callback):
+        if delta:
+            self.events.publish("tokens", chars=len(delta))
+            callback(delta)  # 回调函数处理每个增量
+
+    def optimize_prompt(self, current_prompt, current_output, task_description, history=""):
+        """优化提示词"""
+        response = self.call_llm_api(
+            CHAT_ENDPOINT, self._optimize_payload(current_prompt, current_output, task_description, history),
+            role="optimizer"
+        )
+        return message_content(response)
+
+    def optimize_prompt_candidates(self, current_prompt, current_output, task_description, history="", n=1):
+        """一次生成n个候选提示词
+
+        先用接口的n参数在一次请求中采样多个结果；服务端不支持n（返回的choices不足）时，
+        剩余的候选并行单独请求。返回去重后的候选列表。
+        """
+        payload = self._optimize_payload(current_prompt, current_output, task_description, history, n)
+        candidates = self._candidates(self.call_llm_api(CHAT_ENDPOINT, payload, role="optimizer"))
+
+        missing = n - len(candidates)
+        if missing > 0:
+            with ThreadPoolExecutor(max_workers=missing, thread_name_prefix="spo-optimize") as pool:
+                futures = [
+                    pool.submit(self.optimize_prompt, current_prompt, current_output, task_description, history)
+                    for _ in range(missing)
+                ]
+                for future in futures:
+                    try:
+                        candidates.append(future.result())
+                    except Exception:
+                        continue
+
+        return self._unique(candidates, n)
+
+    def evaluate_outputs(self, output_a, output_b, task_description, question):
+        """评估输出质量"""
+        verdict = self._known_verdict(output_a, output_b, task_description, question)
+        if verdict is not None:
+            return verdict
+
+        payload = self._evaluate_payload(output_a, output_b, task_description, question)
+        verdict = prompts.parse_verdict(message_content(self.call_llm_api(CHAT_ENDPOINT, payload, role="evaluator")))
+        self._store_verdict(output_a, output_b, task_description, question, verdict)
+        return verdict
+
+    def evaluate_outputs_batch(self, items, task_description, max_chars=EVAL_BATCH_MAX_CHARS,
+                               max_workers=DEFAULT_MAX_CONCURRENCY):
+        """一次评估请求评估多个样本，返回按样本ID排序的 (verdicts, errors)
+
+        items为 {"id", "question", "output_a", "output_b"} 列表。输出相同或命中评估缓存的样本不占用请求，
+        其余样本按max_chars分批，每批一次请求；超出上下文长度时对半拆分重试，
+        无法解析的条目回退为逐样本评估。批量请求因其他原因失败、或逐样本评估失败的样本记为相似并写入errors。
+        """
+        verdicts, pending = self._pending_judgments(items, task_description)
+        chunks = prompts.chunk_judgments(pending, task_description, max_chars)
+        parsed_chunks = []
+        for chunk in chunks:
+            try:
+                parsed_chunks.append(self._judge_chunk(chunk, task_description))
+            except Exception as e:
+                parsed_chunks.append(e)
+        errors = {}
+        fallback = self._collect_judgments(chunks, parsed_chunks, task_description, verdicts, errors)
+
+        results, fallback_errors = map_samples(
+            lambda item: self.evaluate_outputs(item["output_a"], item["output_b"], task_description, item["question"]),
+            fallback,
+            max_workers=max_workers,
+            default=prompts.parse_verdict("")
+        )
+        verdicts.update(results)
+        errors.update(fallback_errors)
+        return {sample_id: verdicts[sample_id] for sample_id in sorted(verdicts)}, errors
+
+    def _judge_chunk(self, chunk, task_description):
+        """批量评估一批样本，返回解析成功的 {样本ID: 评估结果}；单个样本直接交给逐样本评估"""
+        if len(chunk) < 2:
+            return {}
+        payload = self._judge_payload(chunk, task_description)
+        try:
+            content = message_content(self.call_llm_api(CHAT_ENDPOINT, payload, role="evaluator"))
+        except Exception as e:
+            # 只有超出上下文长度时拆分才有意义，其他错误（鉴权、限流、网络）原样抛出
+            if not is_context_overflow(e):
+                raise
+            # 对半拆分后重试
+            middle = len(chunk) // 2
+            return {
+                **self._judge_chunk(chunk[:middle], task_description),
+                **self._judge_chunk(chunk[middle:], task_description)
+            }
+        return prompts.parse_batch_verdicts(content, [item["id"] for item in chunk])
+
+    def analyze_changes(self, old_prompt, new_prompt, task_description):
+        """分析提示词变化"""
+        response = self.call_llm_api(
+            CHAT_ENDPOINT, self._analyze_payload(old_prompt, new_prompt, task_description), role="analyzer"
+        )
+        return message_content(response)
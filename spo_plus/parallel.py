@@ -0,0 +1,39 @@
+"""样本并发执行：有界线程池 + 按样本ID排序 + 单样本错误隔离"""
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "5"))
+
+
+def _sample_id(sample):
+    return sample['id']
+
+
+def map_samples(fn, samples, max_workers=DEFAULT_MAX_CONCURRENCY, on_result=None, default="", key=_sample_id):
+    """在有界线程池中对每个样本执行 fn(sample)，返回 (results, errors)
+
+    - 同时在途的请求数不超过 max_workers，设为1即逐个执行
+    - results 按 key(sample)（默认 sample['id']）排序，与完成顺序无关
+    - 单个样本失败只记录到 errors，对应结果为 default，不影响其他样本
+    - on_result(sample_id, result, error) 在调用线程中按完成顺序回调，可安全更新UI
+    """
+    results = {}
+    errors = {}
+    if not samples:
+        return results, errors
+
+    workers = max(1, min(int(max_workers or 1), len(samples)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="spo-exec") as pool:
+        futures = {pool.submit(fn, sample): key(sample) for sample in samples}
+        for future in as_completed(futures):
+            sample_id = futures[future]
+            try:
+                results[sample_id] = future.result()
+            except Exception as e:
+                results[sample_id] = default
+                errors[sample_id] = str(e)
+            if on_result:
+                on_result(sample_id, results[sample_id], errors.get(sample_id))
+
+    return {sample_id: results[sample_id] for sample_id in sorted(results)}, errors
+
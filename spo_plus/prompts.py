@@ -0,0 +1,215 @@
+"""各角色的提示模板与响应解析，供同步和异步LLM服务共用"""
+import json
+
+DEFAULT_MODEL = "deepseek-ai/DeepSeek-V3"
+# 各角色默认模型：优化(LLM-1，也负责生成样本)、执行(LLM-2)、评估(LLM-3)、分析(LLM-4)
+DEFAULT_MODELS = {
+    "optimizer": DEFAULT_MODEL,
+    "executor": DEFAULT_MODEL,
+    "evaluator": DEFAULT_MODEL,
+    "analyzer": DEFAULT_MODEL,
+}
+CHAT_ENDPOINT = "v1/chat/completions"
+
+
+def chat_payload(content, temperature, model=DEFAULT_MODEL):
+    """构造单轮对话请求体"""
+    return {
+        "model": model,
+        "messages": [{"role": "user", "content": content}],
+        "temperature": temperature
+    }
+
+
+def message_content(response):
+    """取出非流式响应的文本内容"""
+    return response.get("choices", [{}])[0].get("message", {}).get("content", "")
+
+
+def samples_prompt(task_description):
+    return f"""请为以下任务生成5个测试样例，每个样例应包含问题和期望的回答标准：
+
+任务描述：{task_description}
+
+请返回JSON格式：
+[
+    {{"question": "问题1", "expected": "期望标准1"}},
+    ...
+]
+"""
+
+
+def parse_samples(content):
+    """解析样本JSON，失败时返回简化版样本"""
+    try:
+        # 提取JSON部分
+        json_str = content[content.find("["):content.rfind("]")+1]
+        samples = json.loads(json_str)
+        # 给每个样本添加ID
+        for i, sample in enumerate(samples):
+            sample['id'] = i + 1
+        return samples
+    except:
+        # 如果解析失败，返回简化版样本
+        return [
+            {"question": "示例问题1", "expected": "期望回答标准1"},
+            {"question": "示例问题2", "expected": "期望回答标准2"}
+        ]
+
+
+def execute_content(prompt, question):
+    return f"{prompt}\n\n{question}"
+
+
+def optimize_prompt_text(current_prompt, current_output, task_description, history=""):
+    return f"""请优化以下提示词，使其更有效地完成任务：
+
+任务描述：{task_description}
+
+当前提示词：
+{current_prompt}
+
+当前输出示例：
+{current_output}
+
+优化历史：
+{history}
+
+请直接返回优化后的完整提示词，不要有其他解释。"""
+
+
+def evaluate_prompt_text(output_a, output_b, task_description, question):
+    return f"""请评估以下两个输出，哪一个更好地完成了任务：
+
+任务描述：{task_description}
+
+问题：{question}
+
+输出A：
+{output_a}
+
+输出B：
+{output_b}
+
+请给出详细评估，并明确指出哪个更好（A、B或相似）："""
+
+
+def parse_verdict(result):
+    """简单解析评估结果"""
+    if "输出A更好" in result or "A更好" in result:
+        winner = "A"
+    elif "输出B更好" in result or "B更好" in result:
+        winner = "B"
+    else:
+        winner = "similar"
+
+    return {
+        "details": result,
+        "winner": winner
+    }
+
+
+def evaluate_batch_prompt_text(task_description, items):
+    """一次请求评估多个样本，items为 {"id", "question", "output_a", "output_b"} 列表"""
+    entries = "\n\n".join(_batch_entry_text(item) for item in items)
+    return f"""请逐一评估以下每个样本的两个输出，判断哪一个更好地完成了任务：
+
+任务描述：{task_description}
+
+{entries}
+
+请只返回JSON数组，每个样本一项，不要有其他内容：
+[
+    {{"id": 样本ID, "winner": "A、B或similar", "reason": "简要理由"}},
+    ...
+]"""
+
+
+def _batch_entry_text(item):
+    return f"""### 样本ID: {item['id']}
+问题：{item['question']}
+
+输出A：
+{item['output_a']}
+
+输出B：
+{item['output_b']}"""
+
+
+def chunk_judgments(items, task_description, max_chars):
+    """按提示词长度把待评估样本切分为若干批，单个超长样本独占一批"""
+    overhead = len(evaluate_batch_prompt_text(task_description, []))
+    chunks = []
+    chunk = []
+    size = overhead
+    for item in items:
+        entry_size = len(_batch_entry_text(item)) + 2
+        if chunk and size + entry_size > max_chars:
+            chunks.append(chunk)
+            chunk = []
+            size = overhead
+        chunk.append(item)
+        size += entry_size
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def parse_batch_verdicts(content, ids):
+    """解析批量评估返回的JSON数组，返回 {样本ID: 评估结果}
+
+    只保留ID属于本批、winner可识别的条目，其余样本由调用方回退为逐样本评估。
+    """
+    try:
+        entries = json.loads(content[content.find("["):content.rfind("]")+1])
+    except ValueError:
+        return {}
+    if not isinstance(entries, list):
+        return {}
+
+    ids_by_text = {str(sample_id): sample_id for sample_id in ids}
+    winners = {"a": "A", "b": "B", "similar": "similar", "相似": "similar"}
+    verdicts = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        sample_id = ids_by_text.get(str(entry.get("id")))
+        winner = winners.get(str(entry.get("winner", "")).strip().lower())
+        if sample_id is None or winner is None:
+            continue
+        verdicts[sample_id] = {
+            "details": str(entry.get("reason", "")),
+            "winner": winner
+        }
+    return verdicts
+
+
+def identical_verdict():
+    """两个输出完全相同时的评估结果，无需调用评估模型"""
+    return {
+        "details": "两个输出完全相同",
+        "winner": "similar"
+    }
+
+
+def verdict_label(winner):
+    """将winner映射为界面和历史记录使用的评估结论"""
+    if winner == 'A':
+        return "A更好"
+    elif winner == 'B':
+        return "B更好"
+    return "相似"
+
+
+def analyze_prompt_text(old_prompt, new_prompt, task_description):
+    return f"""请分析以下提示词的变化，并解释这些变化如何提升了提示词的效果：
+
+任务描述：{task_description}
+
+旧提示词：
+{old_prompt}
+
+新提示词：
+{new_prompt}
+
+请详细说明："""
@@ -0,0 +1,300 @@
+"""客户端限流：按模型的令牌桶（请求数/分钟、token数/分钟）+ AIMD自适应并发
+
+并发请求一多，上游就会返回429。限流器在发出请求前排队等待，收到429/5xx时
+把并发上限减半并遵守Retry-After，成功时再逐步加回，使吞吐稳定在上游能承受的水平。
+限额按API Key计算，因此限流器与连接池一样放在模块级注册表中，在rerun和会话之间共享。
+
+所有等待都通过返回"还需等待的秒数"实现，同步调用用time.sleep，协程用asyncio.sleep。
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+
+# 并发已满时重新检查的间隔（秒）
+POLL_INTERVAL = 0.05
+
+
+def _parse_model_limits(value):
+    """解析形如 "deepseek-ai/DeepSeek-V3=60:100000,Qwen/Qwen2.5-7B-Instruct=1000:50000" 的配置"""
+    limits = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        model, limit = item.rsplit("=", 1)
+        rpm, _, tpm = limit.partition(":")
+        if model.strip() and rpm.strip().isdigit():
+            limits[model.strip()] = (int(rpm.strip()), int(tpm.strip()) if tpm.strip().isdigit() else 0)
+    return limits
+
+
+def parse_retry_after(value):
+    """解析Retry-After头（秒数或HTTP日期），无法解析时返回None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(payload):
+    """粗略估计请求的prompt token数（中文约每2个字符1个token）"""
+    chars = sum(len(message.get("content", "")) for message in payload.get("messages", []))
+    return max(1, chars // 2)
+
+
+def estimate_usage(payload, text):
+    """响应中没有usage时按字符数估计的用量，带estimated标记"""
+    prompt_tokens = estimate_tokens(payload)
+    completion_tokens = len(text) // 2 if text else 0
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "estimated": True,
+    }
+
+
+@dataclass(frozen=True)
+class RateLimitConfig:
+    """限流配置，rpm/tpm为0表示不限制"""
+    rpm: int = 0                       # 每个模型每分钟请求数
+    tpm: int = 0                       # 每个模型每分钟token数
+    model_limits: tuple = ()           # 按模型覆盖 ((model, (rpm, tpm)), ...)
+    initial_concurrency: int = 16      # AIMD初始并发上限
+    min_concurrency: int = 1
+    max_concurrency: int = 16
+    backoff: float = 0.5               # 限流时并发上限乘以该系数
+    default_retry_after: float = 1.0   # 429未带Retry-After时的等待秒数
+    throttle_retries: int = 3          # 429后重新排队的次数
+
+    @classmethod
+    def from_env(cls):
+        """从环境变量读取配置"""
+        max_concurrency = int(os.getenv("LLM_ADAPTIVE_MAX_CONCURRENCY", cls.max_concurrency))
+        return cls(
+            rpm=int(os.getenv("LLM_RPM", cls.rpm)),
+            tpm=int(os.getenv("LLM_TPM", cls.tpm)),
+            model_limits=tuple(sorted(_parse_model_limits(os.getenv("LLM_MODEL_LIMITS")).items())),
+            initial_concurrency=int(os.getenv("LLM_ADAPTIVE_INITIAL_CONCURRENCY", max_concurrency)),
+            min_concurrency=int(os.getenv("LLM_ADAPTIVE_MIN_CONCURRENCY", cls.min_concurrency)),
+            max_concurrency=max_concurrency,
+            backoff=float(os.getenv("LLM_ADAPTIVE_BACKOFF", cls.backoff)),
+            default_retry_after=float(os.getenv("LLM_DEFAULT_RETRY_AFTER", cls.default_retry_after)),
+            throttle_retries=int(os.getenv("LLM_THROTTLE_RETRIES", cls.throttle_retries)),
+        )
+
+    def limits_for(self, model):
+        return dict(self.model_limits).get(model, (self.rpm, self.tpm))
+
+
+class TokenBucket:
+    """令牌桶：容量为一分钟的额度，按秒匀速补充"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, amount=1):
+        """额度足够时扣除并返回0，否则返回还需等待的秒数（不扣除）"""
+        amount = min(float(amount), self.capacity)
+        with self._lock:
+            self._refill(time.monotonic())
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return 0.0
+            return (amount - self.tokens) / self.rate
+
+    def adjust(self, amount):
+        """按实际用量修正已扣除的额度，amount为正表示少扣了"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class AdaptiveConcurrency:
+    """AIMD并发控制：成功时上限加性增长（每个上限窗口+1），限流时乘性减少
+
+    一次减少之前发出的请求反映的是减少前的并发，它们随后收到的限流不再减少上限，
+    同一波被限流的请求只让上限减少一次。
+    """
+
+    def __init__(self, initial, minimum, maximum, backoff):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.backoff = backoff
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.decreased_at = 0.0
+        self._lock = threading.Lock()
+
+    def try_enter(self):
+        """取得并发名额时返回0，否则返回建议等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self.blocked_until:
+                return self.blocked_until - now
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return 0.0
+            return POLL_INTERVAL
+
+    def leave(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def on_success(self):
+        with self._lock:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+
+    def on_throttle(self, retry_after=None, started=None):
+        """started为请求取得并发名额的时刻（time.monotonic），早于上次减少时只处理Retry-After"""
+        with self._lock:
+            now = time.monotonic()
+            if started is None or started >= self.decreased_at:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self.decreased_at = now
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+
+class RateLimiter:
+    """组合按模型的令牌桶与AIMD并发控制，统计限流次数与排队耗时"""
+
+    def __init__(self, config=None):
+        self.config = config or RateLimitConfig.from_env()
+        self.concurrency = AdaptiveConcurrency(
+            self.config.initial_concurrency,
+            self.config.min_concurrency,
+            self.config.max_concurrency,
+            self.config.backoff
+        )
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.throttled = 0
+        self.server_errors = 0
+        self.wait_time = 0.0
+
+    def _buckets_for(self, model):
+        with self._lock:
+            if model not in self._buckets:
+                rpm, tpm = self.config.limits_for(model)
+                self._buckets[model] = (TokenBucket(rpm) if rpm else None, TokenBucket(tpm) if tpm else None)
+            return self._buckets[model]
+
+    def _bucket_delays(self, model, tokens):
+        """依次尝试取得请求额度和token额度，生成每一步需要等待的秒数"""
+        requests_bucket, tokens_bucket = self._buckets_for(model)
+        for bucket, amount in ((requests_bucket, 1), (tokens_bucket, tokens)):
+            while bucket:
+                delay = bucket.try_take(amount)
+                if not delay:
+                    break
+                yield delay
+
+    def _record_wait(self, elapsed):
+        with self._lock:
+            self.wait_time += elapsed
+
+    @contextmanager
+    def slot(self, model, tokens=1):
+        """同步调用：等待并发名额与额度，产出取得名额的时刻，退出时归还并发名额"""
+        start = time.monotonic()
+        while True:
+            delay = self.concurrency.try_enter()
+            if not delay:
+                break
+            time.sleep(delay)
+        try:
+            for delay in self._bucket_delays(model, tokens):
+                time.sleep(delay)
+            started = time.monotonic()
+            self._record_wait(started - start)
+            yield started
+        finally:
+            self.concurrency.leave()
+
+    @asynccontextmanager
+    async def aslot(self, model, tokens=1):
+        """协程版slot"""
+        start = time.monotonic()
+        while True:
+            delay = self.concurrency.try_enter()
+            if not delay:
+                break
+            await asyncio.sleep(delay)
+        try:
+            for delay in self._bucket_delays(model, tokens):
+                await asyncio.sleep(delay)
+            started = time.monotonic()
+            self._record_wait(started - start)
+            yield started
+        finally:
+            self.concurrency.leave()
+
+    def on_success(self, model=None, estimated_tokens=0, usage=None):
+        """请求成功：加回并发上限，并用响应中的usage修正token额度"""
+        self.concurrency.on_success()
+        if model and usage and usage.get("total_tokens"):
+            _, tokens_bucket = self._buckets_for(model)
+            if tokens_bucket:
+                tokens_bucket.adjust(usage["total_tokens"] - estimated_tokens)
+
+    def on_throttle(self, status_code, retry_after=None, started=None):
+        """收到429或5xx：并发上限减半；429还要在Retry-After之前暂停发出新请求
+
+        started为slot产出的时刻，在上次减少之前发出的请求不再减少上限。
+        返回429时重新排队前需要等待的秒数，5xx返回None。
+        """
+        with self._lock:
+            if status_code == 429:
+                self.throttled += 1
+            else:
+                self.server_errors += 1
+        if status_code == 429:
+            retry_after = self.config.default_retry_after if retry_after is None else retry_after
+            self.concurrency.on_throttle(retry_after, started)
+            return retry_after
+        self.concurrency.on_throttle(started=started)
+        return None
+
+    def stats(self):
+        return {
+            "concurrency_limit": int(self.concurrency.limit),
+            "in_flight": self.concurrency.in_flight,
+            "throttled": self.throttled,
+            "server_errors": self.server_errors,
+            "wait_time": self.wait_time,
+        }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(base_url, api_key=None, config=None):
+    """按 (base_url, API Key) 共享限流器，上游的限额是按Key计算的"""
+    config = config or RateLimitConfig.from_env()
+    key_digest = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+    registry_key = (base_url.rstrip("/"), key_digest, config)
+    with _limiters_lock:
+        if registry_key not in _limiters:
+            _limiters[registry_key] = RateLimiter(config)
+        return _limiters[registry_key]
@@ -0,0 +1,248 @@
+"""调用弹性：可重试错误分类、带抖动的指数退避、按角色的延迟分位数与对冲请求
+
+对冲（hedging）：某次调用超过该角色历史p95延迟仍未返回时，再发出一份相同的请求，
+取先成功的结果。聊天补全没有副作用，重复请求只多消耗一次额度。
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from dataclasses import dataclass
+
+import httpx
+import requests
+
+# 可以重试的HTTP状态码：超时、冲突和服务端临时错误。
+# 429由限流器在Retry-After之后重新排队（RateLimitConfig.throttle_retries），这里不再重试，避免两层重试叠加
+RETRYABLE_STATUS = {408, 409, 425, 500, 502, 503, 504}
+
+# 请求超出模型上下文长度时，错误信息中出现的关键词（小写）
+CONTEXT_OVERFLOW_MARKERS = ("context", "length", "too long", "too many tokens", "上下文", "长度")
+
+
+def is_retryable(error):
+    """判断异常是否值得重试：网络错误、超时、响应不完整和可重试的状态码"""
+    response = getattr(error, "response", None)
+    status_code = getattr(response, "status_code", None)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                          httpx.TransportError, httpx.DecodingError)):
+        return True
+    # 响应体被截断时JSON解析失败；完整但不是JSON的响应体（如网关的HTML错误页）重试也不会成功
+    if isinstance(error, (requests.exceptions.JSONDecodeError, json.JSONDecodeError)):
+        return _truncated(error)
+    return False
+
+
+def _truncated(error):
+    """JSON解析在文档末尾出错，或字符串没有结束，说明响应体不完整"""
+    return error.msg.startswith("Unterminated string") or error.pos >= len(error.doc.rstrip())
+
+
+def is_context_overflow(error):
+    """判断异常（或引发它的异常）是否为请求超出上下文长度：400且错误信息提到上下文或长度，或413"""
+    while error is not None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+        if status_code == 413:
+            return True
+        if status_code == 400:
+            text = (response.text or "").lower()
+            return any(marker in text for marker in CONTEXT_OVERFLOW_MARKERS)
+        error = error.__cause__
+    return False
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """重试与对冲配置"""
+    max_attempts: int = 3              # 含首次调用在内的最大尝试次数
+    base_delay: float = 0.5            # 第n次重试前等待 uniform(0, base_delay * 2^n)
+    max_delay: float = 8.0
+    hedge: bool = False                # 是否启用对冲请求
+    hedge_quantile: float = 0.95       # 超过该分位数延迟时发出对冲请求
+    hedge_min_samples: int = 20        # 样本不足时不对冲
+
+    @classmethod
+    def from_env(cls, hedge=None):
+        """从环境变量读取配置，hedge不为None时覆盖LLM_HEDGE"""
+        return cls(
+            max_attempts=int(os.getenv("LLM_RETRY_ATTEMPTS", cls.max_attempts)),
+            base_delay=float(os.getenv("LLM_RETRY_BASE_DELAY", cls.base_delay)),
+            max_delay=float(os.getenv("LLM_RETRY_MAX_DELAY", cls.max_delay)),
+            hedge=os.getenv("LLM_HEDGE", "false").lower() == "true" if hedge is None else hedge,
+            hedge_quantile=float(os.getenv("LLM_HEDGE_QUANTILE", cls.hedge_quantile)),
+            hedge_min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", cls.hedge_min_samples)),
+        )
+
+    def backoff(self, attempt):
+        """第attempt次重试前的等待秒数（full jitter）"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+def _quantile(values, q):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class LatencyTracker:
+    """按角色记录最近的成功调用延迟，提供p50/p95/p99"""
+
+    def __init__(self, window=200):
+        self.window = window
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def record(self, role, elapsed):
+        with self._lock:
+            self._latencies.setdefault(role, deque(maxlen=self.window)).append(elapsed)
+
+    def quantile(self, role, q, min_samples=1):
+        with self._lock:
+            values = list(self._latencies.get(role, ()))
+        if len(values) < min_samples:
+            return None
+        return _quantile(values, q)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = {role: list(values) for role, values in self._latencies.items()}
+        return {
+            role: {
+                "count": len(values),
+                "p50": _quantile(values, 0.5),
+                "p95": _quantile(values, 0.95),
+                "p99": _quantile(values, 0.99),
+            }
+            for role, values in latencies.items() if values
+        }
+
+
+# 对冲请求在独立线程池中执行，落败的请求在后台跑完后丢弃结果
+_hedge_pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="spo-hedge")
+
+
+class ResilientCaller:
+    """在单次请求之外包装重试与对冲，同步和协程各一套入口"""
+
+    def __init__(self, policy=None, latency=None):
+        self.policy = policy or RetryPolicy.from_env()
+        self.latency = latency or LatencyTracker()
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _hedge_delay(self, role, hedge):
+        if not (hedge and self.policy.hedge and role):
+            return None
+        return self.latency.quantile(role, self.policy.hedge_quantile, self.policy.hedge_min_samples)
+
+    def call(self, role, fn, hedge=True, on_retry=None):
+        """同步调用fn()，可重试的错误按退避重试，on_retry(attempt, error)在每次重试前回调"""
+        for attempt in range(self.policy.max_attempts):
+            try:
+                return self._hedged(role, fn, hedge)
+            except Exception as e:
+                if attempt + 1 >= self.policy.max_attempts or not is_retryable(e):
+                    raise
+                self._count("retries")
+                if on_retry:
+                    on_retry(attempt + 1, e)
+                time.sleep(self.policy.backoff(attempt))
+
+    def _timed(self, role, fn):
+        start = time.perf_counter()
+        result = fn()
+        if role:
+            self.latency.record(role, time.perf_counter() - start)
+        return result
+
+    def _hedged(self, role, fn, hedge):
+        delay = self._hedge_delay(role, hedge)
+        if delay is None:
+            return self._timed(role, fn)
+
+        primary = _hedge_pool.submit(self._timed, role, fn)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        self._count("hedges")
+        backup = _hedge_pool.submit(self._timed, role, fn)
+        error = None
+        for future in as_completed([primary, backup]):
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            if future is backup:
+                self._count("hedge_wins")
+            return result
+        raise error
+
+    async def acall(self, role, make_coro, hedge=True, on_retry=None):
+        """协程版call，make_coro()每次返回一个新的协程"""
+        for attempt in range(self.policy.max_attempts):
+            try:
+                return await self._ahedged(role, make_coro, hedge)
+            except Exception as e:
+                if attempt + 1 >= self.policy.max_attempts or not is_retryable(e):
+                    raise
+                self._count("retries")
+                if on_retry:
+                    on_retry(attempt + 1, e)
+                await asyncio.sleep(self.policy.backoff(attempt))
+
+    async def _atimed(self, role, make_coro):
+        start = time.perf_counter()
+        result = await make_coro()
+        if role:
+            self.latency.record(role, time.perf_counter() - start)
+        return result
+
+    async def _ahedged(self, role, make_coro, hedge):
+        delay = self._hedge_delay(role, hedge)
+        if delay is None:
+            return await self._atimed(role, make_coro)
+
+        primary = asyncio.ensure_future(self._atimed(role, make_coro))
+        done, _ = await asyncio.wait({primary}, timeout=delay)
+        if done:
+            return primary.result()
+
+        self._count("hedges")
+        backup = asyncio.ensure_future(self._atimed(role, make_coro))
+        pending = {primary, backup}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    # 协程可以直接取消落败的请求
+                    for other in pending:
+                        other.cancel()
+                    if task is backup:
+                        self._count("hedge_wins")
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    def stats(self):
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "latency": self.latency.snapshot(),
+        }
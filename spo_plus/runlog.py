@@ -0,0 +1,225 @@
+"""只追加的JSONL运行日志：每完成一次迭代追加一行，导出和导入都逐行进行
+
+每行一个JSON对象，按type区分：
+- run：运行开始时的状态（任务描述、初始提示词、测试样本、初始输出、最大迭代次数、初始化的API用量）
+- iteration：一次迭代的历史记录record（含该次迭代的API用量），外加迭代后的当前最佳提示词；新提示词更好时附带其输出
+- state：从内存状态导出时写在最后，包含最后一次迭代的新输出、评估和分析，以及运行的总用量和停止原因
+
+按顺序重放即可还原OptimizationState。写日志只追加一行，导出时逐行生成，
+几百次迭代的运行也不需要把整个历史拼成一个JSON字符串。进程崩溃留下的半行在读取时跳过。
+"""
+import json
+import os
+import time
+
+from .engine import OptimizationState
+from .usage import add_usage
+
+LOG_VERSION = 1
+
+# 导入时视为最后一次迭代详情的字段
+_LAST_ITERATION_FIELDS = ("new_prompt", "new_outputs", "evaluations", "analysis")
+# state记录中覆盖重放结果的运行级字段
+_STATE_FIELDS = ("current_best_prompt", "current_best_outputs") + _LAST_ITERATION_FIELDS + ("usage", "stop_reason")
+
+
+def _line(record):
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def run_record(state):
+    return {
+        "type": "run",
+        "version": LOG_VERSION,
+        "task_description": state.task_description,
+        "current_best_prompt": state.current_best_prompt,
+        "max_iterations": state.max_iterations,
+        "samples": state.samples,
+        "current_best_outputs": state.current_best_outputs,
+        "usage": state.usage,
+        "time": time.time(),
+    }
+
+
+def iteration_record(state, record):
+    """state为该次迭代完成后的状态，改进时其当前最佳输出就是新提示词的输出"""
+    line = {
+        "type": "iteration",
+        "record": record,
+        "current_best_prompt": state.current_best_prompt,
+        "time": time.time(),
+    }
+    if record["is_better"]:
+        line["outputs"] = state.current_best_outputs
+    return line
+
+
+class RunLog:
+    """追加写入单个运行的JSONL日志"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._truncate_partial_line()
+
+    def _truncate_partial_line(self):
+        """进程崩溃时最后一行可能只写了一半，截掉后再追加，避免新记录接在半行后面"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb+") as f:
+            size = f.seek(0, os.SEEK_END)
+            end = size
+            while end > 0:
+                step = min(4096, end)
+                f.seek(end - step)
+                block = f.read(step)
+                index = block.rfind(b"\n")
+                if index >= 0:
+                    end = end - step + index + 1
+                    break
+                end -= step
+            if end != size:
+                f.truncate(end)
+
+    @property
+    def started(self):
+        return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+    def _append(self, record):
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(_line(record))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, state):
+        """写入运行开始的状态；续跑时日志已存在则跳过"""
+        if not self.started:
+            self._append(run_record(state))
+
+    def append(self, state, record):
+        """追加一次迭代，签名与 OptimizationEngine.run 的 on_iteration 一致"""
+        self._append(iteration_record(state, record))
+
+    def last_iteration(self):
+        """最后一行为迭代记录时返回其迭代次数，否则返回None；只读取文件末尾"""
+        if not self.started:
+            return None
+        with open(self.path, "rb") as f:
+            end = f.seek(0, os.SEEK_END)
+            data = b""
+            while end > 0:
+                step = min(65536, end)
+                end -= step
+                f.seek(end)
+                data = f.read(step) + data
+                if data.rstrip(b"\n").rfind(b"\n") >= 0:
+                    break
+        try:
+            item = json.loads(data.rstrip(b"\n").rsplit(b"\n", 1)[-1])
+        except ValueError:
+            return None
+        return item["record"]["iteration"] if item.get("type") == "iteration" else None
+
+    def lines(self):
+        """逐行读取日志文件，用于导出"""
+        with open(self.path, "r", encoding="utf-8") as f:
+            yield from f
+
+
+def export_lines(state):
+    """从内存中的状态逐行生成JSONL日志（没有增量日志的运行使用）"""
+    history = state.optimization_history
+    improved = any(item["is_better"] for item in history)
+    # 历史中不保存初始提示词：有过改进时无法还原，迭代记录中带有每次改进后的提示词
+    yield _line({
+        **run_record(state),
+        "current_best_prompt": "" if improved else state.current_best_prompt,
+        "current_best_outputs": {} if improved else state.current_best_outputs,
+        # 初始化的用量无法从总用量中拆出，总用量写在最后的state记录中
+        "usage": {},
+    })
+    for item in history:
+        yield _line({
+            "type": "iteration",
+            "record": item,
+            "current_best_prompt": item["prompt"] if item["is_better"] else None,
+        })
+    yield _line({
+        "type": "state",
+        "current_best_prompt": state.current_best_prompt,
+        "current_best_outputs": state.current_best_outputs,
+        **{name: getattr(state, name) for name in _LAST_ITERATION_FIELDS + ("usage", "stop_reason")},
+    })
+
+
+def write_run_log(f, lines):
+    """把逐行生成的日志写入文件对象，返回写入的行数"""
+    count = 0
+    for line in lines:
+        f.write(line)
+        count += 1
+    return count
+
+
+def iter_records(lines):
+    """逐行解析日志，跳过空行和写了一半的行"""
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8")
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+
+def replay(records):
+    """按顺序重放日志记录，返回还原的OptimizationState"""
+    state = None
+    for item in records:
+        kind = item.get("type")
+        if kind == "run":
+            state = OptimizationState.from_dict({
+                "task_description": item["task_description"],
+                "current_best_prompt": item["current_best_prompt"],
+                "max_iterations": item["max_iterations"],
+                "samples": item["samples"],
+                "current_best_outputs": item["current_best_outputs"],
+                "usage": item.get("usage") or {},
+            })
+        elif state is None:
+            raise Exception("运行日志缺少开头的run记录")
+        elif kind == "iteration":
+            record = OptimizationState.from_dict({"optimization_history": [item["record"]]}).optimization_history[0]
+            state.optimization_history.append(record)
+            state.current_iteration = record["iteration"]
+            state.new_prompt = record["prompt"]
+            state.evaluations = record["evaluations"]
+            state.analysis = record["analysis"]
+            state.new_outputs = {}
+            if record.get("usage"):
+                state.usage = add_usage(state.usage, record["usage"])
+            if item.get("current_best_prompt") is not None:
+                state.current_best_prompt = item["current_best_prompt"]
+            if "outputs" in item:
+                state.current_best_outputs = OptimizationState.from_dict(
+                    {"current_best_outputs": item["outputs"]}
+                ).current_best_outputs
+                state.new_outputs = state.current_best_outputs
+        elif kind == "state":
+            restored = OptimizationState.from_dict(item)
+            for name in _STATE_FIELDS:
+                if name in item:
+                    setattr(state, name, getattr(restored, name))
+    if state is None:
+        raise Exception("运行日志为空")
+    return state
+
+
+def load_run_log(lines):
+    """从日志行（打开的文件或任意可迭代对象）还原运行状态"""
+    return replay(iter_records(lines))
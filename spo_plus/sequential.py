@@ -0,0 +1,116 @@
+"""自适应顺序评估：多数结果已确定时提前停止，不再发出剩余的评估调用
+
+结论确定时已经发出的调用无法撤回，照常计费。evaluate_adaptive等它们返回后才结束，
+这些调用的用量仍记在本次迭代中；它们的结论被丢弃，单独计为abandoned，不算作节省的调用。
+
+两种判定规则：
+- majority：精确规则。剩余样本即使全部倒向另一方也无法改变 should_update_best_prompt 的结论时停止。
+- sprt：在majority基础上叠加序贯概率比检验（SPRT），适合样本较多的情况。
+  只统计有倾向的结论（A更好/B更好），检验 H1: P(B更好)=0.5+delta 与 H0: P(B更好)=0.5-delta，
+  对数似然比越过阈值即停止。由于两个假设关于0.5对称，越过上阈值时已评估部分一定是B更好占多数，
+  因此提前停止后的评估结果仍然可以直接交给 should_update_best_prompt。
+"""
+import math
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+ADAPTIVE_MODES = ("off", "majority", "sprt")
+
+
+class SequentialDecision:
+    """根据已得到的评估结论判断接受/拒绝新提示是否已经确定"""
+
+    def __init__(self, total, mode="majority", delta=0.2, alpha=0.05, beta=0.05):
+        self.total = total
+        self.mode = mode
+        self.better = 0
+        self.worse = 0
+        self.similar = 0
+        # 每多一个B更好/A更好，对数似然比变化 ±step
+        self.step = math.log((0.5 + delta) / (0.5 - delta))
+        self.upper = math.log((1 - beta) / alpha)
+        self.lower = math.log(beta / (1 - alpha))
+
+    @property
+    def evaluated(self):
+        return self.better + self.worse + self.similar
+
+    def add(self, verdict):
+        if verdict == "B更好":
+            self.better += 1
+        elif verdict == "A更好":
+            self.worse += 1
+        else:
+            self.similar += 1
+
+    def needed(self):
+        """至少还需要多少个结论才可能确定结果，用于限制同时发出的评估数"""
+        remaining = self.total - self.evaluated
+        if remaining <= 0:
+            return 0
+        to_accept = (self.worse + remaining - self.better) // 2 + 1
+        to_reject = math.ceil((self.better + remaining - self.worse) / 2)
+        return max(1, min(to_accept, to_reject, remaining))
+
+    def decision(self):
+        """返回 (是否已确定, 判定依据)"""
+        remaining = self.total - self.evaluated
+        if remaining <= 0:
+            return True, "complete"
+        if self.better > self.worse + remaining or self.better + remaining <= self.worse:
+            return True, "majority"
+        if self.mode == "sprt":
+            llr = (self.better - self.worse) * self.step
+            if llr >= self.upper or llr <= self.lower:
+                return True, "sprt"
+        return False, None
+
+
+def evaluate_adaptive(judge, samples, mode="majority", max_workers=1, on_result=None, default="相似", **sprt_options):
+    """按样本顺序评估，结论确定后不再发出剩余的评估调用
+
+    同时在途的评估数不超过 min(max_workers, 仍可能需要的结论数)，
+    因此并发不会浪费在结论确定后才返回的请求上。
+    返回 (evaluations, errors, info)。evaluations只包含结论确定前完成评估的样本；
+    info记录已评估数、节省的评估调用数（没有发出的调用）、结论确定时仍在途而被丢弃的调用数和停止依据。
+    """
+    decision = SequentialDecision(len(samples), mode=mode, **sprt_options)
+    evaluations = {}
+    errors = {}
+    decided, decided_by = decision.decision()
+    queue = list(samples)
+    in_flight = {}
+
+    pool = ThreadPoolExecutor(max_workers=max(1, int(max_workers or 1)), thread_name_prefix="spo-eval")
+    try:
+        while not decided and (queue or in_flight):
+            limit = min(max(1, int(max_workers or 1)), decision.needed())
+            while queue and len(in_flight) < limit:
+                sample = queue.pop(0)
+                in_flight[pool.submit(judge, sample)] = sample['id']
+
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                sample_id = in_flight.pop(future)
+                try:
+                    evaluations[sample_id] = future.result()
+                except Exception as e:
+                    evaluations[sample_id] = default
+                    errors[sample_id] = str(e)
+                decision.add(evaluations[sample_id])
+                if on_result:
+                    on_result(sample_id, evaluations[sample_id], errors.get(sample_id))
+
+            decided, decided_by = decision.decision()
+    finally:
+        # 取消尚未开始的调用；已经在途的调用照常计费，等它们返回，让其用量记在本次迭代而不是下一次
+        pool.shutdown(wait=True, cancel_futures=True)
+
+    abandoned = len(in_flight)
+    info = {
+        "mode": mode,
+        "evaluated": len(evaluations),
+        "saved": len(samples) - len(evaluations) - abandoned,
+        "abandoned": abandoned,
+        "decided_by": decided_by or "complete"
+    }
+    return {sample_id: evaluations[sample_id] for sample_id in sorted(evaluations)}, errors, info
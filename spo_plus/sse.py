@@ -0,0 +1,112 @@
+"""增量SSE解析：直接处理网络读到的原始字节块
+
+- 按字节查找行边界，只对data字段解码，兼容 \\n、\\r\\n 和 \\r 换行
+- 同一事件中的多行data按SSE规范以换行拼接
+- 增量文本先放入列表，读取累计文本时才拼接并缓存，回调次数按网络读取而不是按增量块计算
+- 结束时给出 finish_reason 和 usage（包括choices为空、只带usage的最后一块）
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # orjson为可选依赖，安装后解析更快
+    orjson = None
+
+_loads = orjson.loads if orjson else json.loads
+_JSON_ERRORS = (ValueError, orjson.JSONDecodeError) if orjson else (ValueError,)
+
+
+class SSEParser:
+    """把任意切分的字节块还原为SSE事件的data字符串"""
+
+    def __init__(self):
+        self._buffer = b""
+        self._data = []
+
+    def feed(self, chunk):
+        """输入一个字节块，返回其中完成的事件data列表"""
+        buffer = self._buffer + chunk if self._buffer else chunk
+        # \r 位于块末尾时可能还有后续的 \n，留到下一块再处理
+        held = b""
+        if buffer.endswith(b"\r"):
+            buffer, held = buffer[:-1], b"\r"
+        if b"\r" in buffer:
+            buffer = buffer.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        # 按行切分交给bytes.split在C层完成，最后一段是不完整的行
+        lines = buffer.split(b"\n")
+        self._buffer = lines.pop() + held
+        return self._lines(lines)
+
+    def close(self):
+        """流结束：处理最后一行和未以空行结束的事件"""
+        lines = [self._buffer.rstrip(b"\r"), b""] if self._buffer else [b""]
+        self._buffer = b""
+        return self._lines(lines)
+
+    def _lines(self, lines):
+        events = []
+        data = self._data
+        for line in lines:
+            if not line:
+                if data:
+                    events.append("\n".join(data))
+                    data = []
+            elif line.startswith(b"data:"):
+                value = line[6:] if line.startswith(b"data: ") else line[5:]
+                data.append(value.decode("utf-8"))
+            # 注释行（以:开头）以及event/id/retry字段与聊天补全无关，直接忽略
+        self._data = data
+        return events
+
+
+class ChatStream:
+    """解析OpenAI兼容的聊天补全流，累积回答文本与结束信息"""
+
+    def __init__(self, loads=None):
+        self.parser = SSEParser()
+        # 默认优先使用orjson，可以传入json.loads做对比
+        self.loads = loads or _loads
+        self._parts = []
+        self.finish_reason = None
+        self.usage = None
+        self.done = False
+
+    @property
+    def text(self):
+        """累计文本，读完整个流后取一次；拼接结果替换掉已拼接的片段"""
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def feed(self, chunk):
+        """输入一个字节块，返回其中新增的文本（可能为空字符串）"""
+        return self._consume(self.parser.feed(chunk))
+
+    def close(self):
+        return self._consume(self.parser.close())
+
+    def _consume(self, events):
+        deltas = []
+        for data in events:
+            if self.done:
+                break
+            if data == "[DONE]":
+                self.done = True
+                break
+            try:
+                payload = self.loads(data)
+            except _JSON_ERRORS:
+                continue
+            if payload.get("usage"):
+                self.usage = payload["usage"]
+            choices = payload.get("choices")
+            if choices:
+                content = (choices[0].get("delta") or {}).get("content")
+                if content:
+                    deltas.append(content)
+                if choices[0].get("finish_reason"):
+                    self.finish_reason = choices[0]["finish_reason"]
+        delta = "".join(deltas)
+        if delta:
+            self._parts.append(delta)
+        return delta
@@ -0,0 +1,276 @@
+"""基于SQLite的运行存储：检查点与断点续跑
+
+每次运行一行记录，包括运行摘要（状态、迭代次数）和完整状态的快照；当前未完成迭代的中间结果
+（测试样本、候选提示词、每个样本的输出和评估、分析）逐条写入检查点表。
+中断后重新打开运行，引擎从检查点取回已完成的部分，只对缺失的样本重新调用API。
+
+迭代完成时先向该运行的JSONL日志追加一行，再更新运行摘要并清除该迭代及之前的检查点。
+完整状态的快照只在初始化、预算停止状态变化、每SNAPSHOT_INTERVAL次迭代和运行结束时重写，
+每次迭代的保存开销不随历史长度增长；快照之后的迭代在打开运行时从日志重放。
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+from .engine import OptimizationState
+from .runlog import RunLog, export_lines, load_run_log
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id TEXT PRIMARY KEY,
+    task_description TEXT NOT NULL,
+    status TEXT NOT NULL,
+    current_iteration INTEGER NOT NULL,
+    max_iterations INTEGER NOT NULL,
+    state TEXT NOT NULL,
+    config TEXT NOT NULL,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    run_id TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    sample_key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (run_id, iteration, stage, sample_key)
+);
+"""
+
+# 每隔多少次迭代重写一次完整状态的快照
+SNAPSHOT_INTERVAL = int(os.getenv("SPO_SNAPSHOT_INTERVAL", "10"))
+
+# 整个阶段只有一个结果（样本列表、候选提示词、分析）时使用的sample_key
+_WHOLE_STAGE = ""
+
+
+def _dumps(value):
+    return json.dumps(value, ensure_ascii=False)
+
+
+def _decode_key(sample_key):
+    """还原样本键：整数样本ID、束搜索的 (候选, 样本ID) 元组"""
+    key = json.loads(sample_key)
+    return tuple(key) if isinstance(key, list) else key
+
+
+def default_store_path():
+    """SPO_RUN_STORE为数据库路径，默认放在缓存根目录下"""
+    root = os.getenv("LLM_CACHE_DIR", os.path.join("~", ".cache", "spo-plus")) or "."
+    return os.path.expanduser(os.getenv("SPO_RUN_STORE", os.path.join(root, "runs.sqlite3")))
+
+
+class RunStore:
+    """运行记录与检查点的SQLite存储，线程安全（每次操作使用独立连接）"""
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+
+    @classmethod
+    def from_env(cls):
+        return cls(default_store_path())
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.path, timeout=30))
+
+    def _execute(self, sql, params=()):
+        with self._lock, self._connect() as conn, conn:
+            return conn.execute(sql, params).fetchall()
+
+    def create_run(self, state, config=None, run_id=None):
+        """新建运行并保存初始状态，返回运行ID"""
+        run_id = run_id or uuid.uuid4().hex[:12]
+        now = time.time()
+        self._execute(
+            "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (run_id, state.task_description, self._status(state), state.current_iteration, state.max_iterations,
+             _dumps(state.to_dict()), _dumps(config or {}), now, now)
+        )
+        return run_id
+
+    @staticmethod
+    def _status(state):
+        if state.stop_reason:
+            return "stopped"
+        return "finished" if state.finished else "running"
+
+    def save_state(self, run_id, state, snapshot=True):
+        """保存完成的迭代（或初始化）后的状态，并清除已经并入状态的检查点
+
+        snapshot为False时只更新运行摘要，不重写完整状态（此后的迭代由运行日志记录）。
+        """
+        with self._lock, self._connect() as conn, conn:
+            if snapshot:
+                conn.execute(
+                    "UPDATE runs SET status = ?, current_iteration = ?, max_iterations = ?, state = ?, updated = ? "
+                    "WHERE id = ?",
+                    (self._status(state), state.current_iteration, state.max_iterations, _dumps(state.to_dict()),
+                     time.time(), run_id)
+                )
+            else:
+                conn.execute(
+                    "UPDATE runs SET status = ?, current_iteration = ?, max_iterations = ?, updated = ? WHERE id = ?",
+                    (self._status(state), state.current_iteration, state.max_iterations, time.time(), run_id)
+                )
+            conn.execute(
+                "DELETE FROM checkpoints WHERE run_id = ? AND iteration <= ?", (run_id, state.current_iteration)
+            )
+
+    def update_config(self, run_id, config):
+        self._execute("UPDATE runs SET config = ?, updated = ? WHERE id = ?", (_dumps(config), time.time(), run_id))
+
+    def load_run(self, run_id):
+        """返回 (状态字典, 配置)，运行不存在时返回 (None, None)
+
+        日志中有快照之后的迭代（两次快照之间，或追加日志后、更新数据库前中断）时重放日志还原状态。
+        """
+        rows = self._execute("SELECT state, config FROM runs WHERE id = ?", (run_id,))
+        if not rows:
+            return None, None
+        state, config = json.loads(rows[0][0]), json.loads(rows[0][1])
+        log = RunLog(self.log_path(run_id))
+        if log.started and (log.last_iteration() or 0) > state.get("current_iteration", 0):
+            state = load_run_log(log.lines()).to_dict()
+        return state, config
+
+    def list_runs(self, limit=20):
+        """按最近更新时间列出运行摘要"""
+        rows = self._execute(
+            "SELECT r.id, r.task_description, r.status, r.current_iteration, r.max_iterations, r.created, r.updated, "
+            "(SELECT COUNT(*) FROM checkpoints c WHERE c.run_id = r.id) "
+            "FROM runs r ORDER BY r.updated DESC LIMIT ?",
+            (limit,)
+        )
+        keys = ("id", "task_description", "status", "current_iteration", "max_iterations", "created", "updated",
+                "checkpoints")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def delete_run(self, run_id):
+        with self._lock, self._connect() as conn, conn:
+            conn.execute("DELETE FROM checkpoints WHERE run_id = ?", (run_id,))
+            conn.execute("DELETE FROM runs WHERE id = ?", (run_id,))
+        if os.path.exists(self.log_path(run_id)):
+            os.remove(self.log_path(run_id))
+
+    def log_path(self, run_id):
+        """运行日志与数据库放在同一目录的run-logs子目录下"""
+        return os.path.join(os.path.dirname(self.path), "run-logs", f"{run_id}.jsonl")
+
+    def export_run(self, run_id):
+        """逐行生成运行的JSONL日志；没有增量日志（如旧运行）时从保存的状态生成"""
+        log = RunLog(self.log_path(run_id))
+        if log.started:
+            return log.lines()
+        state_data, _ = self.load_run(run_id)
+        if state_data is None:
+            raise Exception(f"运行 {run_id} 不存在")
+        return export_lines(OptimizationState.from_dict(state_data))
+
+    def import_run(self, lines, config=None):
+        """导入JSONL日志为新的运行，边解析边写入该运行的日志文件，返回 (运行ID, 状态)"""
+        run_id = uuid.uuid4().hex[:12]
+        log = RunLog(self.log_path(run_id))
+
+        def tee(f):
+            for line in lines:
+                if isinstance(line, bytes):
+                    line = line.decode("utf-8")
+                if line.strip():
+                    f.write(line if line.endswith("\n") else line + "\n")
+                yield line
+
+        try:
+            with open(log.path, "w", encoding="utf-8") as f:
+                state = load_run_log(tee(f))
+        except Exception:
+            os.remove(log.path)
+            raise
+        self.create_run(state, config, run_id=run_id)
+        return run_id, state
+
+    def checkpoint(self, run_id, iteration, stage, value, sample_id=None):
+        """保存一个中间结果；sample_id为None表示整个阶段的结果"""
+        sample_key = _WHOLE_STAGE if sample_id is None else _dumps(sample_id)
+        self._execute(
+            "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?, ?)",
+            (run_id, iteration, stage, sample_key, _dumps(value), time.time())
+        )
+
+    def checkpoints(self, run_id, iteration, stage):
+        """返回 (整个阶段的结果或None, {样本ID: 结果})"""
+        whole = None
+        results = {}
+        for sample_key, value in self._execute(
+            "SELECT sample_key, value FROM checkpoints WHERE run_id = ? AND iteration = ? AND stage = ?",
+            (run_id, iteration, stage)
+        ):
+            if sample_key == _WHOLE_STAGE:
+                whole = json.loads(value)
+            else:
+                results[_decode_key(sample_key)] = json.loads(value)
+        return whole, results
+
+    def run(self, run_id):
+        return Run(self, run_id)
+
+
+class Run:
+    """绑定到单个运行的检查点读写，由OptimizationEngine使用"""
+
+    def __init__(self, store, run_id):
+        self.store = store
+        self.run_id = run_id
+
+    def save(self, iteration, stage, value, sample_id=None):
+        self.store.checkpoint(self.run_id, iteration, stage, value, sample_id)
+
+    def restore(self, iteration, stage):
+        """整个阶段的结果，没有时返回None"""
+        return self.store.checkpoints(self.run_id, iteration, stage)[0]
+
+    def restore_samples(self, iteration, stage):
+        """逐样本的结果 {样本ID: 结果}"""
+        return self.store.checkpoints(self.run_id, iteration, stage)[1]
+
+    @property
+    def log(self):
+        return RunLog(self.store.log_path(self.run_id))
+
+    def save_state(self, state, record=None):
+        """写日志并保存状态：初始化完成时写入运行开始记录，每次迭代后追加一行
+
+        先写日志再更新数据库，两者之间中断时以日志为准。record为None（初始化、预算停止状态变化）时
+        总是重写快照，迭代只在每SNAPSHOT_INTERVAL次和运行结束时重写。
+        """
+        if record is None:
+            self.log.start(state)
+            self.store.save_state(self.run_id, state)
+            return
+        self.log.append(state, record)
+        snapshot = state.finished or state.current_iteration % SNAPSHOT_INTERVAL == 0
+        self.store.save_state(self.run_id, state, snapshot=snapshot)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_run_store(path=None):
+    """进程内按路径共享RunStore，path为空时读取环境变量"""
+    path = os.path.expanduser(path) if path else default_store_path()
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = RunStore(path)
+        return _stores[path]
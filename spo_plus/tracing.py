@@ -0,0 +1,217 @@
+"""阶段级追踪：把事件总线上的事件整理为带起止时间的span，导出为Chrome trace / Perfetto JSON
+
+Tracer订阅事件总线，不需要改动被追踪的代码：
+- stage：引擎阶段（stage_started/stage_finished配对），如 propose、execute、evaluate、analyze、decide
+- step / sample / 其他：EventBus.span() 发布的span，界面的各步骤和渲染为step，引擎逐样本的执行/评估为sample
+- llm：每次API调用（llm_call），附带模型、角色、token数、缓存命中token数和 cache_hit=False
+- cache：命中响应/评估缓存、没有发出API调用的结果（cache_hit），附带 cache_hit=True
+
+span按开始时间归入迭代：初始化为第0次迭代，每个iteration_finished之后进入下一次迭代。
+导出时step/stage为同一线程上的嵌套区间（"X"事件），并发的sample/llm为异步区间（"b"/"e"事件），
+缓存命中为瞬时事件（"i"事件），可以直接在 chrome://tracing 或 https://ui.perfetto.dev 中打开。
+"""
+import bisect
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+
+from .usage import cached_tokens
+
+# 进程内最多保留的span数，超出后丢弃最早的
+MAX_SPANS = 20000
+
+# 导出为同一线程上嵌套区间的类别，其余有起止时间的类别导出为异步区间
+_NESTED_CATEGORIES = ("step", "stage")
+
+
+@dataclass
+class Span:
+    name: str
+    category: str
+    start: float
+    end: float
+    thread: int
+    iteration: int = 0
+    sample_id: object = None
+    attrs: dict = field(default_factory=dict)
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    @property
+    def label(self):
+        if self.category == "llm":
+            return f"{self.name} · {self.attrs.get('model', '')}"
+        if self.category == "cache":
+            return f"{self.name} · 缓存命中（{self.attrs.get('cache', '')}）"
+        if self.sample_id is not None:
+            return f"{self.name} · 样本 {self.sample_id}"
+        return self.name
+
+
+class Tracer:
+    """订阅事件总线并记录span，线程安全"""
+
+    def __init__(self, events=None, max_spans=MAX_SPANS):
+        self.spans = deque(maxlen=max_spans)
+        self._lock = threading.Lock()
+        # 阶段开始时间：(线程, 阶段) -> 开始时间栈
+        self._open = {}
+        self._threads = {}
+        # 迭代分界：(开始时间, 迭代序号)，按时间升序
+        self._boundaries = [(0.0, 0)]
+        # 每次记录span或清空时递增；导出结果按版本缓存，界面rerun时没有新span就不重新序列化
+        self.version = 0
+        self._exports = {}
+        self.events = events
+        if events is not None:
+            events.subscribe(self)
+
+    def begin_iteration(self, iteration, at=None):
+        """此后开始的span归入iteration（续跑或界面逐步执行时由调用方指定）"""
+        with self._lock:
+            self._add_boundary(time.time() if at is None else at, iteration)
+
+    def _add_boundary(self, at, iteration):
+        if self._boundaries and self._boundaries[-1][0] > at:
+            at = self._boundaries[-1][0]
+        self._boundaries.append((at, iteration))
+
+    def _iteration_at(self, start):
+        index = bisect.bisect_right(self._boundaries, (start, float("inf"))) - 1
+        return self._boundaries[max(0, index)][1]
+
+    def __call__(self, event):
+        # 事件总线在发布线程中同步调用订阅者，当前线程就是产生事件的线程
+        thread = threading.get_ident()
+        data = dict(event.data)
+        with self._lock:
+            self._threads.setdefault(thread, threading.current_thread().name)
+            if event.type == "stage_started":
+                self._open.setdefault((thread, event.stage), []).append(event.time)
+            elif event.type == "stage_finished":
+                starts = self._open.get((thread, event.stage))
+                start = starts.pop() if starts else event.time - data.get("elapsed", 0.0)
+                data.pop("elapsed", None)
+                self._add(event.stage, "stage", start, event.time, thread, attrs=data)
+            elif event.type == "span":
+                start = data.pop("start")
+                end = start + data.pop("elapsed")
+                self._add(event.stage, data.pop("category", "span"), start, end, thread, event.sample_id, data)
+            elif event.type == "llm_call":
+                usage = data.pop("usage", None) or {}
+                attrs = {
+                    "model": data.get("model"),
+                    "role": data.get("role"),
+                    "cache_hit": False,
+                    "prompt_tokens": usage.get("prompt_tokens"),
+                    "completion_tokens": usage.get("completion_tokens"),
+                    "cached_tokens": cached_tokens(usage),
+                }
+                for name in ("error", "finish_reason"):
+                    if data.get(name):
+                        attrs[name] = data[name]
+                self._add(data.get("role") or "llm", "llm", event.time - data.get("latency", 0.0), event.time, thread,
+                          attrs=attrs)
+            elif event.type == "cache_hit":
+                self._add(data.get("role") or "cache", "cache", event.time, event.time, thread,
+                          attrs={**data, "cache_hit": True})
+            elif event.type == "iteration_finished":
+                self._add_boundary(event.time, data["iteration"] + 1)
+
+    def _add(self, name, category, start, end, thread, sample_id=None, attrs=None):
+        self.spans.append(Span(name, category, start, end, thread, self._iteration_at(start), sample_id, attrs or {}))
+        self.version += 1
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.spans)
+
+    def iterations(self):
+        return sorted({span.iteration for span in self.snapshot()})
+
+    def iteration_spans(self, iteration):
+        return [span for span in self.snapshot() if span.iteration == iteration]
+
+    def clear(self):
+        with self._lock:
+            self.spans.clear()
+            self._open.clear()
+            self._boundaries = [(0.0, 0)]
+            self.version += 1
+
+    def chrome_trace(self, iteration=None):
+        """Chrome trace格式的字典，iteration为None时导出全部span"""
+        spans = self.snapshot() if iteration is None else self.iteration_spans(iteration)
+        with self._lock:
+            threads = dict(self._threads)
+        return to_chrome_trace(spans, threads)
+
+    def export(self, iteration=None):
+        with self._lock:
+            version = self.version
+            cached = self._exports.get(iteration)
+        if cached and cached[0] == version:
+            return cached[1]
+        text = json.dumps(self.chrome_trace(iteration), ensure_ascii=False)
+        with self._lock:
+            self._exports = {key: value for key, value in self._exports.items() if value[0] == version}
+            self._exports[iteration] = (version, text)
+        return text
+
+    def close(self):
+        if self.events is not None:
+            self.events.unsubscribe(self)
+
+
+def _args(span):
+    args = {"iteration": span.iteration, **{key: value for key, value in span.attrs.items() if value is not None}}
+    if span.sample_id is not None:
+        args["sample_id"] = str(span.sample_id)
+    return args
+
+
+def to_chrome_trace(spans, threads=None):
+    """把span列表转换为Chrome trace事件，时间戳为相对最早span的微秒数"""
+    origin = min((span.start for span in spans), default=0.0)
+    ids = itertools.count(1)
+    events = []
+    for span in sorted(spans, key=lambda span: (span.start, -span.end)):
+        common = {
+            "name": span.label,
+            "cat": span.category,
+            "ts": (span.start - origin) * 1e6,
+            "pid": 1,
+            "tid": span.thread,
+        }
+        if span.category == "cache":
+            events.append({**common, "ph": "i", "s": "t", "args": _args(span)})
+        elif span.category in _NESTED_CATEGORIES:
+            events.append({**common, "ph": "X", "dur": span.duration * 1e6, "args": _args(span)})
+        else:
+            span_id = next(ids)
+            events.append({**common, "ph": "b", "id": span_id, "args": _args(span)})
+            events.append({**common, "ph": "e", "id": span_id, "ts": (span.end - origin) * 1e6})
+    for thread, name in (threads or {}).items():
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": thread, "args": {"name": name}})
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def waterfall_rows(spans):
+    """瀑布图的行：按开始时间排序，时间为相对本组最早span的秒数"""
+    origin = min((span.start for span in spans), default=0.0)
+    rows = []
+    for index, span in enumerate(sorted(spans, key=lambda span: (span.start, -span.end))):
+        rows.append({
+            "row": f"{index + 1:03d} {span.label}",
+            "category": span.category,
+            "start": span.start - origin,
+            "end": max(span.end, span.start + 0.001) - origin,
+            "duration": round(span.duration, 3),
+            "details": ", ".join(f"{key}={value}" for key, value in _args(span).items() if key != "iteration"),
+        })
+    return rows
@@ -0,0 +1,174 @@
+"""HTTP连接池：为LLMService提供长连接复用与握手统计
+
+Streamlit每次rerun都会重新执行app.py，因此连接池必须放在独立模块中，
+借助模块级注册表在rerun和多个会话之间共享。
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+def _parse_host_sizes(value):
+    """解析形如 "api.siliconflow.cn=32,api.openai.com=8" 的配置"""
+    sizes = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        host, size = item.split("=", 1)
+        if host.strip() and size.strip().isdigit():
+            sizes[host.strip()] = int(size.strip())
+    return sizes
+
+
+@dataclass(frozen=True)
+class PoolConfig:
+    """连接池配置"""
+    pool_connections: int = 4          # 缓存的主机连接池数量
+    pool_maxsize: int = 16             # 每个主机默认保持的最大连接数
+    pool_block: bool = False           # 连接耗尽时是否阻塞等待
+    host_maxsize: tuple = ()           # 按主机覆盖的连接数 ((host, size), ...)
+    connect_timeout: float = 10.0
+    read_timeout: float = 300.0
+    gzip: bool = True
+    keep_alive: bool = True
+
+    @classmethod
+    def from_env(cls):
+        """从环境变量读取配置"""
+        return cls(
+            pool_connections=int(os.getenv("LLM_POOL_CONNECTIONS", cls.pool_connections)),
+            pool_maxsize=int(os.getenv("LLM_POOL_MAXSIZE", cls.pool_maxsize)),
+            pool_block=os.getenv("LLM_POOL_BLOCK", "false").lower() == "true",
+            host_maxsize=tuple(sorted(_parse_host_sizes(os.getenv("LLM_POOL_HOST_MAXSIZE")).items())),
+            connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", cls.connect_timeout)),
+            read_timeout=float(os.getenv("LLM_READ_TIMEOUT", cls.read_timeout)),
+            gzip=os.getenv("LLM_HTTP_GZIP", "true").lower() == "true",
+            keep_alive=os.getenv("LLM_HTTP_KEEP_ALIVE", "true").lower() == "true",
+        )
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    def maxsize_for(self, host):
+        return dict(self.host_maxsize).get(host, self.pool_maxsize)
+
+
+@dataclass
+class TransportStats:
+    """连接池统计：请求数、新建连接数（未命中）与握手耗时"""
+    requests: int = 0
+    new_connections: int = 0
+    connect_time: float = 0.0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record_request(self):
+        with self._lock:
+            self.requests += 1
+
+    def record_connect(self, elapsed):
+        with self._lock:
+            self.new_connections += 1
+            self.connect_time += elapsed
+
+    def snapshot(self):
+        with self._lock:
+            hits = max(self.requests - self.new_connections, 0)
+            return {
+                "requests": self.requests,
+                "pool_hits": hits,
+                "pool_misses": self.new_connections,
+                "hit_rate": hits / self.requests if self.requests else 0.0,
+                "connect_time_total": self.connect_time,
+                "connect_time_avg": self.connect_time / self.new_connections if self.new_connections else 0.0,
+                # 按平均握手耗时估算复用连接节省的时间
+                "connect_time_saved": hits * self.connect_time / self.new_connections if self.new_connections else 0.0,
+            }
+
+
+def _timed_connection(conn_cls, stats):
+    """包装连接类，统计每次TCP+TLS建连耗时"""
+    class TimedConnection(conn_cls):
+        def connect(self):
+            start = time.perf_counter()
+            try:
+                super().connect()
+            finally:
+                stats.record_connect(time.perf_counter() - start)
+
+    return TimedConnection
+
+
+class PooledAdapter(HTTPAdapter):
+    """带握手统计的HTTPAdapter"""
+
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": type("TimedHTTPConnectionPool", (HTTPConnectionPool,), {
+                "ConnectionCls": _timed_connection(HTTPConnection, self.stats)
+            }),
+            "https": type("TimedHTTPSConnectionPool", (HTTPSConnectionPool,), {
+                "ConnectionCls": _timed_connection(HTTPSConnection, self.stats)
+            }),
+        }
+
+    def send(self, request, **kwargs):
+        self.stats.record_request()
+        return super().send(request, **kwargs)
+
+
+class PooledSession(requests.Session):
+    """持有连接池统计的Session"""
+
+    def __init__(self, host, config):
+        super().__init__()
+        self.stats = TransportStats()
+        self.config = config
+        adapter = PooledAdapter(
+            self.stats,
+            pool_connections=config.pool_connections,
+            pool_maxsize=config.maxsize_for(host),
+            pool_block=config.pool_block,
+            max_retries=0,
+        )
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self.headers["Accept-Encoding"] = "gzip, deflate" if config.gzip else "identity"
+        self.headers["Connection"] = "keep-alive" if config.keep_alive else "close"
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(base_url, config=None):
+    """获取（或创建）与base_url主机对应的共享Session"""
+    config = config or PoolConfig.from_env()
+    parsed = urlparse(base_url)
+    key = (parsed.scheme, parsed.netloc, config)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = PooledSession(parsed.hostname or "", config)
+            _sessions[key] = session
+        return session
+
+
+def close_all_sessions():
+    """关闭所有共享Session（用于进程退出或测试清理）"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
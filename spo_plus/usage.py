@@ -0,0 +1,179 @@
+"""token用量与费用统计，以及运行的token/费用预算
+
+服务每次API调用结束都会发布llm_call事件，附带响应中的usage。UsageMeter订阅事件总线，
+按角色累计调用次数、prompt/completion/缓存命中token数、耗时和费用；引擎在每次迭代
+结束时取走这段时间的用量写入历史记录，并累加到运行状态的总用量中。
+
+用量字典可以直接序列化为JSON，结构为：
+    {"calls", "errors", "unreported", "prompt_tokens", "completion_tokens", "cached_tokens", "latency", "cost",
+     "by_role": {角色: {同上的计数字段, "model"}}}
+unreported为响应中没有usage的调用次数（如服务端不支持stream_options的流式调用），
+这些调用的token由服务按字符数估计（usage中带estimated），照常计入token数和费用。
+"""
+import os
+import threading
+from dataclasses import dataclass
+
+# 累加的计数字段
+USAGE_FIELDS = ("calls", "errors", "unreported", "prompt_tokens", "completion_tokens", "cached_tokens", "latency",
+                "cost")
+
+# 默认价格（元/百万tokens：输入, 输出, 缓存命中的输入），以实际账单为准，可用LLM_PRICES覆盖
+DEFAULT_PRICES = {
+    "deepseek-ai/DeepSeek-V3": (2.0, 8.0, 2.0),
+    "deepseek-ai/DeepSeek-R1": (4.0, 16.0, 4.0),
+    "Pro/deepseek-ai/DeepSeek-V3": (2.0, 8.0, 2.0),
+    "Pro/deepseek-ai/DeepSeek-R1": (4.0, 16.0, 4.0),
+}
+
+
+def _parse_prices(value):
+    """解析形如 "deepseek-ai/DeepSeek-V3=2:8:0.5,gpt-4o=17.5:70" 的配置，第三项缓存价格可省略"""
+    prices = {}
+    for item in (value or "").split(","):
+        if "=" not in item:
+            continue
+        model, price = item.rsplit("=", 1)
+        parts = price.split(":")
+        try:
+            numbers = [float(part) for part in parts if part.strip()]
+        except ValueError:
+            continue
+        if model.strip() and len(numbers) >= 2:
+            prices[model.strip()] = (numbers[0], numbers[1], numbers[2] if len(numbers) > 2 else numbers[0])
+    return prices
+
+
+def load_prices():
+    return {**DEFAULT_PRICES, **_parse_prices(os.getenv("LLM_PRICES"))}
+
+
+def empty_usage():
+    usage = {name: 0 for name in USAGE_FIELDS}
+    usage["by_role"] = {}
+    return usage
+
+
+def cached_tokens(usage):
+    """缓存命中的prompt token数，兼容 prompt_tokens_details.cached_tokens 和 prompt_cache_hit_tokens 两种字段"""
+    details = usage.get("prompt_tokens_details") or {}
+    return details.get("cached_tokens") or usage.get("prompt_cache_hit_tokens") or 0
+
+
+def call_cost(usage, price):
+    """单次调用的费用，price为 (输入, 输出, 缓存命中的输入) 每百万token的价格"""
+    cached = cached_tokens(usage)
+    prompt = usage.get("prompt_tokens") or 0
+    completion = usage.get("completion_tokens") or 0
+    return ((prompt - cached) * price[0] + completion * price[1] + cached * price[2]) / 1_000_000
+
+
+def add_usage(total, usage):
+    """返回两份用量相加后的新字典，任一方可以为空"""
+    result = empty_usage()
+    for source in (total or {}, usage or {}):
+        for name in USAGE_FIELDS:
+            result[name] += source.get(name, 0)
+        for role, item in source.get("by_role", {}).items():
+            entry = result["by_role"].setdefault(role, {name: 0 for name in USAGE_FIELDS})
+            for name in USAGE_FIELDS:
+                entry[name] += item.get(name, 0)
+            if item.get("model"):
+                entry["model"] = item["model"]
+    return result
+
+
+def total_tokens(usage):
+    return (usage or {}).get("prompt_tokens", 0) + (usage or {}).get("completion_tokens", 0)
+
+
+def format_usage(usage):
+    """一行摘要，用于界面和命令行"""
+    usage = usage or {}
+    text = f"{usage.get('calls', 0)} 次调用 · {total_tokens(usage)} tokens"
+    if usage.get("cached_tokens"):
+        text += f"（缓存命中 {usage['cached_tokens']}）"
+    if usage.get("cost"):
+        text += f" · ¥{usage['cost']:.4f}"
+    return text
+
+
+class UsageMeter:
+    """订阅事件总线，累计每次API调用的用量；take() 取走并清零上次取走之后的用量"""
+
+    def __init__(self, events=None, prices=None):
+        self.prices = load_prices() if prices is None else prices
+        self._lock = threading.Lock()
+        self._pending = empty_usage()
+        self.events = events
+        if events is not None:
+            events.subscribe(self)
+
+    def __call__(self, event):
+        if event.type == "llm_call":
+            self.record(event.data.get("role"), event.data.get("model"), event.data.get("usage"),
+                        event.data.get("latency", 0.0), error=event.data.get("error"))
+
+    def record(self, role, model, usage=None, latency=0.0, error=None):
+        """记录一次调用；失败或没有usage时只计次数和耗时，估计的用量计入token数并记为unreported"""
+        call = {name: 0 for name in USAGE_FIELDS}
+        call.update(calls=1, latency=latency, model=model)
+        if error:
+            call["errors"] = 1
+        elif not usage:
+            call["unreported"] = 1
+        else:
+            if usage.get("estimated"):
+                call["unreported"] = 1
+            call["prompt_tokens"] = usage.get("prompt_tokens") or 0
+            call["completion_tokens"] = usage.get("completion_tokens") or 0
+            call["cached_tokens"] = cached_tokens(usage)
+            price = self.prices.get(model)
+            if price:
+                call["cost"] = call_cost(usage, price)
+        single = {name: call[name] for name in USAGE_FIELDS}
+        single["by_role"] = {role or "other": call}
+        with self._lock:
+            self._pending = add_usage(self._pending, single)
+
+    def peek(self):
+        with self._lock:
+            return add_usage(self._pending, None)
+
+    def take(self):
+        with self._lock:
+            usage, self._pending = self._pending, empty_usage()
+        return usage
+
+    def close(self):
+        if self.events is not None:
+            self.events.unsubscribe(self)
+
+
+@dataclass(frozen=True)
+class Budget:
+    """运行的token/费用上限，0表示不限制"""
+    max_tokens: int = 0
+    max_cost: float = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            max_tokens=int(os.getenv("LLM_MAX_TOKENS", cls.max_tokens)),
+            max_cost=float(os.getenv("LLM_MAX_COST", cls.max_cost)),
+        )
+
+    def __bool__(self):
+        return bool(self.max_tokens or self.max_cost)
+
+    def check(self, spent, estimate=None):
+        """已用量加上下一次迭代的预计用量超出上限时返回原因，否则返回None"""
+        tokens = total_tokens(spent) + total_tokens(estimate)
+        if self.max_tokens and tokens > self.max_tokens:
+            return (f"token预算不足：已用 {total_tokens(spent)}，下一次迭代预计 {total_tokens(estimate)}，"
+                    f"上限 {self.max_tokens}")
+        cost = (spent or {}).get("cost", 0) + (estimate or {}).get("cost", 0)
+        if self.max_cost and cost > self.max_cost:
+            return (f"费用预算不足：已用 ¥{(spent or {}).get('cost', 0):.4f}，"
+                    f"下一次迭代预计 ¥{(estimate or {}).get('cost', 0):.4f}，上限 ¥{self.max_cost:.4f}")
+        return None
@@ -0,0 +1,210 @@
+"""后台优化：在独立线程中持有引擎执行迭代，与Streamlit的脚本运行解耦
+
+自动模式原来在脚本中执行一次迭代后 st.rerun()，优化绑定在浏览器会话上，迭代期间界面无法操作，
+关闭标签页后优化随之停止。RunWorker在后台线程中依次初始化、检查预算、执行迭代，
+每个子阶段和每次迭代都经引擎的检查点写入运行存储，标签页关闭后继续运行；进程退出后可以从检查点续跑。
+
+界面通过 snapshot() 轮询：最新的运行状态、当前阶段和完成的样本数、流式执行中各样本已输出的文本
+（工作线程只保存增量，轮询时才拼接）。
+控制在迭代之间生效，正在进行的迭代会先完成：
+- pause()：暂停，step_mode为True时每次迭代完成后自动暂停（对应界面的手动模式）
+- resume()：继续
+- stop()：结束线程，运行之后仍可以继续
+
+工作线程按运行ID登记在进程级注册表中，多个标签页打开同一个运行时看到并控制的是同一个工作线程。
+工作线程持有引擎，结束时关闭引擎的用量计量，引擎不应与界面共用UsageMeter。
+"""
+import threading
+import time
+
+from .render import join_deltas
+from .usage import add_usage
+
+# 状态：running → pausing → paused → running ...；stopping → stopped；finished；failed
+ACTIVE_STATUSES = ("running", "pausing", "paused", "stopping")
+
+
+class RunWorker:
+    """在后台线程中运行一次优化，线程安全"""
+
+    def __init__(self, run_id, engine, state, step_mode=False, stream=False, tracer=None):
+        self.run_id = run_id
+        self.engine = engine
+        self.step_mode = step_mode
+        # 流式执行时在快照中提供各样本已输出的文本
+        self.stream = stream
+        self.tracer = tracer
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._state = state
+        self._status = "running"
+        self._pause = False
+        self._stop = False
+        self._error = None
+        self._errors = {}
+        self._progress = {"stage": None, "total": 0, "done": 0}
+        self._partial = {}
+        self.started = time.time()
+        self.updated = self.started
+        # 每次状态或进度变化时递增，界面可以据此判断是否需要重绘
+        self.version = 0
+        self._thread = threading.Thread(target=self._run, name=f"spo-run-{run_id}", daemon=True)
+
+    def start(self):
+        self.engine.events.subscribe(self)
+        self._thread.start()
+        return self
+
+    @property
+    def status(self):
+        with self._lock:
+            return self._status
+
+    @property
+    def active(self):
+        return self.status in ACTIVE_STATUSES
+
+    def pause(self):
+        """当前迭代完成后暂停"""
+        with self._lock:
+            if self._status == "running":
+                self._pause = True
+                self._set_status("pausing")
+
+    def resume(self):
+        with self._lock:
+            self._pause = False
+            if self._status in ("pausing", "paused"):
+                self._set_status("running")
+            self._wake.notify_all()
+
+    def stop(self):
+        """当前迭代完成后结束，暂停中的工作线程立即结束"""
+        with self._lock:
+            if self._status in ACTIVE_STATUSES:
+                self._stop = True
+                self._set_status("stopping")
+                self._wake.notify_all()
+
+    def join(self, timeout=None):
+        self._thread.join(timeout)
+
+    def snapshot(self):
+        """界面轮询的当前状态：state为OptimizationState，usage包含当前迭代中已发生的调用"""
+        with self._lock:
+            return {
+                "run_id": self.run_id,
+                "status": self._status,
+                "state": self._state,
+                "usage": add_usage(self._state.usage, self.engine.usage.peek()),
+                "progress": dict(self._progress),
+                "partial": {sample_id: join_deltas(parts) for sample_id, parts in self._partial.items()},
+                "error": self._error,
+                "errors": dict(self._errors),
+                "updated": self.updated,
+                "version": self.version,
+            }
+
+    def _set_status(self, status):
+        # 调用方持有锁
+        self._status = status
+        self._touch()
+
+    def _touch(self):
+        self.updated = time.time()
+        self.version += 1
+
+    def __call__(self, event):
+        """订阅引擎的事件总线，记录当前阶段和完成的样本数"""
+        with self._lock:
+            if event.type == "stage_started":
+                self._progress = {"stage": event.stage, "total": event.data.get("total", 0), "done": 0}
+            elif event.type == "sample_done" and event.stage == self._progress["stage"]:
+                self._progress["done"] += 1
+            else:
+                return
+            self._touch()
+
+    def _on_delta(self, sample_id, delta):
+        with self._lock:
+            self._partial.setdefault(sample_id, []).append(delta)
+            self._touch()
+
+    def _publish(self, state):
+        with self._lock:
+            self._state = state
+            self._partial = {}
+            self._progress = {"stage": None, "total": 0, "done": 0}
+            self._touch()
+
+    def _wait_if_paused(self):
+        """暂停时阻塞到继续或停止，返回是否应继续运行"""
+        with self._lock:
+            if self._pause and not self._stop:
+                self._set_status("paused")
+            while self._pause and not self._stop:
+                self._wake.wait()
+            return not self._stop
+
+    def _run(self):
+        engine = self.engine
+        state = self._state
+        try:
+            # 续跑时初始化已完成则直接进入迭代
+            if not state.current_best_outputs:
+                state, errors = engine.initialize(state)
+                with self._lock:
+                    self._errors = errors
+                self._publish(state)
+            while True:
+                state = engine.check_budget(state)
+                self._publish(state)
+                if state.finished:
+                    with self._lock:
+                        self._set_status("finished")
+                    return
+                if not self._wait_if_paused():
+                    with self._lock:
+                        self._set_status("stopped")
+                    return
+                if self.tracer:
+                    self.tracer.begin_iteration(state.current_iteration + 1)
+                state, _ = engine.step(state, on_delta=self._on_delta if self.stream else None)
+                self._publish(state)
+                if self.step_mode:
+                    with self._lock:
+                        if not self._stop:
+                            self._pause = True
+        except Exception as e:
+            with self._lock:
+                self._error = str(e)
+                self._set_status("failed")
+        finally:
+            engine.events.unsubscribe(self)
+            engine.usage.close()
+
+
+_workers = {}
+_workers_lock = threading.Lock()
+
+
+def get_worker(run_id):
+    """运行对应的工作线程（包括已结束的），没有时返回None"""
+    with _workers_lock:
+        return _workers.get(run_id)
+
+
+def start_worker(run_id, engine, state, **options):
+    """为运行启动工作线程；同一运行已有活动的工作线程时直接返回它，不重复启动"""
+    with _workers_lock:
+        worker = _workers.get(run_id)
+        if worker is not None and worker.active:
+            return worker
+        worker = RunWorker(run_id, engine, state, **options)
+        _workers[run_id] = worker
+    return worker.start()
+
+
+def active_workers():
+    with _workers_lock:
+        return {run_id: worker for run_id, worker in _workers.items() if worker.active}